@@ -40,3 +40,5 @@ def get_version():
     return ''.join(vers)
 
 __version__ = get_version()
+
+default_app_config = 'xgds_planner2.apps.XgdsPlanner2Config'
@@ -0,0 +1,37 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class XgdsPlanner2Config(AppConfig):
+    name = 'xgds_planner2'
+    verbose_name = 'xGDS Planner'
+
+    def ready(self):
+        from xgds_planner2 import jsonCodec
+        jsonCodec.setCodec(settings.XGDS_PLANNER_JSON_CODEC)
+        from xgds_planner2 import planIndex
+        planIndex.connectSignals()
+        from xgds_planner2 import spatialIndex
+        spatialIndex.connectSignals()
+        from xgds_planner2 import exportCache
+        exportCache.connectSignals()
+
+        if settings.XGDS_PLANNER_PRELOAD_SCHEMAS:
+            from xgds_planner2 import models
+            models.PLAN_SCHEMA_REGISTRY.preload()
@@ -21,26 +21,48 @@ Command-line utility for performing common operations on XPJSON documents.
 
 import traceback
 import os
+import sys
+import glob
+import zipfile
 
 from xgds_planner2 import xpjson, choosePlanImporter
 
 
+def loadSchema(schemaPath):
+    # compileXpjson writes a snapshot next to each simplified schema;
+    # use it if it is current, it is much faster than parsing the JSON.
+    docs = xpjson.loadSnapshotFromPath(xpjson.getSnapshotPath(schemaPath))
+    if docs:
+        return docs['schema']
+    return xpjson.loadDocument(schemaPath)
+
+
 def main():
     import optparse
     parser = optparse.OptionParser('''usage: %prog [opts] <cmd> ...
 
- %prog validate <doc.json>
-   Validate XPJSON document
+ %prog validate <doc.json | dir> ...
+   Validate XPJSON documents, and the .json files under any directories,
+   in parallel. Writes one JSON line per document to stdout and a
+   summary to stderr; exits with status 1 if any document is invalid.
 
  %prog simplify <doc.json> <out.json>
    Simplify XPJSON document (compile out inheritance, fill defaults)
 
  %prog import <doc.kml>
-   Import a plan into the database. Supported formats: only KML for now.
+   Import a plan into the database. Supported formats: those in
+   XGDS_PLANNER_PLAN_IMPORTERS (KML, CSV and XPJSON by default).
+
+ %prog import <dir | plans.zip | 'plans/*.kml'>
+   Import every plan file in a directory, zip file or glob pattern,
+   parsing in parallel worker processes (see bulkImport.py).
 
     ''')
     parser.add_option('-s', '--schema',
                       help='Schema to use when processing Plan or PlanLibrary')
+    parser.add_option('--processes',
+                      type='int',
+                      help='Worker processes for validate and batch import (default one per CPU)')
     importOpts = optparse.OptionGroup(parser, 'Import-specific options')
     importOpts.add_option('--formatCode',
                           help='Specify importer class by format code (default is to infer based on extension)')
@@ -51,6 +73,11 @@ def main():
                           help='Specify plan number [required]')
     importOpts.add_option('--planVersion',
                           help='Specify plan version [required]')
+    importOpts.add_option('--platform',
+                          help='Specify the platform whose schema the plans use')
+    importOpts.add_option('--batchSize',
+                          type='int',
+                          help='Plans written per transaction in batch import')
     parser.add_option_group(importOpts)
 
     opts, args = parser.parse_args()
@@ -60,7 +87,7 @@ def main():
     cmd = args[0]
 
     if opts.schema is not None:
-        schema = xpjson.loadDocument(opts.schema)
+        schema = loadSchema(opts.schema)
         if schema.type != 'PlanSchema':
             parser.error('--schema must be the path to a XPJSON PlanSchema document')
     else:
@@ -68,20 +95,26 @@ def main():
 
     ######################################################################
     if cmd == 'validate':
-        if len(args) != 2:
-            parser.error('validate requires exactly 1 argument')
-        docPath = args[1]
-
-        try:
-            doc = xpjson.loadDocument(docPath, schema)
-            print 'VALID %s %s' % (doc.get('type'), docPath)
-        except xpjson.NoSchemaError, t:
-            parser.error('you must specify the --schema argument to validate a document of type %s'
-                         % t)
-        except:
-            traceback.print_exc()
-            print
-            print 'INVALID %s' % docPath
+        if len(args) < 2:
+            parser.error('validate requires at least 1 argument')
+        from xgds_planner2 import bulkValidate
+
+        docPaths = bulkValidate.collectDocumentPaths(args[1:])
+        summary = bulkValidate.ValidationSummary()
+        for result in bulkValidate.iterValidateDocuments(docPaths, schema, opts.processes):
+            if result.get('needsSchema'):
+                parser.error('you must specify the --schema argument to validate a document of type %s'
+                             % result['type'])
+            summary.add(result)
+            print bulkValidate.dumpResult(result)
+            sys.stdout.flush()
+        stats = summary.toDict()
+        print >> sys.stderr, ('validated %d documents in %.1fs (%.1f plans/s): %d valid, %d invalid'
+                              % (stats['documents'], stats['elapsedSeconds'],
+                                 stats['documentsPerSecond'] or 0,
+                                 stats['valid'], stats['invalid']))
+        if stats['invalid']:
+            sys.exit(1)
 
     ######################################################################
     elif cmd == 'simplify':
@@ -113,20 +146,51 @@ def main():
                 and opts.planVersion):
             parser.error('import requires: --creator, --planNumber, --planVersion')
 
-        name = os.path.basename(importPath)
-        name = os.path.splitext(name)[0]
         meta = {
             'creator': opts.creator,
             'planNumber': opts.planNumber,
             'planVersion': opts.planVersion,
         }
 
-        importerClass = choosePlanImporter.chooseImporter(name, formatCode=opts.formatCode)
-        dbPlan = importerClass.importPlan(name,
-                                          buf=open(importPath, 'r').read(),
-                                          meta=meta,
-                                          path=importPath)
-        dbPlan.save()
+        if (os.path.isdir(importPath)
+                or glob.has_magic(importPath)
+                or zipfile.is_zipfile(importPath)):
+            from xgds_planner2 import bulkImport
+
+            def progress(report, fileName, error):
+                print report.getProgressLine(fileName, error)
+
+            try:
+                report = bulkImport.importPlans(importPath, meta,
+                                                platform=opts.platform,
+                                                formatCode=opts.formatCode,
+                                                processes=opts.processes,
+                                                batchSize=opts.batchSize,
+                                                progress=progress)
+            except bulkImport.BulkImportError, e:
+                parser.error(str(e))
+            summary = report.toDict()
+            print 'imported %d of %d files in %.1fs' % (summary['imported'],
+                                                       summary['files'],
+                                                       summary['elapsedSeconds'])
+            for entry in report.getErrors():
+                print 'ERROR %(fileName)s: %(error)s' % entry
+        else:
+            name = os.path.basename(importPath)
+            name = os.path.splitext(name)[0]
+
+            # match the file name including its extension
+            importerClass = choosePlanImporter.chooseImporter(importPath, formatCode=opts.formatCode)
+            planSchema = None
+            if opts.platform:
+                from xgds_planner2.models import getPlanSchema
+                planSchema = getPlanSchema(opts.platform)
+            dbPlan = importerClass.importPlan(name,
+                                              buf=open(importPath, 'r').read(),
+                                              meta=meta,
+                                              planSchema=planSchema,
+                                              path=importPath)
+            dbPlan.save()
 
     ######################################################################
     else:
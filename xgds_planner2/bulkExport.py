@@ -0,0 +1,234 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Bulk export: render many plans in several formats at once, into a
+directory or a zip file, using a pool of worker processes.
+
+Each worker loads the plan schemas once when it starts and then
+exports whole plans (every requested format of one plan per task), so
+a plan's jsonPlan is read once however many formats are asked for.
+Used by 'manage.py exportPlans' and the bulkExport.zip endpoint. The
+endpoint exports in the serving process instead (processes=0): forking
+a web server is not safe with the export pipeline's threads running,
+and a client should not be able to start a process per CPU. It is
+limited to XGDS_PLANNER_BULK_EXPORT_MAX_PLANS plans.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+import zipfile
+
+from django.db import connections
+
+from xgds_planner2 import choosePlanExporter, models
+from xgds_planner2.planExporter import writeChunksToPath
+
+
+class BulkExportError(ValueError):
+    pass
+
+
+def getExporterInfos(extensions):
+    """
+    Return the ExporterInfo for each of *extensions*, e.g. ['.kml',
+    '.pml'], raising BulkExportError for unknown ones.
+    """
+    result = []
+    for extension in extensions:
+        info = choosePlanExporter.PLAN_EXPORTERS_BY_EXTENSION.get(extension)
+        if info is None:
+            raise BulkExportError('unknown export extension %r, expected one of %s'
+                                  % (extension,
+                                     ', '.join(sorted(choosePlanExporter.PLAN_EXPORTERS_BY_EXTENSION))))
+        result.append(info)
+    return result
+
+
+def getPlanFileName(dbPlan, extension):
+    # the pk keeps plans with the same name apart
+    return '%s_%s%s' % (dbPlan.escapedName(), dbPlan.pk, extension)
+
+
+def initWorker():
+    # the forked worker must not share the parent's database connections
+    connections.close_all()
+    models.PLAN_SCHEMA_REGISTRY.preload()
+
+
+def exportPlan(args):
+    """
+    Export one plan in every requested format. Runs in a worker.
+    Return (pk, results), with a dict per format holding extension,
+    fileName, seconds, error and, unless writing to a directory, text.
+    """
+    from xgds_planner2.planIndex import PLAN_MODEL  # delayed import avoids import loop
+    pk, extensions, outputDirectory, request = args
+    try:
+        dbPlan = PLAN_MODEL.get().objects.withJson('jsonPlan').get(pk=pk)
+    except PLAN_MODEL.get().DoesNotExist:
+        return pk, [{'extension': extension,
+                     'fileName': None,
+                     'error': 'plan %s does not exist' % pk,
+                     'text': None,
+                     'seconds': 0.0}
+                    for extension in extensions]
+    results = []
+    for info in getExporterInfos(extensions):
+        result = {'extension': info.extension,
+                  'fileName': getPlanFileName(dbPlan, info.extension),
+                  'error': None,
+                  'text': None}
+        start = time.time()
+        try:
+            chunks = info.exporterClass().iterExportDbPlan(dbPlan, request)
+            if outputDirectory:
+                writeChunksToPath(chunks, os.path.join(outputDirectory, result['fileName']))
+            else:
+                result['text'] = ''.join(chunks)
+        except Exception, e:  # pylint: disable=W0703
+            result['error'] = '%s: %s' % (e.__class__.__name__, e)
+        result['seconds'] = time.time() - start
+        results.append(result)
+    return pk, results
+
+
+class BulkExportReport(object):
+    """
+    Per-format counts, errors and timings of a bulk export.
+    """
+
+    def __init__(self, extensions, numPlans):
+        self.numPlans = numPlans
+        self.numDone = 0
+        self.formats = dict(((extension, {'exported': 0, 'failed': 0, 'seconds': 0.0})
+                             for extension in extensions))
+        self.errors = []
+        self.startTime = time.time()
+
+    def add(self, pk, results):
+        self.numDone += 1
+        for result in results:
+            entry = self.formats[result['extension']]
+            entry['seconds'] += result['seconds']
+            if result['error']:
+                entry['failed'] += 1
+                self.errors.append({'plan': pk,
+                                    'fileName': result['fileName'],
+                                    'error': result['error']})
+            else:
+                entry['exported'] += 1
+
+    def getProgressLine(self, pk, results):
+        return '[%d/%d] plan %s: %s' % (self.numDone, self.numPlans, pk,
+                                        ' '.join(['%s %.2fs%s' % (r['extension'],
+                                                                  r['seconds'],
+                                                                  ' FAILED' if r['error'] else '')
+                                                  for r in results]))
+
+    def toDict(self):
+        formats = {}
+        for extension, entry in self.formats.iteritems():
+            count = entry['exported'] + entry['failed']
+            formats[extension] = dict(entry,
+                                      meanSeconds=entry['seconds'] / count if count else None)
+        return {'plans': self.numPlans,
+                'done': self.numDone,
+                'elapsedSeconds': time.time() - self.startTime,
+                'formats': formats,
+                'errors': self.errors}
+
+
+def iterExportPlans(planIds, extensions, outputDirectory=None, request=None, processes=None):
+    """
+    Export the plans with primary keys *planIds* in the formats given by
+    *extensions*, yielding (pk, results) as each plan finishes (see
+    exportPlan()). *request*, if given, must be picklable, e.g. an
+    exportPipeline.DetachedRequest. *processes* defaults to the number
+    of CPUs; 0 exports the plans one by one in this process.
+    """
+    getExporterInfos(extensions)  # fail early on unknown extensions
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    tasks = [(pk, list(extensions), outputDirectory, request) for pk in planIds]
+    if processes == 0:
+        for task in tasks:
+            yield exportPlan(task)
+        return
+    # don't hand our open connections to the forked workers
+    connections.close_all()
+    pool = multiprocessing.Pool(processes, initWorker)
+    try:
+        for result in pool.imap_unordered(exportPlan, tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class ZipStream(object):
+    """
+    Write-only file for zipfile.ZipFile that hands back what has been
+    written so far from drain(), so a zip can be streamed as it is built.
+    """
+
+    def __init__(self):
+        self.pieces = []
+        self.position = 0
+
+    def write(self, data):
+        self.pieces.append(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        result = ''.join(self.pieces)
+        self.pieces = []
+        return result
+
+
+def iterZipExport(planIds, extensions, request=None, processes=None, progress=None):
+    """
+    Yield the bytes of a zip file holding the exports of *planIds*, one
+    plan at a time, ending with report.json (see BulkExportReport).
+    *progress*, if given, is called with (report, pk, results) as each
+    plan finishes.
+    """
+    report = BulkExportReport(extensions, len(planIds))
+    stream = ZipStream()
+    archive = zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED)
+    for pk, results in iterExportPlans(planIds, extensions, None, request, processes):
+        report.add(pk, results)
+        if progress is not None:
+            progress(report, pk, results)
+        for result in results:
+            text = result['text']
+            if text is not None:
+                if isinstance(text, unicode):
+                    text = text.encode('utf-8')
+                archive.writestr(result['fileName'], text)
+        yield stream.drain()
+    archive.writestr('report.json', json.dumps(report.toDict(), indent=4, sort_keys=True))
+    archive.close()
+    yield stream.drain()
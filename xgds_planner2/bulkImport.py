@@ -0,0 +1,343 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Bulk import: load many plan files (any format in
+XGDS_PLANNER_PLAN_IMPORTERS) from a directory, a zip file or a glob
+pattern at once.
+
+A pool of worker processes reads, parses and validates the files and
+computes their stats, i.e. PlanImporter.importPlan() without the save.
+The parent writes the resulting rows with bulk_create,
+XGDS_PLANNER_BULK_IMPORT_BATCH_SIZE plans per transaction, while the
+workers go on parsing. If the database rejects a batch, its plans are
+saved one at a time so only the offending files fail.
+
+Each plan is named after its id, as planImport names a single
+imported plan. bulk_create sends no post_save signals, so the plan
+index and the spatial index are updated here instead. Unlike
+planImport, bulk imports do not run the save callbacks
+(XGDS_PLANNER_CALLBACK), so the plans are not relayed to other servers
+either.
+
+Used by 'manage.py importPlans', 'xp.py import' and zip uploads to
+planImport. Zip uploads parse in the serving process instead
+(processes=0): forking a web server is not safe with the export
+pipeline's threads running, and a client should not be able to start a
+process per CPU. They are limited to XGDS_PLANNER_BULK_IMPORT_MAX_FILES
+files.
+"""
+
+import copy
+import glob
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+
+from django.conf import settings
+from django.db import connections, transaction, DatabaseError
+
+from geocamUtil.dotDict import convertToDotDictRecurse
+
+from xgds_planner2 import choosePlanImporter, models, planImporter
+
+
+class BulkImportError(ValueError):
+    pass
+
+
+def collectImportFiles(source, formatCode=None):
+    """
+    Return (fileName, path, member) for each file to import from
+    *source*: a directory (searched recursively), a zip file or a glob
+    pattern. *member* is the name of the file within the zip, else
+    None. Unless *formatCode* picks the importer, files with no
+    importer for their extension are left out.
+    """
+    if os.path.isdir(source):
+        items = []
+        for dirPath, _dirNames, fileNames in os.walk(source):
+            for fileName in fileNames:
+                path = os.path.join(dirPath, fileName)
+                items.append((os.path.relpath(path, source), path, None))
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            items = [(info.filename, source, info.filename)
+                     for info in archive.infolist()
+                     if not info.filename.endswith('/')]
+    else:
+        items = [(path, path, None) for path in glob.glob(source) if os.path.isfile(path)]
+        if not items and not glob.has_magic(source):
+            raise BulkImportError('%s is not a directory, a zip file or a pattern' % source)
+    items.sort()
+    if formatCode is not None:
+        if formatCode not in choosePlanImporter.PLAN_IMPORTERS_BY_FORMAT:
+            raise BulkImportError('unknown import format %r, expected one of %s'
+                                  % (formatCode,
+                                     ', '.join(sorted(choosePlanImporter.PLAN_IMPORTERS_BY_FORMAT))))
+        return items
+    return [item for item in items
+            if choosePlanImporter.chooseImporter(item[0]) is not None]
+
+
+# zip files opened by readImportFile() in this process (a worker, or the
+# web server for zip uploads), so each central directory is read once
+WORKER_ZIPS = {}
+WORKER_ZIPS_LOCK = threading.Lock()
+
+
+def initWorker():
+    # the forked worker must not share the parent's database connections
+    connections.close_all()
+    WORKER_ZIPS.clear()
+    models.PLAN_SCHEMA_REGISTRY.preload()
+
+
+def readImportFile(path, member):
+    if member is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    with WORKER_ZIPS_LOCK:
+        archive = WORKER_ZIPS.get(path)
+        if archive is None:
+            archive = WORKER_ZIPS[path] = zipfile.ZipFile(path)
+        return archive.read(member)
+
+
+def closeZips(paths):
+    """
+    Close the zip files *paths* opened by readImportFile() in this
+    process, after an import that ran without workers.
+    """
+    with WORKER_ZIPS_LOCK:
+        for path in paths:
+            archive = WORKER_ZIPS.pop(path, None)
+            if archive is not None:
+                archive.close()
+
+
+def getPlanFields(dbPlan):
+    """
+    Return the column values of unsaved *dbPlan* as (fields,
+    jsonFields), both picklable; jsonFields holds the DotDict columns
+    serialized as JSON. See makePlan().
+    """
+    fields = {}
+    jsonFields = {}
+    for field in dbPlan._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        value = getattr(dbPlan, field.attname)
+        if isinstance(value, dict):
+            jsonFields[field.attname] = json.dumps(value)
+        else:
+            fields[field.attname] = value
+    return fields, jsonFields
+
+
+def makePlan(planFields):
+    from xgds_planner2.planIndex import PLAN_MODEL  # delayed import avoids import loop
+    fields, jsonFields = planFields
+    dbPlan = PLAN_MODEL.get()(**fields)
+    for name, text in jsonFields.iteritems():
+        setattr(dbPlan, name, convertToDotDictRecurse(json.loads(text)))
+    return dbPlan
+
+
+def parsePlanFile(args):
+    """
+    Parse one plan file into an unsaved plan. Runs in a worker. Return
+    a dict with fileName, error, seconds and planFields (see
+    getPlanFields()).
+    """
+    fileName, path, member, meta, platform, formatCode = args
+    result = {'fileName': fileName,
+              'error': None,
+              'planFields': None}
+    start = time.time()
+    try:
+        importerClass = choosePlanImporter.chooseImporter(fileName, formatCode)
+        if importerClass is None:
+            raise BulkImportError('no importer for %s' % fileName)
+        buf = readImportFile(path, member)
+        name = os.path.splitext(os.path.basename(fileName))[0]
+        dbPlan = importerClass.importPlan(name,
+                                          buf=buf,
+                                          meta=copy.deepcopy(meta),
+                                          planSchema=models.getPlanSchema(platform) if platform else None,
+                                          path=path if member is None else None)
+        if dbPlan is None:
+            raise BulkImportError('no platform given for %s' % fileName)
+        planImporter.setNameFromId(dbPlan)
+        result['planFields'] = getPlanFields(dbPlan)
+    except Exception, e:  # pylint: disable=W0703
+        result['error'] = '%s: %s' % (e.__class__.__name__, e)
+    result['seconds'] = time.time() - start
+    return result
+
+
+def writePlans(batch):
+    """
+    Insert the plans of *batch*, a list of (fileName, dbPlan), in one
+    transaction. If the database rejects it, save them one at a time
+    instead. Return the list of (fileName, dbPlan, error).
+    """
+    from xgds_planner2.planIndex import PLAN_MODEL  # delayed import avoids import loop
+    from xgds_planner2.spatialIndex import PLAN_SPATIAL_INDEX  # delayed import avoids import loop
+    try:
+        with transaction.atomic():
+            PLAN_MODEL.get().objects.bulk_create([dbPlan for _fileName, dbPlan in batch])
+    except (DatabaseError, ValueError):
+        # ValueError: bulk_create does not handle multi-table inheritance
+        logging.warning('bulkImport: could not insert a batch of %d plans, saving them one at a time',
+                        len(batch), exc_info=True)
+    else:
+        for _fileName, dbPlan in batch:
+            PLAN_SPATIAL_INDEX.update(dbPlan)
+        return [(fileName, dbPlan, None) for fileName, dbPlan in batch]
+
+    results = []
+    for fileName, dbPlan in batch:
+        try:
+            with transaction.atomic():
+                dbPlan.save()
+        except DatabaseError, e:
+            results.append((fileName, dbPlan, '%s: %s' % (e.__class__.__name__, e)))
+        else:
+            results.append((fileName, dbPlan, None))
+    return results
+
+
+class BulkImportReport(object):
+    """
+    Outcome of every file of a bulk import, with counts and timings.
+    """
+
+    def __init__(self, numFiles):
+        self.numFiles = numFiles
+        self.numImported = 0
+        self.numFailed = 0
+        self.parseSeconds = 0.0
+        self.files = []
+        self.startTime = time.time()
+
+    def add(self, fileName, error, dbPlan=None, seconds=0.0):
+        self.parseSeconds += seconds
+        if error:
+            self.numFailed += 1
+            self.files.append({'fileName': fileName, 'error': error})
+        else:
+            self.numImported += 1
+            self.files.append({'fileName': fileName, 'uuid': dbPlan.uuid, 'name': dbPlan.name})
+
+    def getProgressLine(self, fileName, error):
+        return '[%d/%d] %s: %s' % (self.numImported + self.numFailed, self.numFiles, fileName,
+                                   'FAILED %s' % error if error else 'ok')
+
+    def getErrors(self):
+        return [entry for entry in self.files if 'error' in entry]
+
+    def toDict(self):
+        done = self.numImported + self.numFailed
+        return {'files': self.numFiles,
+                'imported': self.numImported,
+                'failed': self.numFailed,
+                'elapsedSeconds': time.time() - self.startTime,
+                'meanParseSeconds': self.parseSeconds / done if done else None,
+                'results': self.files}
+
+
+def iterImportPlans(items, meta, platform=None, formatCode=None, processes=None, batchSize=None):
+    """
+    Import the files *items* (see collectImportFiles()), each with a
+    copy of *meta* as in PlanImporter.importPlan(), using the schema of
+    *platform* if given. Yield (fileName, error, dbPlan, seconds) for
+    every file once it is written or has failed. *processes* defaults
+    to the number of CPUs, 0 parses the files in this process.
+    *batchSize* defaults to XGDS_PLANNER_BULK_IMPORT_BATCH_SIZE.
+    """
+    from xgds_planner2.planIndex import invalidatePlanIndex  # delayed import avoids import loop
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if batchSize is None:
+        batchSize = settings.XGDS_PLANNER_BULK_IMPORT_BATCH_SIZE
+    tasks = [(fileName, path, member, meta, platform, formatCode)
+             for fileName, path, member in items]
+    batch = []
+    seconds = {}
+    imported = False
+    if processes == 0:
+        pool = None
+        results = itertools.imap(parsePlanFile, tasks)
+    else:
+        # don't hand our open connections to the forked workers
+        connections.close_all()
+        pool = multiprocessing.Pool(processes, initWorker)
+        # small files parse quickly, so hand them out a few at a time
+        results = pool.imap_unordered(parsePlanFile, tasks, chunksize=4)
+    try:
+        for result in results:
+            if result['error']:
+                yield result['fileName'], result['error'], None, result['seconds']
+                continue
+            batch.append((result['fileName'], makePlan(result['planFields'])))
+            seconds[result['fileName']] = result['seconds']
+            if len(batch) >= batchSize:
+                for fileName, dbPlan, error in writePlans(batch):
+                    imported = imported or not error
+                    yield fileName, error, dbPlan, seconds.pop(fileName)
+                batch = []
+        if batch:
+            for fileName, dbPlan, error in writePlans(batch):
+                imported = imported or not error
+                yield fileName, error, dbPlan, seconds.pop(fileName)
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        else:
+            closeZips(set([path for _fileName, path, member in items if member is not None]))
+        if imported:
+            invalidatePlanIndex()
+
+
+def importPlans(source, meta, platform=None, formatCode=None, processes=None, batchSize=None,
+                progress=None, maxFiles=None):
+    """
+    Import every plan file in *source* (see collectImportFiles()) and
+    return the BulkImportReport. *progress*, if given, is called with
+    (report, fileName, error) as each file finishes. Raise
+    BulkImportError without importing anything if there are more than
+    *maxFiles* files.
+    """
+    items = collectImportFiles(source, formatCode)
+    if maxFiles is not None and len(items) > maxFiles:
+        raise BulkImportError('%d files, at most %d can be imported at once'
+                              % (len(items), maxFiles))
+    report = BulkImportReport(len(items))
+    for fileName, error, dbPlan, seconds in iterImportPlans(items, meta, platform, formatCode,
+                                                            processes, batchSize):
+        report.add(fileName, error, dbPlan, seconds)
+        if progress is not None:
+            progress(report, fileName, error)
+    return report
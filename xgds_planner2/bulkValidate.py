@@ -0,0 +1,153 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Bulk validation of XPJSON documents, e.g. checking a whole plan archive
+against an updated schema with 'xp.py validate'.
+
+The schema is loaded once, by the parent; forked worker processes
+inherit it and validate one document per task. Each result is a dict
+ready to be written as a JSON line. Needs no database.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+
+from xgds_planner2 import xpjson
+
+# callers can change these globals.
+# error messages quote the offending element, which can be big
+MAX_ERROR_LENGTH = 1000
+# documents handed to a worker at a time
+CHUNK_SIZE = 8
+
+# the schema to validate against, set in the parent before forking
+WORKER_SCHEMA = None
+
+
+def collectDocumentPaths(paths):
+    """
+    Return *paths* with each directory among them replaced by the .json
+    files found under it, sorted.
+    """
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for dirPath, _dirNames, fileNames in os.walk(path):
+                found.extend([os.path.join(dirPath, fileName)
+                              for fileName in fileNames
+                              if fileName.endswith('.json')])
+            result.extend(sorted(found))
+        else:
+            result.append(path)
+    return result
+
+
+def validateDocument(path, schema=None):
+    """
+    Validate the XPJSON document at *path* against *schema*, by default
+    WORKER_SCHEMA. Return a dict with path, valid, seconds and either
+    the document type or the error, and for errors within the document
+    the errorPath of the offending element (see xpjson.getErrorPath()).
+    If the document needs a schema and there is none, needsSchema is
+    set along with the type.
+    """
+    if schema is None:
+        schema = WORKER_SCHEMA
+    result = {'path': path}
+    start = time.time()
+    docDict = None
+    try:
+        docDict = xpjson.loadDictFromPath(path)
+        doc = xpjson.loadDocumentFromDict(docDict, schema, parseOpts=xpjson.ParseOpts())
+    except Exception, e:  # pylint: disable=W0703
+        result['valid'] = False
+        if isinstance(e, xpjson.NoSchemaError):
+            result['needsSchema'] = True
+            result['type'] = docDict.get('type')
+            message = 'a schema is needed to validate a document of type %s' % result['type']
+        else:
+            message = '%s: %s' % (e.__class__.__name__, e)
+        result['error'] = message[:MAX_ERROR_LENGTH]
+        if docDict is not None and not isinstance(e, xpjson.NoSchemaError):
+            try:
+                # reload, validation may have modified the dict
+                result['errorPath'] = xpjson.getErrorPath(xpjson.loadDictFromPath(path), schema,
+                                                          xpjson.ParseOpts())
+            except Exception:  # pylint: disable=W0703
+                result['errorPath'] = None
+    else:
+        result['valid'] = True
+        result['type'] = doc.get('type')
+    result['seconds'] = time.time() - start
+    return result
+
+
+def initWorker(schema):
+    global WORKER_SCHEMA  # pylint: disable=W0603
+    WORKER_SCHEMA = schema
+
+
+def iterValidateDocuments(paths, schema=None, processes=None):
+    """
+    Validate the documents at *paths* against *schema*, yielding the
+    result of each (see validateDocument()) in the order of *paths*.
+    *processes* defaults to the number of CPUs; with 0 or 1, validate
+    in this process.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield validateDocument(path, schema)
+        return
+    pool = multiprocessing.Pool(processes, initWorker, (schema,))
+    try:
+        for result in pool.imap(validateDocument, paths, CHUNK_SIZE):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class ValidationSummary(object):
+    def __init__(self):
+        self.numValid = 0
+        self.numInvalid = 0
+        self.startTime = time.time()
+
+    def add(self, result):
+        if result['valid']:
+            self.numValid += 1
+        else:
+            self.numInvalid += 1
+
+    def toDict(self):
+        elapsed = time.time() - self.startTime
+        total = self.numValid + self.numInvalid
+        return {'documents': total,
+                'valid': self.numValid,
+                'invalid': self.numInvalid,
+                'elapsedSeconds': elapsed,
+                'documentsPerSecond': total / elapsed if elapsed else None}
+
+
+def dumpResult(result):
+    return json.dumps(result, sort_keys=True)
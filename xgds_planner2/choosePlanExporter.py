@@ -32,6 +32,7 @@ class ExporterInfo(object):
 
 PLAN_EXPORTERS = []
 PLAN_EXPORTERS_BY_FORMAT = {}
+PLAN_EXPORTERS_BY_EXTENSION = {}
 for exporterInfo in settings.XGDS_PLANNER_PLAN_EXPORTERS:
     # _formatCode, _extension, _exporterClassName, _customLabel
     _formatCode = exporterInfo[0]
@@ -46,3 +47,4 @@ for exporterInfo in settings.XGDS_PLANNER_PLAN_EXPORTERS:
                                  _customLabel)
     PLAN_EXPORTERS.append(_exporterInfo)
     PLAN_EXPORTERS_BY_FORMAT[_formatCode] = _exporterInfo
+    PLAN_EXPORTERS_BY_EXTENSION[_extension] = _exporterInfo
@@ -60,6 +60,14 @@ def doCompile(planSchema, builder=None):
                        planSchema.schemaSource],
                       buildLibrary(planSchema))
 
+    def buildSnapshot(planSchema):
+        planSchema.writeSnapshot()
+        print 'wrote schema snapshot for platform %s to %s' % (planSchema.platform, planSchema.snapshotPath)
+    builder.applyRule(planSchema.snapshotPath,
+                      [planSchema.simplifiedSchemaPath,
+                       planSchema.simplifiedLibraryPath],
+                      buildSnapshot(planSchema))
+
 
 def main():
     import optparse
@@ -150,6 +150,69 @@ PIPELINE['JAVASCRIPT']['simulator'] = {'source_filenames': ('xgds_planner2/js/pl
 
 _thisDir = os.path.dirname(__file__)
 
+# Load every platform in XGDS_PLANNER_SCHEMAS when the app starts, so the
+# first request each worker serves does not pay for parsing them.
+XGDS_PLANNER_PRELOAD_SCHEMAS = True
+
+# Cache (a key of CACHES) holding the plan index served by planIndexJson.
+# It is invalidated when a plan is saved or deleted; with a per-process
+# backend such as locmem, other processes only see the change when their
+# copy times out after XGDS_PLANNER_PLAN_INDEX_TIMEOUT seconds.
+XGDS_PLANNER_PLAN_INDEX_CACHE = 'default'
+XGDS_PLANNER_PLAN_INDEX_TIMEOUT = 300
+
+# Each process keeps a spatial index of plan routes (see spatialIndex.py)
+# that follows its own saves and deletes, and is rebuilt from the database
+# after this many seconds to pick up changes made by other processes.
+XGDS_PLANNER_SPATIAL_INDEX_MAX_AGE = 300
+
+# Rendered plan exports are cached (see exportCache.py) in the backend
+# class named here, built with XGDS_PLANNER_EXPORT_CACHE_OPTIONS as keyword
+# args. The choices are FileExportCacheBackend (shared by the processes
+# of a host, option directory, by default DATA_ROOT/xgds_planner2/exportCache
+# made with mode 0700), DjangoExportCacheBackend (shared across
+# hosts given a shared cache, options cache and timeout) and
+# LocMemExportCacheBackend (per process, LRU, option maxBytes; saves in
+# other processes do not invalidate it). Set to None to disable the cache.
+XGDS_PLANNER_EXPORT_CACHE_BACKEND = 'xgds_planner2.exportCache.FileExportCacheBackend'
+XGDS_PLANNER_EXPORT_CACHE_OPTIONS = {}
+# exports bigger than this are served but not cached
+XGDS_PLANNER_EXPORT_CACHE_MAX_ITEM_BYTES = 8 * 1024 * 1024
+
+# Extensions (from XGDS_PLANNER_PLAN_EXPORTERS) to render into the export
+# cache in the background after each save, e.g. ('.kml', '.pml', '.bdj').
+# Also add (SAVE, 'xgds_planner2.exportPipeline.exportPlanCallback', PYTHON)
+# to XGDS_PLANNER_CALLBACK. See exportPipeline.py.
+XGDS_PLANNER_EXPORT_PIPELINE_FORMATS = ()
+XGDS_PLANNER_EXPORT_PIPELINE_WORKERS = 2
+# plans waiting beyond this many are not pre-exported, only exported on demand
+XGDS_PLANNER_EXPORT_PIPELINE_MAX_PENDING = 100
+
+# bulkExport.zip exports in the serving process, so it refuses to export
+# more plans than this; use 'manage.py exportPlans' for more.
+XGDS_PLANNER_BULK_EXPORT_MAX_PLANS = 100
+
+# Bulk imports ('manage.py importPlans', 'xp.py import' of a directory,
+# zip or pattern, zip uploads to planImport) write this many plans per
+# transaction. See bulkImport.py.
+XGDS_PLANNER_BULK_IMPORT_BATCH_SIZE = 500
+# Zip uploads to planImport are parsed in the serving process, so they
+# are refused beyond these limits; use 'manage.py importPlans' for more.
+XGDS_PLANNER_BULK_IMPORT_MAX_FILES = 100
+XGDS_PLANNER_BULK_IMPORT_MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+
+# JSON library used to parse and dump plans: 'simplejson', 'json' or
+# 'ujson' (fastest, but writes floats with at most 15 decimal places).
+# None picks the fastest of simplejson and json installed. See jsonCodec.py.
+XGDS_PLANNER_JSON_CODEC = None
+
+# gzip-compress plans relayed to other servers. See planRelay.py.
+XGDS_PLANNER_RELAY_GZIP = True
+# also relay the plan in the old jsonPlan field, for receivers that
+# predate planRelay.py. That doubles the payload, so it is off: upgrade
+# the receivers first, or set this on the senders until they are.
+XGDS_PLANNER_RELAY_LEGACY_FIELD = False
+
 # Set to true to make the bearing distance be in crs units
 XGDS_PLANNER_CRS_UNITS_DEFAULT = False
 
@@ -274,8 +337,9 @@ XGDS_PLANNER_PLAN_BEARING_HANDLEBAR_PATH = 'xgds_planner2/templates/xgds_planner
 # extra JavaScript callback to call after the links tab is loaded.
 XGDS_PLANNER_LINKS_LOADED_CALLBACK = 'null'
 
-# This is used to hold a map of site frames, so we can convert lat/long to the closest site frame.
-# It is initialized by calling views.getSiteFrames().
+# Deprecated, put the site frames in the platform libraries instead. A
+# non-empty list here is used as the site frames; otherwise
+# siteFrames.SITE_FRAME_REGISTRY fills it in for code that still reads it.
 XGDS_PLANNER_SITE_FRAMES = []
 
 XGDS_MAP_SERVER_JS_MAP = getOrCreateDict('XGDS_MAP_SERVER_JS_MAP')
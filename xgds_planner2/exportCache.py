@@ -0,0 +1,329 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Cache of rendered plan exports, so that repeat downloads of an
+unchanged plan (for instance Google Earth polling the network links of
+planIndex.kml) are served without loading, parsing or walking the plan.
+
+An export is keyed by (plan uuid, plan dateModified, plan jsonHash,
+exporter, start time, request variant). dateModified only has whole
+seconds, so the jsonHash column keeps two saves within a second apart. The start time is the one the exporter will
+actually use (see PlanExporter.getCacheStartTime()), so a PML export
+is keyed on the planned start of the plan's execution, and exports
+that start at the current time are never cached. The request variant
+is whatever else the exporter reads from the request, e.g. the host
+of the absolute urls in KML. Looking a key up needs only the plan's
+summary columns, never the jsonPlan blob. Editing a plan changes its
+dateModified, and every save or delete also invalidates the plan's
+entries through the post_save and post_delete signals, which catches
+saves that leave dateModified alone.
+
+The storage is pluggable: XGDS_PLANNER_EXPORT_CACHE_BACKEND names one
+of the backend classes below (or your own with the same get, set and
+invalidate methods), built with XGDS_PLANNER_EXPORT_CACHE_OPTIONS as
+keyword args. The default FileExportCacheBackend is shared by all the
+processes of a host, so an invalidation reaches every one of them. It
+keeps its files under DATA_ROOT, in a directory only the server's user
+can read, rather than in the shared temp directory; use
+DjangoExportCacheBackend with a shared cache across hosts. The
+per-process LocMemExportCacheBackend only suits a single process.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+
+from geocamUtil.loader import getClassByName
+
+from xgds_planner2.planExporter import CACHE_NOW
+
+
+def getKeyDigest(key):
+    """
+    Return a filename-safe digest of the parts of *key* after the uuid.
+    """
+    return hashlib.md5(repr(key[1:])).hexdigest()
+
+
+class LocMemExportCacheBackend(object):
+    """
+    Per-process cache holding at most *maxBytes* of exports, evicting
+    the least recently used. Saves in other processes do not reach it,
+    so only use it when a single process serves the planner.
+    """
+
+    def __init__(self, maxBytes=64 * 1024 * 1024):
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            text = self.entries.pop(key, None)
+            if text is not None:
+                self.entries[key] = text
+            return text
+
+    def set(self, key, text):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = text
+            self.size += len(text)
+            while self.size > self.maxBytes and self.entries:
+                _key, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def invalidate(self, uuid):
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == uuid]:
+                self.size -= len(self.entries.pop(key))
+
+
+class FileExportCacheBackend(object):
+    """
+    Cache on disk under *directory*, one subdirectory per plan. Shared
+    by every process that uses the same directory. The directories are
+    made with mode 0700, so keep *directory* somewhere only the server's
+    user can write; it defaults to DATA_ROOT/xgds_planner2/exportCache.
+    Nothing is evicted, besides invalidation; clean up old files with
+    cron if need be.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(settings.DATA_ROOT, 'xgds_planner2', 'exportCache')
+        self.directory = directory
+
+    def getPath(self, key):
+        return os.path.join(self.directory, key[0], getKeyDigest(key))
+
+    def get(self, key):
+        try:
+            with open(self.getPath(key), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def set(self, key, text):
+        path = self.getPath(key)
+        planDir = os.path.dirname(path)
+        try:
+            if not os.path.isdir(planDir):
+                os.makedirs(planDir, 0700)
+        except OSError:
+            # another process made it first
+            pass
+        # write to a temp file and rename, so readers never see a partial export
+        fd, tmpPath = tempfile.mkstemp(dir=planDir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(text)
+        os.rename(tmpPath, path)
+
+    def invalidate(self, uuid):
+        shutil.rmtree(os.path.join(self.directory, uuid), ignore_errors=True)
+
+
+class DjangoExportCacheBackend(object):
+    """
+    Cache in the Django cache named *cache* (a key of CACHES). Entries
+    expire after *timeout* seconds; None uses the cache's default.
+    """
+
+    GENERATION_KEY = 'xgds_planner2.exportCache.generation.%s'
+    ENTRY_KEY = 'xgds_planner2.exportCache.%s.%s.%s'
+
+    def __init__(self, cache='default', timeout=None):
+        self.cacheName = cache
+        self.timeout = timeout
+
+    def getCache(self):
+        return caches[self.cacheName]
+
+    def getEntryKey(self, cache, key):
+        # invalidate() bumps the plan's generation, which orphans its entries
+        generation = cache.get(self.GENERATION_KEY % key[0], 0)
+        return self.ENTRY_KEY % (key[0], generation, getKeyDigest(key))
+
+    def get(self, key):
+        cache = self.getCache()
+        return cache.get(self.getEntryKey(cache, key))
+
+    def set(self, key, text):
+        cache = self.getCache()
+        if self.timeout is None:
+            cache.set(self.getEntryKey(cache, key), text)
+        else:
+            cache.set(self.getEntryKey(cache, key), text, self.timeout)
+
+    def invalidate(self, uuid):
+        cache = self.getCache()
+        generationKey = self.GENERATION_KEY % uuid
+        cache.add(generationKey, 0, None)
+        try:
+            cache.incr(generationKey)
+        except ValueError:
+            # evicted between the two calls
+            cache.set(generationKey, 1, None)
+
+
+class ExportCache(object):
+    """
+    Wraps a backend with hit and miss counts for this process.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        try:
+            text = self.backend.get(key)
+        except Exception:  # pylint: disable=W0703
+            logging.warning('exportCache: could not read %s', key, exc_info=True)
+            text = None
+        self.count('hits' if text is not None else 'misses')
+        return text
+
+    def set(self, key, text):
+        try:
+            self.backend.set(key, text)
+        except Exception:  # pylint: disable=W0703
+            logging.warning('exportCache: could not store %s', key, exc_info=True)
+            return
+        self.count('stores')
+
+    def invalidate(self, uuid):
+        try:
+            self.backend.invalidate(uuid)
+        except Exception:  # pylint: disable=W0703
+            logging.warning('exportCache: could not invalidate %s', uuid, exc_info=True)
+        self.count('invalidations')
+
+    def getStats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'backend': self.backend.__class__.__name__,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hitRate': float(self.hits) / lookups if lookups else None,
+                    'stores': self.stores,
+                    'invalidations': self.invalidations}
+
+
+EXPORT_CACHE = None
+EXPORT_CACHE_LOCK = threading.Lock()
+
+
+def getExportCache():
+    """
+    Return the process's ExportCache, or None if caching is disabled.
+    """
+    global EXPORT_CACHE  # pylint: disable=W0603
+    if EXPORT_CACHE is None and settings.XGDS_PLANNER_EXPORT_CACHE_BACKEND:
+        with EXPORT_CACHE_LOCK:
+            if EXPORT_CACHE is None:
+                backendClass = getClassByName(settings.XGDS_PLANNER_EXPORT_CACHE_BACKEND)
+                EXPORT_CACHE = ExportCache(backendClass(**settings.XGDS_PLANNER_EXPORT_CACHE_OPTIONS))
+    return EXPORT_CACHE
+
+
+def getExportKey(dbPlan, exporterInfo, startTime=None, variant=''):
+    """
+    Return the cache key for exporting *dbPlan* with the exporter
+    described by *exporterInfo* (a choosePlanExporter.ExporterInfo).
+    The extension is part of the key because several exporters can
+    share a format code. *startTime* is the exporter's
+    getCacheStartTime() and *variant* its getCacheVariant() for the
+    request.
+    """
+    return (dbPlan.uuid,
+            dbPlan.dateModified.isoformat() if dbPlan.dateModified else '',
+            dbPlan.jsonHash,
+            exporterInfo.formatCode + exporterInfo.extension,
+            startTime.isoformat() if startTime else '',
+            variant)
+
+
+def iterCachedExport(dbPlan, exporterInfo, exporter, request, startTime=None):
+    """
+    Return an iterator over chunks of the export text of *dbPlan*,
+    served from the cache if possible. On a miss the export is rendered
+    with *exporter* as usual, passed through chunk by chunk and stored
+    afterwards, unless it is bigger than
+    XGDS_PLANNER_EXPORT_CACHE_MAX_ITEM_BYTES.
+    """
+    cache = getExportCache()
+    if cache is None:
+        return exporter.iterExportDbPlan(dbPlan, request)
+    startTime = exporter.getCacheStartTime(dbPlan, startTime)
+    if startTime == CACHE_NOW:
+        # different every time
+        return exporter.iterExportDbPlan(dbPlan, request)
+    key = getExportKey(dbPlan, exporterInfo, startTime, exporter.getCacheVariant(request))
+    text = cache.get(key)
+    if text is not None:
+        return iter([text])
+    return storeChunks(cache, key, exporter.iterExportDbPlan(dbPlan, request))
+
+
+def storeChunks(cache, key, chunks):
+    kept = []
+    size = 0
+    for chunk in chunks:
+        if kept is not None:
+            size += len(chunk)
+            if size > settings.XGDS_PLANNER_EXPORT_CACHE_MAX_ITEM_BYTES:
+                kept = None
+            else:
+                kept.append(chunk)
+        yield chunk
+    if kept is not None:
+        cache.set(key, ''.join(kept))
+
+
+def invalidatePlanExports(sender, instance=None, **kwargs):
+    cache = getExportCache()
+    if cache is not None:
+        cache.invalidate(instance.uuid)
+
+
+def connectSignals():
+    from xgds_planner2.planIndex import PLAN_MODEL  # delayed import avoids import loop
+    planModel = PLAN_MODEL.get()
+    post_save.connect(invalidatePlanExports, sender=planModel,
+                      dispatch_uid='xgds_planner2.exportCache.post_save')
+    post_delete.connect(invalidatePlanExports, sender=planModel,
+                        dispatch_uid='xgds_planner2.exportCache.post_delete')
@@ -0,0 +1,226 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Write-behind export pipeline: after a plan is saved, render the formats
+listed in XGDS_PLANNER_EXPORT_PIPELINE_FORMATS in background worker
+threads and store them in the export cache (see exportCache.py), so
+the downloads that usually follow a save are served straight from the
+cache. With FileExportCacheBackend the exports sit on disk next to each
+other, one directory per plan.
+
+To turn it on, list the extensions to render and register the save
+callback:
+
+XGDS_PLANNER_EXPORT_PIPELINE_FORMATS = ('.kml', '.pml', '.bdj')
+XGDS_PLANNER_CALLBACK = [(SAVE, 'xgds_planner2.exportPipeline.exportPlanCallback', PYTHON)]
+
+Each plan has at most one pending job: saving it again before its job
+runs replaces the job, and a job whose plan has been saved since it was
+scheduled is skipped. At most XGDS_PLANNER_EXPORT_PIPELINE_MAX_PENDING
+plans wait at once; past that, new jobs are dropped and those plans are
+exported on demand as before, so a burst of saves never queues
+unbounded work or slows down the save itself.
+"""
+
+import logging
+import threading
+import urlparse
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from xgds_planner2 import choosePlanExporter, exportCache
+from xgds_planner2.planExporter import CACHE_NOW
+
+
+class DetachedRequest(object):
+    """
+    The parts of the saving request that exporters use (to build
+    absolute URLs), safe to hand to a worker thread after the request
+    is gone.
+    """
+
+    def __init__(self, request):
+        self.host = request.get_host()
+        self.baseUri = request.build_absolute_uri('/')
+
+    def get_host(self):
+        return self.host
+
+    def build_absolute_uri(self, location=None):
+        return urlparse.urljoin(self.baseUri, location or '')
+
+
+class ExportJob(object):
+    def __init__(self, uuid, dateModified, request):
+        self.uuid = uuid
+        self.dateModified = dateModified
+        self.request = request
+
+
+def getPipelineExporters():
+    """
+    Return the ExporterInfo of each extension in
+    XGDS_PLANNER_EXPORT_PIPELINE_FORMATS.
+    """
+    result = []
+    for extension in settings.XGDS_PLANNER_EXPORT_PIPELINE_FORMATS:
+        info = choosePlanExporter.PLAN_EXPORTERS_BY_EXTENSION.get(extension)
+        if info is None:
+            logging.warning('exportPipeline: no exporter for %s in XGDS_PLANNER_PLAN_EXPORTERS',
+                            extension)
+        else:
+            result.append(info)
+    return result
+
+
+class ExportPipeline(object):
+    """
+    Queue of export jobs, one per plan, run by a pool of daemon threads
+    started on first use.
+    """
+
+    def __init__(self, numWorkers, maxPending):
+        self.numWorkers = numWorkers
+        self.maxPending = maxPending
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.pending = OrderedDict()
+        self.workers = []
+        self.scheduled = 0
+        self.superseded = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def schedule(self, job):
+        """
+        Queue *job*, replacing any job still pending for the same plan.
+        Return False if it was dropped because the queue is full.
+        """
+        with self.lock:
+            if job.uuid in self.pending:
+                self.superseded += 1
+            elif len(self.pending) >= self.maxPending:
+                self.dropped += 1
+                logging.warning('exportPipeline: %d plans waiting, not pre-exporting %s',
+                                len(self.pending), job.uuid)
+                return False
+            self.pending[job.uuid] = job
+            self.scheduled += 1
+            self.startWorkers()
+            self.ready.notify()
+        return True
+
+    def startWorkers(self):
+        # called with the lock held
+        while len(self.workers) < self.numWorkers:
+            worker = threading.Thread(target=self.work,
+                                      name='exportPipeline-%d' % len(self.workers))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def work(self):
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.ready.wait()
+                _uuid, job = self.pending.popitem(last=False)
+            try:
+                self.runJob(job)
+            except Exception:  # pylint: disable=W0703
+                with self.lock:
+                    self.failed += 1
+                logging.warning('exportPipeline: could not export plan %s', job.uuid, exc_info=True)
+            else:
+                with self.lock:
+                    self.completed += 1
+            finally:
+                close_old_connections()
+
+    def runJob(self, job):
+        from xgds_planner2.planIndex import PLAN_MODEL  # delayed import avoids import loop
+        cache = exportCache.getExportCache()
+        if cache is None:
+            logging.warning('exportPipeline: XGDS_PLANNER_EXPORT_CACHE_BACKEND is None, nowhere to store exports')
+            return
+        try:
+            dbPlan = PLAN_MODEL.get().objects.get(uuid=job.uuid)
+        except PLAN_MODEL.get().DoesNotExist:
+            return
+        if dbPlan.deleted or (job.dateModified and dbPlan.dateModified > job.dateModified):
+            # a later save scheduled its own job, or the plan is gone.
+            # compared with > since the database may drop microseconds.
+            with self.lock:
+                self.superseded += 1
+            return
+        for info in getPipelineExporters():
+            exporter = info.exporterClass()
+            startTime = exporter.getCacheStartTime(dbPlan, None)
+            if startTime == CACHE_NOW:
+                # the export would never be served from the cache
+                continue
+            key = exportCache.getExportKey(dbPlan, info, startTime, exporter.getCacheVariant(job.request))
+            text = ''.join(exporter.iterExportDbPlan(dbPlan, job.request))
+            cache.set(key, text)
+
+    def getStats(self):
+        with self.lock:
+            return {'pending': len(self.pending),
+                    'workers': len(self.workers),
+                    'scheduled': self.scheduled,
+                    'superseded': self.superseded,
+                    'dropped': self.dropped,
+                    'completed': self.completed,
+                    'failed': self.failed}
+
+
+EXPORT_PIPELINE = None
+EXPORT_PIPELINE_LOCK = threading.Lock()
+
+
+def getExportPipeline():
+    global EXPORT_PIPELINE  # pylint: disable=W0603
+    if EXPORT_PIPELINE is None:
+        with EXPORT_PIPELINE_LOCK:
+            if EXPORT_PIPELINE is None:
+                EXPORT_PIPELINE = ExportPipeline(settings.XGDS_PLANNER_EXPORT_PIPELINE_WORKERS,
+                                                 settings.XGDS_PLANNER_EXPORT_PIPELINE_MAX_PENDING)
+    return EXPORT_PIPELINE
+
+
+def scheduleExports(dbPlan, request=None):
+    """
+    Pre-export *dbPlan* in the background once the current transaction
+    commits.
+    """
+    if not settings.XGDS_PLANNER_EXPORT_PIPELINE_FORMATS:
+        return
+    job = ExportJob(dbPlan.uuid,
+                    dbPlan.dateModified,
+                    DetachedRequest(request) if request is not None else None)
+    transaction.on_commit(lambda: getExportPipeline().schedule(job))
+
+
+def exportPlanCallback(request, plan):
+    """
+    XGDS_PLANNER_CALLBACK entry point for SAVE.
+    """
+    scheduleExports(plan, request)
+    return plan
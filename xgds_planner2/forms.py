@@ -64,5 +64,6 @@ class ImportPlanForm(CreatePlanForm):
     def __init__(self, *args, **kwargs):
         super(ImportPlanForm, self).__init__(*args, **kwargs)
         importers = settings.XGDS_PLANNER_PLAN_IMPORTERS
-        self.fields['sourceFile'].ext_whitelist = (e for (n, e, c) in importers)
+        # a zip file holds many plans, imported in bulk (see bulkImport.py)
+        self.fields['sourceFile'].ext_whitelist = tuple(e for (n, e, c) in importers) + ('.zip',)
 
@@ -0,0 +1,151 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Pluggable JSON codec. A plan is parsed and dumped several times per
+request, so the views, xpjson and the importers go through loads(),
+loadsDotDict() and dumps() here, which use the fastest JSON library
+available:
+
+ simplejson  C speedups, same output as the standard library
+ json        the standard library, always available
+ ujson       fastest, but only used if chosen by name, since it writes
+             floats with at most 15 decimal places
+
+By default the first of PREFERRED_CODECS that imports is used;
+setCodec() picks one by name. In Django, the app applies
+XGDS_PLANNER_JSON_CODEC when it is loaded.
+
+Pretty-printed output and custom encoder classes always go through the
+standard library, so files on disk and their formatting don't depend on
+which codec is installed.
+"""
+
+import json
+
+from geocamUtil.dotDict import DotDict, convertToDotDictRecurse
+
+# callers can change this global.
+PREFERRED_CODECS = ('simplejson', 'json')
+
+
+class StdlibJsonCodec(object):
+    name = 'json'
+
+    def __init__(self):
+        self.module = json
+
+    def loads(self, s):
+        return self.module.loads(s)
+
+    def loadsDotDict(self, s):
+        # builds the DotDicts while parsing, rather than converting afterwards
+        return self.module.loads(s, object_hook=DotDict)
+
+    def dumps(self, obj, sort_keys=False):
+        return self.module.dumps(obj, sort_keys=sort_keys)
+
+
+class SimplejsonCodec(StdlibJsonCodec):
+    name = 'simplejson'
+
+    def __init__(self):
+        super(SimplejsonCodec, self).__init__()
+        import simplejson
+        self.module = simplejson
+
+
+class UjsonCodec(object):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self.module = ujson
+
+    def loads(self, s):
+        return self.module.loads(s, precise_float=True)
+
+    def loadsDotDict(self, s):
+        return convertToDotDictRecurse(self.loads(s))
+
+    def dumps(self, obj, sort_keys=False):
+        try:
+            return self.module.dumps(obj,
+                                     sort_keys=sort_keys,
+                                     double_precision=15,
+                                     escape_forward_slashes=False)
+        except (TypeError, OverflowError):
+            # objects ujson can't encode, e.g. very large ints
+            return json.dumps(obj, sort_keys=sort_keys)
+
+
+CODEC_CLASSES = {
+    'json': StdlibJsonCodec,
+    'simplejson': SimplejsonCodec,
+    'ujson': UjsonCodec,
+}
+
+CODEC = None
+
+
+def setCodec(name=None):
+    """
+    Use the codec called *name*, a key of CODEC_CLASSES, or if None the
+    first of PREFERRED_CODECS whose library imports. Raises ImportError
+    if the library of *name* is missing.
+    """
+    global CODEC  # pylint: disable=W0603
+    if name is None:
+        for candidate in PREFERRED_CODECS:
+            try:
+                CODEC = CODEC_CLASSES[candidate]()
+                break
+            except ImportError:
+                pass
+        else:
+            CODEC = StdlibJsonCodec()
+    else:
+        try:
+            codecClass = CODEC_CLASSES[name]
+        except KeyError:
+            raise ValueError('unknown JSON codec %r, expected one of %s'
+                             % (name, ', '.join(sorted(CODEC_CLASSES))))
+        CODEC = codecClass()
+    return CODEC
+
+
+def getCodec():
+    if CODEC is None:
+        setCodec()
+    return CODEC
+
+
+def loads(s):
+    return getCodec().loads(s)
+
+
+def loadsDotDict(s):
+    """
+    Parse *s* with every object as a DotDict, like
+    convertToDotDictRecurse(loads(s)).
+    """
+    return getCodec().loadsDotDict(s)
+
+
+def dumps(obj, sort_keys=False, indent=None, cls=None):
+    if indent is not None or cls is not None:
+        return json.dumps(obj, sort_keys=sort_keys, indent=indent, cls=cls)
+    return getCodec().dumps(obj, sort_keys)
@@ -29,6 +29,7 @@ class KmlPlanExporter(TreeWalkPlanExporter):
 
     label = 'kml'
     content_type = 'application/vnd.google-earth.kml+xml'
+    streaming = True
 
     def transformStation(self, station, tsequence, context):
         lon, lat = station.geometry['coordinates']
@@ -43,7 +44,7 @@ class KmlPlanExporter(TreeWalkPlanExporter):
         name = "__" + name
         directionStyle = None
         styleUrl = '#station'
-        result = ""
+        result = []
         try:
             if station.isDirectional:
                 if station.headingDegrees:
@@ -52,18 +53,18 @@ class KmlPlanExporter(TreeWalkPlanExporter):
                     directionStyle = KmlUtil.makeStyle(iconHeading=headingDegrees)
         except AttributeError:
             pass
-        result = result + ('''
+        result.append('''
 <Placemark>
   <name>%s</name>
   <styleUrl>%s</styleUrl>''' % (escape(name), styleUrl))
         if directionStyle:
-            result = result + directionStyle
-        result = result + ('''
+            result.append(directionStyle)
+        result.append('''
   <Point>
     <coordinates>%(lon)s,%(lat)s</coordinates>
   </Point>
 </Placemark>''' % {'lon': lon, 'lat': lat})
-        return result
+        return ''.join(result)
 
     def transformSegment(self, segment, tsequence, context):
         coords = [context.prevStation.geometry['coordinates']]
@@ -72,7 +73,7 @@ class KmlPlanExporter(TreeWalkPlanExporter):
             coords.extend(segment.geometry['coordinates'])
         coords.append(context.nextStation.geometry['coordinates'])
 
-        result = '''
+        result = ['''
 <Placemark>
   <name>%(name)s</name>
   <styleUrl>#segment</styleUrl>
@@ -80,16 +81,22 @@ class KmlPlanExporter(TreeWalkPlanExporter):
     <LineString>
       <tessellate>1</tessellate>
       <coordinates>
-''' % {'name': escape(segment.id) }
+''' % {'name': escape(segment.id) }]
         for coord in coords:
-            result = result + str(coord[0]) + ',' + str(coord[1]) + '\n'
-        result = result + '''
+            result.append(str(coord[0]) + ',' + str(coord[1]) + '\n')
+        result.append('''
       </coordinates>
     </LineString>
   </MultiGeometry>
 </Placemark>
-'''
-        return result
+''')
+        return ''.join(result)
+
+    def getCacheVariant(self, request):
+        # the icon urls in makeStyles() are absolute
+        if request:
+            return request.get_host()
+        return ''
 
     def getFullUrl(self, piece):
         result = static(piece)
@@ -110,11 +117,28 @@ class KmlPlanExporter(TreeWalkPlanExporter):
         segmentStyle = KmlUtil.makeStyle("segment", lineWidth=2)
         return waypointStyle + directionStyle + segmentStyle
 
-    def transformPlan(self, plan, tsequence, context):
+    def getDocumentName(self, plan):
         name = escape(plan.get("name"))
         if not name:
             name = escape(plan.get("id", ""))
-        return KmlUtil.wrapKmlDocument(self.makeStyles() + '\n'.join(tsequence), name)
+        return name
+
+    def transformPlan(self, plan, tsequence, context):
+        return KmlUtil.wrapKmlDocument(self.makeStyles() + '\n'.join(tsequence),
+                                       self.getDocumentName(plan))
+
+    def iterPlanText(self, plan, context):
+        # split the KmlUtil wrapper around a marker so the streamed
+        # document matches exportPlan() exactly
+        marker = '<!-- xgds_planner2 placemarks -->'
+        head, tail = KmlUtil.wrapKmlDocument(marker, self.getDocumentName(plan)).split(marker)
+        yield head
+        yield self.makeStyles()
+        for i, placemark in enumerate(self.iterExportSequence(plan, context)):
+            if i > 0:
+                yield '\n'
+            yield placemark
+        yield tail
 
 
 def test():
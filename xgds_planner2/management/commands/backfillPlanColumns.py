@@ -0,0 +1,65 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Fill in the plan columns copied from jsonPlan (platformName, siteId,
+siteName, planVersion) for plans saved before those columns existed,
+so the planList.json platform and site filters find them, e.g.
+
+./manage.py backfillPlanColumns --batchSize 1000
+"""
+
+from django.core.management.base import BaseCommand
+
+from xgds_planner2 import planIndex
+
+
+class Command(BaseCommand):
+    help = 'Copy the plan listing columns from jsonPlan for existing plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batchSize', type=int, default=500,
+                            help='plans read per query; default 500')
+
+    def handle(self, *args, **options):
+        planModel = planIndex.PLAN_MODEL.get()
+        columns = planModel.LIST_COLUMNS
+        lastPk = None
+        numRead = numUpdated = 0
+        while True:
+            # jsonPlan is deferred by default, and only() keeps that
+            queryset = (planModel.objects.withJson('jsonPlan')
+                        .only('pk', 'jsonPlan', *columns).order_by('pk'))
+            if lastPk is not None:
+                queryset = queryset.filter(pk__gt=lastPk)
+            plans = list(queryset[:options['batchSize']])
+            if not plans:
+                break
+            for plan in plans:
+                old = dict([(f, getattr(plan, f)) for f in columns])
+                new = plan.extractListColumns()
+                if new != old:
+                    # update() rather than save(), which would change
+                    # dateModified and recompute the stats
+                    planModel.objects.filter(pk=plan.pk).update(**new)
+                    numUpdated += 1
+            numRead += len(plans)
+            lastPk = plans[-1].pk
+            self.stdout.write('read %d plans, updated %d' % (numRead, numUpdated))
+
+        if numUpdated:
+            planIndex.invalidatePlanIndex()
+        self.stdout.write('backfilled %d of %d plans' % (numUpdated, numRead))
@@ -0,0 +1,94 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Export many plans in several formats at once, e.g.
+
+./manage.py exportPlans --format .kml --format .pml --site IRG \
+    --modifiedAfter 2016-06-01 --directory /tmp/campaign
+"""
+
+import json
+import os
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from xgds_planner2 import bulkExport, planIndex
+
+
+class Command(BaseCommand):
+    help = 'Export plans in bulk, into a directory or a zip file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('planIds', nargs='*', type=int,
+                            help='primary keys of the plans to export; default all matching the filters')
+        parser.add_argument('--format', action='append', dest='formats', default=[],
+                            help='extension of a format in XGDS_PLANNER_PLAN_EXPORTERS, e.g. .kml; repeat for more')
+        parser.add_argument('--directory', help='write the exports into this directory')
+        parser.add_argument('--zip', help='write the exports into this zip file')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='number of worker processes; default the number of CPUs')
+        for name in ('platform', 'site', 'creator', 'modifiedAfter', 'modifiedBefore', 'bbox'):
+            parser.add_argument('--' + name, help='only plans matching this %s (see planList.json)' % name)
+
+    def handle(self, *args, **options):
+        if not options['formats']:
+            raise CommandError('give at least one --format')
+        if bool(options['directory']) == bool(options['zip']):
+            raise CommandError('give exactly one of --directory and --zip')
+
+        try:
+            bulkExport.getExporterInfos(options['formats'])
+            queryset = planIndex.filterPlans(planIndex.PLAN_MODEL.get().objects.all(),
+                                             **planIndex.getFilterArgs(options))
+        except (bulkExport.BulkExportError, planIndex.PlanListError), e:
+            raise CommandError(str(e))
+        if options['planIds']:
+            queryset = queryset.filter(pk__in=options['planIds'])
+        planIds = list(queryset.order_by('pk').values_list('pk', flat=True))
+
+        def progress(report, pk, results):
+            self.stdout.write(report.getProgressLine(pk, results))
+
+        if options['zip']:
+            with open(options['zip'], 'wb') as out:
+                for chunk in bulkExport.iterZipExport(planIds, options['formats'],
+                                                      processes=options['processes'],
+                                                      progress=progress):
+                    out.write(chunk)
+            with zipfile.ZipFile(options['zip']) as archive:
+                summary = json.loads(archive.read('report.json'))
+        else:
+            directory = options['directory']
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            report = bulkExport.BulkExportReport(options['formats'], len(planIds))
+            for pk, results in bulkExport.iterExportPlans(planIds, options['formats'], directory,
+                                                          processes=options['processes']):
+                report.add(pk, results)
+                progress(report, pk, results)
+            summary = report.toDict()
+
+        self.stdout.write('exported %d plans in %.1fs' % (summary['done'], summary['elapsedSeconds']))
+        self.stdout.write('%-16s %10s %8s %14s' % ('format', 'exported', 'failed', 'mean (s)'))
+        for extension in options['formats']:
+            entry = summary['formats'][extension]
+            self.stdout.write('%-16s %10d %8d %14s' % (extension, entry['exported'], entry['failed'],
+                                                       '%.3f' % entry['meanSeconds']
+                                                       if entry['meanSeconds'] is not None else '-'))
+        for error in summary['errors']:
+            self.stderr.write('plan %(plan)s %(fileName)s: %(error)s' % error)
@@ -0,0 +1,74 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Import many plan files at once, e.g.
+
+./manage.py importPlans --platform Rover --creator admin \
+    --planNumber 1 --planVersion A --report report.json /data/archive.zip
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from xgds_planner2 import bulkImport
+
+
+class Command(BaseCommand):
+    help = 'Import plan files in bulk from a directory, a zip file or a glob pattern'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='directory, zip file or quoted glob pattern, e.g. "plans/*.kml"')
+        parser.add_argument('--platform', required=True,
+                            help='platform in XGDS_PLANNER_SCHEMAS whose schema the plans use')
+        parser.add_argument('--formatCode',
+                            help='import every file with this importer (default is to infer based on extension)')
+        parser.add_argument('--creator', help='creator username')
+        parser.add_argument('--planNumber', type=int, help='plan number')
+        parser.add_argument('--planVersion', help='plan version')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='number of worker processes; default the number of CPUs')
+        parser.add_argument('--batchSize', type=int, default=None,
+                            help='plans written per transaction; default XGDS_PLANNER_BULK_IMPORT_BATCH_SIZE')
+        parser.add_argument('--report', help='write the per-file report to this JSON file')
+
+    def handle(self, *args, **options):
+        meta = dict([(f, options[f])
+                     for f in ('creator', 'planNumber', 'planVersion')
+                     if options[f] is not None])
+
+        def progress(report, fileName, error):
+            self.stdout.write(report.getProgressLine(fileName, error))
+
+        try:
+            report = bulkImport.importPlans(options['source'], meta,
+                                            platform=options['platform'],
+                                            formatCode=options['formatCode'],
+                                            processes=options['processes'],
+                                            batchSize=options['batchSize'],
+                                            progress=progress)
+        except bulkImport.BulkImportError, e:
+            raise CommandError(str(e))
+
+        summary = report.toDict()
+        if options['report']:
+            with open(options['report'], 'w') as out:
+                json.dump(summary, out, indent=4, sort_keys=True)
+        self.stdout.write('imported %d of %d files in %.1fs'
+                          % (summary['imported'], summary['files'], summary['elapsedSeconds']))
+        for entry in report.getErrors():
+            self.stderr.write('%(fileName)s: %(error)s' % entry)
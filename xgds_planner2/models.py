@@ -19,8 +19,10 @@ import pytz
 from dateutil.parser import parse as dateparser
 
 import copy
+import hashlib
 import logging
 import os
+import threading
 
 from django.contrib.contenttypes.fields import GenericRelation
 from django.db import models
@@ -51,8 +53,6 @@ from xgds_core.models import NamedURL, NameManager, HasFlight
 # SIMPLIFIED_SCHEMA_URL = settings.STATIC_URL + _schema
 # SIMPLIFIED_LIBRARY_URL = settings.STATIC_URL + _library
 
-PLAN_SCHEMA_CACHE = {}
-
 class AbstractPlanExecution(models.Model, HasFlight):
     """
     Relationship table for managing
@@ -104,14 +104,59 @@ class PlanExecution(AbstractPlanExecution):
     plan = DEFAULT_PLAN_FIELD()
 
 
+# the JSON blobs of a plan. PlanManager leaves them out of queries, so
+# they are only loaded (and decoded) when an attribute is first read.
+PLAN_JSON_FIELDS = ('jsonPlan', 'stats', 'statsCache', 'routeGeometry')
+
+
+def getIntersectingBboxQ(bbox):
+    """
+    Return a Q selecting plans whose route bbox intersects *bbox*,
+    given as [west, south, east, north].
+    """
+    west, south, east, north = bbox
+    return (models.Q(minLon__lte=east) & models.Q(maxLon__gte=west) &
+            models.Q(minLat__lte=north) & models.Q(maxLat__gte=south))
+
+
+class PlanQuerySet(models.QuerySet):
+    def intersecting(self, bbox):
+        return self.filter(getIntersectingBboxQ(bbox))
+
+    def withJson(self, *fields):
+        """
+        Load the named JSON blobs (default: all of them) along with the
+        other columns. Use this when reading them from many plans, to
+        avoid a query per plan.
+        """
+        if not fields:
+            fields = PLAN_JSON_FIELDS
+        return self.defer(None).defer(*[f for f in PLAN_JSON_FIELDS if f not in fields])
+
+
+class PlanManager(models.Manager.from_queryset(PlanQuerySet)):
+    def get_queryset(self):
+        return super(PlanManager, self).get_queryset().defer(*PLAN_JSON_FIELDS)
+
+
 class AbstractPlan(models.Model):
     uuid = UuidField(unique=True, db_index=True)
     name = models.CharField(max_length=128, db_index=True)
     dateModified = models.DateTimeField(db_index=True)
     creator = models.ForeignKey(User, null=True, blank=True, db_index=True)
 
+    # copied from jsonPlan in extractFromJson() so plan listings can filter on them
+    platformName = models.CharField(max_length=128, blank=True, default='', db_index=True)
+    siteId = models.CharField(max_length=128, blank=True, default='', db_index=True)
+    # NULL until extracted, '' if the plan has none
+    siteName = models.CharField(max_length=128, blank=True, null=True, default=None)
+    planVersion = models.CharField(max_length=32, blank=True, null=True, default=None)
+
     # the canonical serialization of the plan exchanged with javascript clients
     jsonPlan = ExtrasDotField()
+    # hash of jsonPlan as of extractFromJson(), so caches can tell apart
+    # saves within the same second of dateModified. '' until extracted.
+    jsonHash = models.CharField(max_length=40, blank=True, default='')
 
     # a place to put an auto-generated summary of the plan
     summary = models.CharField(max_length=4096)
@@ -122,6 +167,15 @@ class AbstractPlan(models.Model):
     # allow users to mark plans as read only, so when they are opened they cannot be edited
     readOnly = models.BooleanField(blank=True, default=False)
 
+    # the route through the stations as a GeoJSON Feature, and its bbox,
+    # so maps can draw and find plans without reading jsonPlan. see
+    # getRouteGeometry().
+    routeGeometry = ExtrasDotField()
+    minLon = models.FloatField(null=True, blank=True, db_index=True)
+    minLat = models.FloatField(null=True, blank=True, db_index=True)
+    maxLon = models.FloatField(null=True, blank=True, db_index=True)
+    maxLat = models.FloatField(null=True, blank=True, db_index=True)
+
     # cache commonly used stats derived from the plan (relatively expensive to calculate)
     numStations = models.PositiveIntegerField(default=0)
     numSegments = models.PositiveIntegerField(default=0)
@@ -129,8 +183,22 @@ class AbstractPlan(models.Model):
     lengthMeters = models.FloatField(null=True, blank=True)
     estimatedDurationSeconds = models.FloatField(null=True, blank=True)
     stats = ExtrasDotField()  # a place for richer stats such as numCommandsByType
+    # per-element contributions cached between saves by IncrementalPlanStats.
+    # kept out of stats, which listings read and relays send.
+    statsCache = ExtrasDotField()
     namedURLs = GenericRelation(NamedURL)
 
+    objects = PlanManager()
+
+    # the columns extractFromJson() derives from the route and stats of
+    # the plan, which a relayed plan brings along (see planRelay.py)
+    PRECOMPUTED_FIELDS = ('routeGeometry', 'minLon', 'minLat', 'maxLon', 'maxLat',
+                          'numStations', 'numSegments', 'numCommands', 'lengthMeters',
+                          'estimatedDurationSeconds', 'stats', 'summary')
+
+    # the columns extractListColumns() copies from jsonPlan
+    LIST_COLUMNS = ('platformName', 'siteId', 'siteName', 'planVersion')
+
     class Meta:
         ordering = ['-dateModified']
         abstract = True
@@ -142,7 +210,17 @@ class AbstractPlan(models.Model):
     def get_absolute_url(self):
         return reverse('planner2_plan_save_json', args=[self.pk, self.name])
 
-    def extractFromJson(self, overWriteDateModified=True, overWriteUuid=True, request=None):
+    def extractFromJson(self, overWriteDateModified=True, overWriteUuid=True, request=None,
+                        precomputed=None):
+        """
+        Fill in the columns derived from jsonPlan. *precomputed*, if
+        given, holds the PRECOMPUTED_FIELDS another server worked out
+        (see getPrecomputedFields()), which are then used as they are
+        rather than computed again. Nothing checks that they match
+        jsonPlan; the caller must trust their source. They are only
+        ignored if they were worked out against a different version of
+        the plan schema and library than ours.
+        """
         if overWriteUuid:
             if not self.uuid:
                 self.uuid = makeUuid()
@@ -164,15 +242,39 @@ class AbstractPlan(models.Model):
             self.creator = plannerUsers[0]
         else:
             self.creator = None
+        self.extractListColumns()
+        self.jsonHash = statsPlanExporter.hashJson(self.jsonPlan)
+
+        if precomputed is not None and precomputed.get('schemaHash') != self.getSchemaHash():
+            logging.warning('extractFromJson: plan %s was relayed with another schema, recomputing',
+                            self.uuid)
+            precomputed = None
+        if precomputed is not None:
+            for f in self.PRECOMPUTED_FIELDS:
+                setattr(self, f, precomputed[f])
+            return self
+
+        self.routeGeometry = self.getRouteGeometry()
+        bbox = self.routeGeometry.bbox
+        if bbox:
+            self.minLon, self.minLat, self.maxLon, self.maxLat = bbox
+        else:
+            self.minLon = self.minLat = self.maxLon = self.maxLat = None
 
-        # fill in stats
+        # fill in stats. only elements changed since the last save are
+        # recomputed (and validated), see IncrementalPlanStats.
         try:
-            exporter = statsPlanExporter.StatsPlanExporter()
-#             print ' about to do stats'
-            stats = exporter.exportDbPlan(self, request)
+            planSchema = getPlanSchema(self.jsonPlan.platform['name'])
+            # plans saved before statsCache existed kept it in stats
+            calculator = statsPlanExporter.IncrementalPlanStats(planSchema.getSchema(),
+                                                                self.statsCache or
+                                                                self.stats.get('elementStats'))
+            stats = calculator.getStats(self.jsonPlan)
             for f in ('numStations', 'numSegments', 'numCommands', 'lengthMeters', 'estimatedDurationSeconds'):
                 setattr(self, f, stats[f])
             self.stats.numCommandsByType = stats["numCommandsByType"]
+            self.stats.pop('elementStats', None)
+            self.statsCache = DotDict(calculator.elementStats)
             self.summary = statsPlanExporter.getSummary(stats)
         except:
             logging.warning('extractFromJson: could not extract stats from plan %s',
@@ -180,6 +282,39 @@ class AbstractPlan(models.Model):
             raise  # FIX
         return self
 
+    def extractListColumns(self):
+        """
+        Copy the columns plan listings filter on from jsonPlan. Returns
+        the LIST_COLUMNS as a dict. Plans saved before these columns
+        existed get them from the backfillPlanColumns command.
+        """
+        platform = self.jsonPlan.get('platform')
+        self.platformName = (platform.get('name') or '') if platform else ''
+        site = self.jsonPlan.get('site')
+        self.siteId = (site.get('id') or '') if site else ''
+        self.siteName = (site.get('name') or '') if site else ''
+        self.planVersion = self.jsonPlan.get('planVersion') or ''
+        return dict([(f, getattr(self, f)) for f in self.LIST_COLUMNS])
+
+    def getPrecomputedFields(self):
+        """
+        Return the PRECOMPUTED_FIELDS of the plan for a relay, with the
+        hash of the schema they were computed against.
+        """
+        result = dict([(f, getattr(self, f)) for f in self.PRECOMPUTED_FIELDS])
+        if result['stats'] and 'elementStats' in result['stats']:
+            # saved before statsCache existed; private to this server
+            result['stats'] = DotDict(result['stats'])
+            result['stats'].pop('elementStats')
+        result['schemaHash'] = self.getSchemaHash()
+        return result
+
+    def getSchemaHash(self):
+        try:
+            return getPlanSchema(self.jsonPlan.platform['name']).getSchemaHash()
+        except:  # pylint: disable=W0702
+            return None
+
     def getSummaryOfCommandsByType(self):
         return statsPlanExporter.getSummaryOfCommandsByType(self.stats)
 
@@ -194,13 +329,30 @@ class AbstractPlan(models.Model):
                         self.uuid)
         raise  # FIX
 
+    def getPlanVersion(self):
+        # the column is NULL for plans not saved or backfilled since it
+        # was added; only those read the jsonPlan blob
+        if self.planVersion is not None:
+            return self.planVersion or None
+        if self.jsonPlan:
+            return self.jsonPlan.planVersion
+        return None
+
+    def getSiteName(self):
+        if self.siteName is not None:
+            return self.siteName or None
+        if self.jsonPlan and self.jsonPlan.site:
+            return self.jsonPlan.site.name
+        return None
+
     def escapedName(self):
         name = re.sub(r'[^\w]', '', self.name)
         if name == '':
             return 'plan'
         else:
-            if self.jsonPlan and self.jsonPlan.planVersion:
-                return name + "_" + self.jsonPlan.planVersion
+            planVersion = self.getPlanVersion()
+            if planVersion:
+                return name + "_" + planVersion
             return name
 
     def getExportUrl(self, extension):
@@ -242,35 +394,57 @@ class AbstractPlan(models.Model):
         else:
             return None
 
+    def getRouteGeometry(self):
+        """
+        Return the route of the plan as a GeoJSON Feature: a LineString
+        through the stations with its bbox, and the station ids and
+        notes in the properties.
+        """
+        coords = []
+        stationIds = []
+        stationNotes = []
+        for el in self.jsonPlan.get('sequence', []):
+            if el.type == "Station":
+                coords.append(el.geometry.coordinates)
+                stationIds.append(el.id)
+                stationNotes.append(el.get('notes') or '')
+        bbox = None
+        if coords:
+            lons = [c[0] for c in coords]
+            lats = [c[1] for c in coords]
+            bbox = [min(lons), min(lats), max(lons), max(lats)]
+        return DotDict({'type': 'Feature',
+                        'geometry': {'type': 'LineString',
+                                     'coordinates': coords},
+                        'bbox': bbox,
+                        'properties': {'name': self.jsonPlan.get('name'),
+                                       'author': self.jsonPlan.get('creator'),
+                                       'notes': self.jsonPlan.get('notes') or '',
+                                       'stationIds': stationIds,
+                                       'stationNotes': stationNotes}})
+
     def toMapDict(self):
         """
         Return a reduced dictionary that will be turned to JSON for rendering in a map
         Here we are just interested in the route plan and not in activities
         We just include stations
         """
+        route = self.routeGeometry
+        if not route or not route.get('geometry'):
+            # saved before routeGeometry was added
+            route = self.getRouteGeometry()
+        props = route['properties']
         result = {}
         result['id'] = self.uuid
-        result['author'] = self.jsonPlan.creator
-        result['name'] = self.jsonPlan.name
+        result['author'] = props['author']
+        result['name'] = props['name']
         result['type'] = 'Plan'
-        if self.jsonPlan.notes:
-            result['notes'] = self.jsonPlan.notes
-        else:
-            result['notes'] = ''
-
-        stations = []
-        seq = self.jsonPlan.sequence
-        for el in seq:
-            if el.type == "Station":
-                sta = {}
-                sta['id'] = el.id
-                sta['coords'] = el.geometry.coordinates
-                sta['notes'] = ''
-                if hasattr(el, 'notes'):
-                    if el.notes:
-                        sta['notes'] = el.notes
-                stations.append(sta)
-        result['stations'] = stations
+        result['notes'] = props['notes']
+        result['stations'] = [{'id': stationId, 'coords': coords, 'notes': notes}
+                              for stationId, coords, notes
+                              in zip(props['stationIds'],
+                                     route['geometry']['coordinates'],
+                                     props['stationNotes'])]
         return result
 
     def get_tree_json(self):
@@ -303,8 +477,8 @@ class Plan(AbstractPlan):
 
 
 # PlanSchema used to be a database model, but is now a normal Python
-# class built from the Django settings.  This will not change during
-# runtime so we should cache these in PLAN_SCHEMA_CACHE.
+# class built from the Django settings.  Loading one is expensive, so we
+# cache them in PLAN_SCHEMA_REGISTRY.
 class PlanSchema:
     def __init__(self, platform, schemaDict):
         self.platform = platform
@@ -322,10 +496,18 @@ class PlanSchema:
         self.schemaUrl = os.path.join(settings.STATIC_URL, schemaSuffix)
         self.libraryUrl = os.path.join(settings.STATIC_URL, librarySuffix)
 
+        # pickled schema and library written by compileXpjson
+        self.snapshotPath = xpjson.getSnapshotPath(self.simplifiedSchemaPath)
+
         self.schema = None
         self.library = None
         self.jsonSchema = None
         self.jsonLibrary = None
+        self.snapshotChecked = False
+
+        # set by loadSchema(), used by PLAN_SCHEMA_REGISTRY to detect recompiles
+        self.simplifiedMtimes = None
+        self.schemaHash = None
 
     def getJsonSchema(self):
         if not self.jsonSchema:
@@ -337,7 +519,47 @@ class PlanSchema:
                 raise
         return self.jsonSchema
 
+    def getSchemaHash(self):
+        """
+        Return a hash of the simplified schema and library, which tells
+        whether two servers derive the same stats from a plan.
+        """
+        if self.schemaHash is None:
+            self.schemaHash = hashlib.sha256(self.getJsonSchema() + self.getJsonLibrary()).hexdigest()
+        return self.schemaHash
+
+    def getSnapshotSourcePaths(self):
+        return [self.schemaSource,
+                self.librarySource,
+                self.simplifiedSchemaPath,
+                self.simplifiedLibraryPath]
+
+    def writeSnapshot(self):
+        schema = xpjson.loadDocument(self.simplifiedSchemaPath)
+        library = xpjson.loadDocument(self.simplifiedLibraryPath,
+                                      schema=schema,
+                                      fillInDefaults=True)
+        xpjson.dumpSnapshotToPath(self.snapshotPath,
+                                  self.getSnapshotSourcePaths(),
+                                  {'schema': schema,
+                                   'library': library})
+
+    def loadSnapshot(self):
+        """
+        Fill in schema and library from the snapshot if it is current.
+        Only tried once; if it fails, getSchema() and getLibrary() fall
+        back to parsing the simplified JSON.
+        """
+        if self.snapshotChecked:
+            return
+        self.snapshotChecked = True
+        docs = xpjson.loadSnapshotFromPath(self.snapshotPath)
+        if docs and not (self.schema or self.library):
+            self.schema = docs['schema']
+            self.library = docs['library']
+
     def getSchema(self):
+        self.loadSnapshot()
         if not self.schema:
             try:
                 self.schema = xpjson.loadDocument(self.simplifiedSchemaPath)
@@ -357,6 +579,7 @@ class PlanSchema:
         return self.jsonLibrary
 
     def getLibrary(self):
+        self.loadSnapshot()
         if not self.library:
             try:
                 self.library = xpjson.loadDocument(self.simplifiedLibraryPath,
@@ -368,9 +591,98 @@ class PlanSchema:
         return self.library
 
 
+def getSimplifiedMtimes(planSchema):
+    """
+    Return the modification times of the simplified schema and library
+    files written by compileXpjson, or None for a file that is missing.
+    """
+    result = []
+    for path in (planSchema.simplifiedSchemaPath, planSchema.simplifiedLibraryPath):
+        try:
+            result.append(os.path.getmtime(path))
+        except OSError:
+            result.append(None)
+    return tuple(result)
+
+
+class PlanSchemaRegistry(object):
+    """
+    Per-process cache of loaded PlanSchema objects, safe to share across
+    threads.
+
+    Each lookup compares the modification times of the simplified schema
+    and library files against the ones recorded by loadSchema(), so after
+    'manage.py prep' recompiles them, running processes pick up the new
+    versions. A reload builds the new PlanSchema completely before
+    swapping it in, so readers never see a half-loaded schema.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.schemas = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    @staticmethod
+    def isCurrent(planSchema):
+        return getSimplifiedMtimes(planSchema) == planSchema.simplifiedMtimes
+
+    def get(self, platform):
+        result = self.schemas.get(platform)
+        if result is not None and self.isCurrent(result):
+            with self.lock:
+                self.hits += 1
+            return result
+
+        with self.lock:
+            # another thread may have reloaded it while we were waiting
+            previous = self.schemas.get(platform)
+            if previous is not None and previous is not result and self.isCurrent(previous):
+                self.hits += 1
+                return previous
+
+            try:
+                result = loadSchema(platform)
+            except:
+                logging.warning('could not find plan schema for platform %s', platform)
+                raise
+            self.schemas[platform] = result
+            if previous is None:
+                self.misses += 1
+            else:
+                self.reloads += 1
+            return result
+
+    def preload(self):
+        """
+        Load the schema for every platform in XGDS_PLANNER_SCHEMAS, so
+        the first request a process serves doesn't pay for it.
+        """
+        for platform in settings.XGDS_PLANNER_SCHEMAS.iterkeys():
+            try:
+                self.get(platform)
+            except:  # pylint: disable=W0702
+                # the simplified files may not exist yet, e.g. before prep
+                pass
+
+    def getStats(self):
+        with self.lock:
+            return {'platforms': sorted(self.schemas.keys()),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'reloads': self.reloads}
+
+
+PLAN_SCHEMA_REGISTRY = PlanSchemaRegistry()
+
+
 def loadSchema(platform):
     schemaDict = settings.XGDS_PLANNER_SCHEMAS[platform]
     schema = PlanSchema(platform, schemaDict)
+    # record mtimes before reading, so if the files are recompiled while
+    # we load, the next lookup reloads them again
+    schema.simplifiedMtimes = getSimplifiedMtimes(schema)
     schema.getSchema()
     schema.getJsonSchema()
     schema.getLibrary()
@@ -380,12 +692,4 @@ def loadSchema(platform):
 
 # get the cached plan schema, building it if need be.
 def getPlanSchema(platform):
-    result = PLAN_SCHEMA_CACHE.get(platform)
-    if not result:
-        try:
-            result = loadSchema(platform)
-            PLAN_SCHEMA_CACHE[platform] = result
-        except:
-            logging.warning('could not find plan schema for platform %s', platform)
-            raise
-    return result
+    return PLAN_SCHEMA_REGISTRY.get(platform)
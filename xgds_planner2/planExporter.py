@@ -18,10 +18,9 @@ import json
 import logging
 import traceback
 
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.conf import settings
 
-from geocamUtil.dotDict import convertToDotDictRecurse, DotDict
 from geocamUtil import geomath
 
 import models
@@ -30,6 +29,40 @@ import xpjson
 
 # pylint: disable=W0223
 
+# streamed exports are sent in chunks of about this many bytes.
+# callers can change this global.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# returned by getCacheStartTime() for exports that start at the current time
+CACHE_NOW = 'now'
+
+
+def bufferChunks(pieces, chunkSize=None):
+    """
+    Join the strings yielded by *pieces* into chunks of about
+    *chunkSize* bytes, so a streamed response is not written a few
+    bytes at a time.
+    """
+    if chunkSize is None:
+        chunkSize = STREAM_CHUNK_SIZE
+    buf = []
+    size = 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunkSize:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf)
+
+
+def writeChunksToPath(chunks, path):
+    with open(path, 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+
 
 class PlanExporter(object):
     """
@@ -45,28 +78,64 @@ class PlanExporter(object):
     the serializeExportedObject() method.
 
     You can use opts to pass in a dictonary for extra options.
+
+    Exporters that can produce their text incrementally set streaming =
+    True and override iterExportDbPlan(); their HTTP responses and files
+    are then written chunk by chunk.
     """
 
     label = 'Describe the type of file the class exports. Set in subclasses.'
     content_type = 'The MIME type of the file the class exports. Set in subclasses.'
+    streaming = False
 
     def exportDbPlan(self, dbPlan, request):
         raise NotImplementedError()
 
     def serializeExportedObject(self, obj):
         return obj
-    
+
+    def iterExportDbPlan(self, dbPlan, request):
+        """
+        Return an iterator over chunks of the export text.
+        """
+        return iter([self.serializeExportedObject(self.exportDbPlan(dbPlan, request))])
+
     def getHttpResponse(self, dbPlan, attachmentName=None, request=None):
-        obj = self.exportDbPlan(dbPlan, request)
-        text = self.serializeExportedObject(obj)
-        response = HttpResponse(text,
-                                content_type=self.content_type)
+        return self.makeHttpResponse(self.iterExportDbPlan(dbPlan, request), attachmentName)
+
+    def makeHttpResponse(self, chunks, attachmentName=None):
+        """
+        Return the HTTP response for export text given as an iterator
+        over chunks, e.g. from iterExportDbPlan() or the export cache.
+        """
+        if self.streaming:
+            response = StreamingHttpResponse(chunks,
+                                             content_type=self.content_type)
+        else:
+            response = HttpResponse(''.join(chunks),
+                                    content_type=self.content_type)
         if attachmentName is not None:
             response['Content-disposition'] = 'attachment; filename=%s' % attachmentName
         return response
 
+    def getCacheVariant(self, request):
+        """
+        Return a string naming what, besides the plan, the export text
+        depends on in *request*, for the export cache key.
+        """
+        return ''
+
+    def getCacheStartTime(self, dbPlan, startTime):
+        """
+        Return the start time the export of *dbPlan* depends on, given
+        the *startTime* requested (or None), for the export cache key.
+        Exporters whose output depends on the current time return
+        CACHE_NOW, and their exports are not cached.
+        """
+        return None
+
     def exportDbPlanToPath(self, dbPlan, path, request):
-        open(path, 'wb').write(self.serializeExportedObject(self.exportDbPlan(dbPlan, request)))
+        writeChunksToPath(self.iterExportDbPlan(dbPlan, request), path)
 
     def initPlan(self, plan, context):
         """
@@ -89,6 +158,72 @@ class JsonPlanExporter(PlanExporter):
                           indent=4)
 
 
+class WalkContext(object):
+    """
+    The context passed to the transform*() methods of a
+    TreeWalkPlanExporter.
+
+    Attributes are read like a DotDict: missing attributes are None,
+    and context['foo'] is the same as context.foo. Each element of the
+    walk gets a child frame from child(). A frame stores only the
+    attributes set on it and looks up the rest along its parent chain,
+    so descending the tree never copies the context.
+    """
+
+    __slots__ = ('_parentContext', '_extras',
+                 'plan', 'schema', 'stations',
+                 'stationIndex', 'parent', 'station', 'segment',
+                 'prevStation', 'nextStation',
+                 'command', 'commandIndex')
+
+    def __init__(self, parentContext=None, **kwargs):
+        object.__setattr__(self, '_parentContext', parentContext)
+        object.__setattr__(self, '_extras', None)
+        for key, val in kwargs.iteritems():
+            setattr(self, key, val)
+
+    def child(self, **kwargs):
+        return WalkContext(self, **kwargs)
+
+    def __getattr__(self, key):
+        # only called when key is an unset slot or not a slot at all
+        if key.startswith('__'):
+            raise AttributeError(key)
+        if self._extras is not None and key in self._extras:
+            return self._extras[key]
+        if self._parentContext is None:
+            return None
+        return getattr(self._parentContext, key)
+
+    def __setattr__(self, key, val):
+        try:
+            object.__setattr__(self, key, val)
+        except AttributeError:
+            if self._extras is None:
+                object.__setattr__(self, '_extras', {})
+            self._extras[key] = val
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, val):
+        setattr(self, key, val)
+
+    def __contains__(self, key):
+        # 'transform' in context, as on the DotDict context this replaced
+        return getattr(self, key) is not None
+
+    def get(self, key, defaultVal=None):
+        val = getattr(self, key)
+        if val is None:
+            return defaultVal
+        return val
+
+    def copy(self):
+        # kept for exporters written against the old DotDict context
+        return self.child()
+
+
 class TreeWalkPlanExporter(PlanExporter):
     """
     A base class for plan exporters that walk the xpjson.Plan syntax
@@ -123,8 +258,14 @@ class TreeWalkPlanExporter(PlanExporter):
     def transformPlan(self, plan, tsequence, context):
         return plan
 
-    def getBracketingStations(self, plan, segmentIndex, isStation=False):
-        stations = [s for s in plan.sequence if s.type == 'Station']
+    def getStations(self, plan):
+        return [s for s in plan.get("sequence", []) if s.type == 'Station']
+
+    def getBracketingStations(self, plan, segmentIndex, isStation=False, stations=None):
+        # building the station list is O(n); exportPlanInternal() builds
+        # it once and passes it in so the walk stays linear.
+        if stations is None:
+            stations = self.getStations(plan)
         prevStation = None
         if segmentIndex > 0:
             try:
@@ -146,11 +287,10 @@ class TreeWalkPlanExporter(PlanExporter):
     def exportStation(self, station, context):
         tsequence = []
         if hasattr(station, 'commands'):
-            station.sequence = convertToDotDictRecurse(station.commands)
+            # xpjson.PathElement already converted the commands
+            station.sequence = station.commands
             for i, cmd in enumerate(station.sequence):
-                ctx = context.copy()
-                ctx.command = cmd
-                ctx.commandIndex = i
+                ctx = context.child(command=cmd, commandIndex=i)
                 tsequence.append(self.transformStationCommand(cmd, ctx))
         else:
             station.sequence = []
@@ -159,61 +299,98 @@ class TreeWalkPlanExporter(PlanExporter):
     def exportSegment(self, segment, context):
         tsequence = []
         if hasattr(segment, 'commands'):
-            segment.sequence = convertToDotDictRecurse(segment.commands)
+            segment.sequence = segment.commands
             for i, cmd in enumerate(segment.sequence):
-                ctx = context.copy()
-                ctx.command = cmd
-                ctx.commandIndex = i
+                ctx = context.child(command=cmd, commandIndex=i)
                 tsequence.append(self.transformSegmentCommand(cmd, ctx))
         else:
             segment.sequence = []
         return self.transformSegment(segment, tsequence, context)
 
     def exportPlan(self, plan, schema):
-        context = DotDict({
-            'plan': plan
-        })
-        context.schema = schema
+        context = WalkContext(plan=plan, schema=schema)
         self.initPlan(plan, context)
         return self.exportPlanInternal(plan, context)
 
     def exportPlanInternal(self, plan, context):
+        tsequence = list(self.iterExportSequence(plan, context))
+        return self.transformPlan(plan, tsequence, context)
+
+    def iterExportSequence(self, plan, context):
+        """
+        Yield the exported elements of the plan sequence one at a time.
+        Streaming exporters use this in place of exportPlanInternal() so
+        they never hold the whole transformed sequence.
+        """
         index = 0
-        tsequence = []
+        context.stations = stations = self.getStations(plan)
         for elt in plan.get("sequence", []):
-            ctx = context.copy()
-            ctx.stationIndex = index
             if elt.type == 'Station':
-                ctx.parent = ctx.station = elt
-                ctx.prevStation, ctx.nextStation = self.getBracketingStations(plan, index, True)
+                prevStation, nextStation = self.getBracketingStations(plan, index, True, stations)
+                ctx = context.child(stationIndex=index,
+                                    parent=elt,
+                                    station=elt,
+                                    prevStation=prevStation,
+                                    nextStation=nextStation)
                 exported_station = self.exportStation(elt, ctx)
                 if exported_station:
-                    tsequence.append(exported_station)
+                    yield exported_station
             elif elt.type == 'Segment':
-                ctx.parent = ctx.segment = elt
-                ctx.prevStation, ctx.nextStation = self.getBracketingStations(plan, index)
+                prevStation, nextStation = self.getBracketingStations(plan, index, stations=stations)
+                ctx = context.child(stationIndex=index,
+                                    parent=elt,
+                                    segment=elt,
+                                    prevStation=prevStation,
+                                    nextStation=nextStation)
                 exported_segment = self.exportSegment(elt, ctx)
                 if exported_segment:
-                    tsequence.append(exported_segment)
+                    yield exported_segment
             else:
                 print 'exportPlan: cannot process element of type %s in Plan.sequence' % elt.type
 
             if elt.type == 'Station':
                 index += 1
 
-        return self.transformPlan(plan, tsequence, context)
-
-    def exportDbPlan(self, dbPlan, request):
+    def loadDbPlan(self, dbPlan, request):
+        """
+        Return the xpjson plan and schema for *dbPlan*.
+        """
         try:
             platform = dbPlan.jsonPlan['platform']
             planSchema = models.getPlanSchema(platform["name"])
             plan = dbPlan.toXpjson()
             self.request = request
-            return self.exportPlan(plan, planSchema.getSchema())
+            return plan, planSchema.getSchema()
         except:
             logging.warning('exportDbPlan: could not save plan %s', dbPlan.name)
             raise  # FIX
 
+    def exportDbPlan(self, dbPlan, request):
+        plan, schema = self.loadDbPlan(dbPlan, request)
+        return self.exportPlan(plan, schema)
+
+    def iterPlanText(self, plan, context):
+        """
+        Yield the text of the export in pieces. Streaming exporters
+        override this to build the document from iterExportSequence().
+        """
+        yield self.serializeExportedObject(self.exportPlanInternal(plan, context))
+
+    def iterExportPlan(self, plan, schema):
+        """
+        Like exportPlan(), but return an iterator over chunks of the
+        export text.
+        """
+        context = WalkContext(plan=plan, schema=schema)
+        self.initPlan(plan, context)
+        return bufferChunks(self.iterPlanText(plan, context))
+
+    def iterExportDbPlan(self, dbPlan, request):
+        # load the plan before the response starts, so errors still
+        # produce an error response
+        plan, schema = self.loadDbPlan(dbPlan, request)
+        return self.iterExportPlan(plan, schema)
+
 
 class ExamplePlanExporter(JsonPlanExporter, TreeWalkPlanExporter):
     """
@@ -282,6 +459,10 @@ class BearingDistanceJsonPlanExporter(JsonPlanExporter, TreeWalkPlanExporter):
 
     label = 'bdJson'
 
+    def initPlan(self, plan, context):
+        import statsPlanExporter  # delayed import avoids import loop
+        self.stationDistances = statsPlanExporter.getStationDistancesMeters(plan)
+
     def transformPlan(self, plan, tsequence, context):
         return {'creator': plan.creator, # TODO the actual user is stored in the db plan
                 'dateCreated': plan.dateCreated,
@@ -332,10 +513,13 @@ class BearingDistanceJsonPlanExporter(JsonPlanExporter, TreeWalkPlanExporter):
         if derivedInfo:
             distanceMeters = derivedInfo['distanceMeters']
             durationSeconds = derivedInfo['durationSeconds']
+        elif not 0 < context.stationIndex <= len(self.stationDistances):
+            # no station on one end of the segment; index -1 would wrap around
+            distanceMeters = 0
+            durationSeconds = 0
         else:
-            plon, plat = context.prevStation.geometry['coordinates']
-            nlon, nlat = context.nextStation.geometry['coordinates']
-            distanceMeters = geomath.getLength(geomath.calculateDiffMeters([plon, plat], [nlon, nlat]))
+            # the segment runs from station stationIndex - 1 to station stationIndex
+            distanceMeters = float(self.stationDistances[context.stationIndex - 1])
             speed = context.plan._objDict['defaultSpeed']
             try:
                 speed = segment._objDict['hintedSpeed']
@@ -396,10 +580,18 @@ class BearingDistanceCRSJsonPlanExporter(BearingDistanceJsonPlanExporter):
 
     def initPlan(self, plan, context):
         super(BearingDistanceCRSJsonPlanExporter, self).initPlan(plan, context)
+        self.stationCrsCoordinates = None
         if plan.site.alternateCrs:
             plan.site.crs = plan.site.alternateCrs
             plan.site.alternateCrs = None
             context['transform'] = xpjson.getCrsTransform(plan.site.crs)
+            # convert every station in one call rather than one at a time
+            # during the walk
+            import statsPlanExporter  # delayed import avoids import loop
+            self.stationCrsCoordinates = xpjson.transformPoints(context['transform'],
+                                                                statsPlanExporter.getStationCoordinates(plan))
 
     def getStationGeometry(self, station, context):
-        return {'coordinates':context['transform'](station.geometry['coordinates'])}
\ No newline at end of file
+        if self.stationCrsCoordinates is None:
+            return station.geometry
+        return {'coordinates': self.stationCrsCoordinates[context.stationIndex]}
\ No newline at end of file
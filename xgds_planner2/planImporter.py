@@ -17,7 +17,6 @@
 import os
 import time
 import datetime
-import json
 import copy
 
 from django.conf import settings
@@ -25,7 +24,7 @@ from django.conf import settings
 from geocamUtil.dotDict import convertToDotDictRecurse
 from geocamUtil.loader import getModelByName
 
-from xgds_planner2 import models, xpjson
+from xgds_planner2 import jsonCodec, models, xpjson
 from xgds_planner2.fillIdsPlanExporter import FillIdsPlanExporter
 
 # Please don't put lines like this at the root of modules, this breaks testing
@@ -54,6 +53,20 @@ def planDocFromPlanDict(planDict, schema):
     return fillIds.exportPlan(planDoc, schema)
 
 
+def setNameFromId(dbPlan):
+    """
+    Name the newly imported *dbPlan* after the id its importer filled in,
+    as every plan created or imported in the planner is named.
+    """
+    planId = dbPlan.jsonPlan.id
+    dbPlan.jsonPlan["name"] = planId
+    dbPlan.jsonPlan["uuid"] = dbPlan.uuid
+    dbPlan.name = planId
+    if dbPlan.routeGeometry:
+        dbPlan.routeGeometry.properties.name = planId
+    return dbPlan
+
+
 class PlanImporter(object):
     """
     Abstract class that defines the API for plan importers.
@@ -130,7 +143,7 @@ class XPJsonPlanImporter(PlanImporter):
 
 
 def planDocCleanSimInfo(rawData):
-    data = json.loads(rawData)
+    data = jsonCodec.loads(rawData)
 
     if '_simInfo' in data:
         del data['_simInfo']
@@ -0,0 +1,362 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+The plan index: a JSON summary of every non-deleted plan, served by
+planIndexJson and embedded in the planner pages.
+
+Building it reads only the summary columns (never the jsonPlan or stats
+blobs) in one query joined with the creator. The result is kept in the
+Django cache named by XGDS_PLANNER_PLAN_INDEX_CACHE and invalidated by
+the plan model's post_save and post_delete signals.
+
+For installations with too many plans to list at once, getPlanPage()
+and iterPlans() page through a filtered listing with keyset cursors
+over the indexed dateModified and name columns or the creator's
+username, so each page costs the same however large the table is.
+"""
+
+import base64
+import datetime
+import hashlib
+import json
+
+import pytz
+from dateutil.parser import parse as dateparser
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+
+from geocamUtil.loader import LazyGetModelByName
+
+from xgds_planner2 import jsonCodec
+from xgds_planner2.models import getIntersectingBboxQ
+
+PLAN_MODEL = LazyGetModelByName(settings.XGDS_PLANNER_PLAN_MODEL)
+
+# invalidation bumps the generation instead of deleting the index, so
+# an index built from a query that raced with a save is stored under a
+# stale key and never served.
+GENERATION_KEY = 'xgds_planner2.planIndex.generation'
+INDEX_KEY = 'xgds_planner2.planIndex.%s'
+
+INDEX_FIELDS = ('pk',
+                'uuid',
+                'name',
+                'dateModified',
+                'creator__username',
+                'numStations',
+                'numSegments',
+                'numCommands',
+                'lengthMeters',
+                'estimatedDurationSeconds')
+
+
+def getCache():
+    return caches[settings.XGDS_PLANNER_PLAN_INDEX_CACHE]
+
+
+def getGeneration(cache):
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 0, None)
+        generation = cache.get(GENERATION_KEY, 0)
+    return generation
+
+
+# sort keys accepted by getPlanPage(), mapped to model fields. prefix
+# with '-' for descending order.
+PLAN_LIST_SORTS = {'dateModified': 'dateModified',
+                   'name': 'name',
+                   'creator': 'creator__username'}
+PLAN_LIST_NULLABLE_SORTS = ('creator__username',)
+
+# callers can change these globals.
+PLAN_LIST_DEFAULT_LIMIT = 100
+PLAN_LIST_MAX_LIMIT = 1000
+
+
+class PlanListError(ValueError):
+    pass
+
+
+def getPlanSummary(row):
+    """
+    Return the index entry for *row*, a dict of INDEX_FIELDS from
+    values().
+    """
+    return {
+        'id': row['pk'],
+        'uuid': row['uuid'],
+        'name': row['name'],
+        'url': reverse('planner2_plan_save_json', args=[row['pk'], row['name']]),
+        'dateModified': row['dateModified'].isoformat(),
+        'creator': row['creator__username'] or "",
+        'numStations': row['numStations'],
+        'numSegments': row['numSegments'],
+        'numCommands': row['numCommands'],
+        'lengthMeters': row['lengthMeters'],
+        'estimatedDurationsSeconds': row['estimatedDurationSeconds']
+    }
+
+
+def buildPlanIndex():
+    """
+    Return the list of plan summaries, newest first.
+    """
+    rows = PLAN_MODEL.get().objects.filter(deleted=False).values(*INDEX_FIELDS)
+    return [getPlanSummary(row) for row in rows]
+
+
+def getPlanIndex():
+    """
+    Return the cached plan index as a dict with 'json' (the serialized
+    list of plan summaries), 'etag' and 'lastModified', building it if
+    need be.
+    """
+    cache = getCache()
+    key = INDEX_KEY % getGeneration(cache)
+    index = cache.get(key)
+    if index is None:
+        text = jsonCodec.dumps(buildPlanIndex())
+        index = {'json': text,
+                 'etag': hashlib.md5(text).hexdigest(),
+                 'lastModified': datetime.datetime.now(pytz.utc).replace(microsecond=0)}
+        cache.set(key, index, settings.XGDS_PLANNER_PLAN_INDEX_TIMEOUT)
+    return index
+
+
+def invalidatePlanIndex(sender=None, **kwargs):
+    cache = getCache()
+    getGeneration(cache)
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # the generation was evicted between the two calls
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def connectSignals():
+    planModel = PLAN_MODEL.get()
+    post_save.connect(invalidatePlanIndex, sender=planModel,
+                      dispatch_uid='xgds_planner2.planIndex.post_save')
+    post_delete.connect(invalidatePlanIndex, sender=planModel,
+                        dispatch_uid='xgds_planner2.planIndex.post_delete')
+
+
+def parseBool(val):
+    if val.lower() in ('1', 'true', 'yes'):
+        return True
+    if val.lower() in ('0', 'false', 'no'):
+        return False
+    raise PlanListError('expected a boolean, got %r' % val)
+
+
+def parseDate(val):
+    try:
+        result = dateparser(val)
+    except (ValueError, OverflowError):
+        raise PlanListError('expected a date, got %r' % val)
+    if result.tzinfo is None:
+        result = pytz.utc.localize(result)
+    return result
+
+
+def parseBbox(val):
+    try:
+        bbox = [float(v) for v in val.split(',')]
+    except ValueError:
+        bbox = None
+    if not bbox or len(bbox) != 4:
+        raise PlanListError('expected bbox=west,south,east,north, got %r' % val)
+    return bbox
+
+
+def filterPlans(queryset,
+                platform=None,
+                site=None,
+                creator=None,
+                readOnly=None,
+                modifiedAfter=None,
+                modifiedBefore=None,
+                bbox=None):
+    """
+    Restrict *queryset* to non-deleted plans matching the given filters.
+    *creator* is a username; the dates may be datetimes or strings;
+    *bbox* is [west, south, east, north] or the same as a comma-separated
+    string, and selects plans whose route intersects it.
+    """
+    queryset = queryset.filter(deleted=False)
+    if bbox:
+        if isinstance(bbox, basestring):
+            bbox = parseBbox(bbox)
+        queryset = queryset.filter(getIntersectingBboxQ(bbox))
+    if platform:
+        queryset = queryset.filter(platformName=platform)
+    if site:
+        queryset = queryset.filter(siteId=site)
+    if creator:
+        queryset = queryset.filter(creator__username=creator)
+    if readOnly is not None:
+        if isinstance(readOnly, basestring):
+            readOnly = parseBool(readOnly)
+        queryset = queryset.filter(readOnly=readOnly)
+    if modifiedAfter:
+        if isinstance(modifiedAfter, basestring):
+            modifiedAfter = parseDate(modifiedAfter)
+        queryset = queryset.filter(dateModified__gte=modifiedAfter)
+    if modifiedBefore:
+        if isinstance(modifiedBefore, basestring):
+            modifiedBefore = parseDate(modifiedBefore)
+        queryset = queryset.filter(dateModified__lt=modifiedBefore)
+    return queryset
+
+
+def getFilterArgs(params):
+    """
+    Extract the filterPlans() keyword args from request parameters.
+    """
+    names = ('platform', 'site', 'creator', 'readOnly', 'modifiedAfter', 'modifiedBefore', 'bbox')
+    return dict(((name, params[name]) for name in names if params.get(name)))
+
+
+def parseSort(sort):
+    descending = sort.startswith('-')
+    key = sort.lstrip('-')
+    if key not in PLAN_LIST_SORTS:
+        raise PlanListError('unknown sort %r, expected one of %s'
+                            % (sort, ', '.join(sorted(PLAN_LIST_SORTS))))
+    return PLAN_LIST_SORTS[key], descending
+
+
+def getSortValue(item, field):
+    if isinstance(item, dict):
+        return item[field]
+    if field == 'creator__username':
+        return item.creator.username if item.creator_id else None
+    return getattr(item, field)
+
+
+def encodeCursor(value, pk):
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, pk]))
+
+
+def decodeCursor(cursor, field):
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise PlanListError('invalid cursor')
+    if field == 'dateModified':
+        value = parseDate(value)
+    return value, pk
+
+
+def getAfterCursorQ(field, descending, value, pk):
+    """
+    Return a Q selecting the rows that sort after (value, pk) in the
+    order (field, pk), both ascending or both descending. NULLs sort
+    where the database puts them.
+    """
+    nullsLargest = connection.features.nulls_order_largest
+    if descending:
+        beyond, pkBeyond = '__lt', Q(pk__lt=pk)
+        nullsAfter = not nullsLargest
+    else:
+        beyond, pkBeyond = '__gt', Q(pk__gt=pk)
+        nullsAfter = nullsLargest
+
+    if value is None:
+        result = Q(**{field + '__isnull': True}) & pkBeyond
+        if not nullsAfter:
+            result |= Q(**{field + '__isnull': False})
+        return result
+
+    result = Q(**{field + beyond: value}) | (Q(**{field: value}) & pkBeyond)
+    if nullsAfter and field in PLAN_LIST_NULLABLE_SORTS:
+        result |= Q(**{field + '__isnull': True})
+    return result
+
+
+def getPlanPage(queryset, sort='-dateModified', cursor=None, limit=None):
+    """
+    Return (items, nextCursor) for one page of *queryset* (plan objects
+    or values() dicts including 'pk' and the sort field) in the order
+    given by *sort*. Pass nextCursor back to get the following page; it
+    is None on the last page.
+    """
+    field, descending = parseSort(sort)
+    if limit is None:
+        limit = PLAN_LIST_DEFAULT_LIMIT
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise PlanListError('expected an integer limit, got %r' % limit)
+    if limit < 1 or limit > PLAN_LIST_MAX_LIMIT:
+        raise PlanListError('limit must be between 1 and %d' % PLAN_LIST_MAX_LIMIT)
+
+    if cursor:
+        value, pk = decodeCursor(cursor, field)
+        queryset = queryset.filter(getAfterCursorQ(field, descending, value, pk))
+    prefix = '-' if descending else ''
+    queryset = queryset.order_by(prefix + field, prefix + 'pk')
+
+    # fetch one extra row to learn whether there is another page
+    items = list(queryset[:limit + 1])
+    nextCursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        nextCursor = encodeCursor(getSortValue(last, field),
+                                  last['pk'] if isinstance(last, dict) else last.pk)
+    return items, nextCursor
+
+
+def iterPlans(queryset, sort='-dateModified', pageSize=None):
+    """
+    Yield every item of *queryset* in *sort* order, one page at a time.
+    """
+    cursor = None
+    while True:
+        items, cursor = getPlanPage(queryset, sort, cursor, pageSize)
+        for item in items:
+            yield item
+        if cursor is None:
+            break
+
+
+def getPlanListPage(params):
+    """
+    Return the plan summaries and next cursor for the request
+    parameters *params*: the filterPlans() filters plus sort, cursor
+    and limit.
+    """
+    queryset = filterPlans(PLAN_MODEL.get().objects.all(), **getFilterArgs(params))
+    sort = params.get('sort', '-dateModified')
+    field, _descending = parseSort(sort)
+    fields = INDEX_FIELDS
+    if field not in fields:
+        fields = fields + (field,)
+    rows, nextCursor = getPlanPage(queryset.values(*fields),
+                                   sort,
+                                   params.get('cursor'),
+                                   params.get('limit'))
+    return [getPlanSummary(row) for row in rows], nextCursor
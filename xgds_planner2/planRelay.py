@@ -0,0 +1,128 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Wire format for plans relayed between servers (plan_save_json ->
+addRelay -> plan_save_from_relay).
+
+The relay fields used to carry the plan as a JSON string inside JSON,
+so every quote was escaped twice, and the receiver recomputed all the
+stats of the plan. Now the field RELAY_FIELD carries, base64 encoded
+and gzip-compressed if XGDS_PLANNER_RELAY_GZIP is set:
+
+ a header line  JSON: format version, sha256 of the plan text, and the
+                columns the sender derived from the plan (see
+                AbstractPlan.getPrecomputedFields())
+ the plan text  the canonical JSON of jsonPlan, encoded once
+
+The hash only detects a payload damaged in transit. It does not prove
+that the derived columns match the plan text: anyone who can post to
+the relay endpoint can send any columns with a matching hash. The
+receiver takes the columns as they are, instead of recomputing them,
+unless they were computed against a different plan schema and library
+(see AbstractPlan.extractFromJson()).
+
+Receivers that predate this module only read the old LEGACY_FIELD.
+Upgrade the receivers before the senders: an upgraded receiver still
+accepts payloads with only LEGACY_FIELD (see
+views.plan_save_from_relay()). A sender that must relay to receivers
+not yet upgraded can set XGDS_PLANNER_RELAY_LEGACY_FIELD, which also
+sends the plan text, double-encoded as before, in LEGACY_FIELD. It is
+off by default since it more than doubles the payload.
+"""
+
+import base64
+import hashlib
+import zlib
+
+from django.conf import settings
+
+from xgds_planner2 import jsonCodec
+
+RELAY_FIELD = 'planRelay'
+RELAY_ENCODING_FIELD = 'planRelayEncoding'
+RELAY_FORMAT_VERSION = 1
+LEGACY_FIELD = 'jsonPlan'
+
+# zlib window bits that read and write the gzip format
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class PlanRelayError(ValueError):
+    pass
+
+
+def getPlanHash(planText):
+    return hashlib.sha256(planText).hexdigest()
+
+
+def getRelayFields(plan, planText=None):
+    """
+    Return the relay fields for saved *plan*, a dict for the relay's
+    serialized data. *planText* is the JSON of plan.jsonPlan, if the
+    caller has it already.
+    """
+    if planText is None:
+        planText = jsonCodec.dumps(plan.jsonPlan)
+    if isinstance(planText, unicode):
+        planText = planText.encode('utf-8')
+    header = {'version': RELAY_FORMAT_VERSION,
+              'planHash': getPlanHash(planText),
+              'precomputed': plan.getPrecomputedFields()}
+    payload = jsonCodec.dumps(header) + '\n' + planText
+    if settings.XGDS_PLANNER_RELAY_GZIP:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+        payload = compressor.compress(payload) + compressor.flush()
+        encoding = 'gzip'
+    else:
+        encoding = 'identity'
+    result = {RELAY_FIELD: base64.b64encode(payload),
+              RELAY_ENCODING_FIELD: encoding}
+    if settings.XGDS_PLANNER_RELAY_LEGACY_FIELD:
+        result[LEGACY_FIELD] = planText
+    return result
+
+
+def dumpRelayData(plan, planText=None):
+    """
+    Return the serialized data to hand to addRelay() for *plan*.
+    """
+    return jsonCodec.dumps(getRelayFields(plan, planText))
+
+
+def decodeRelayFields(fields):
+    """
+    Return (planText, precomputed) from the relay *fields* (e.g.
+    request.POST), raising PlanRelayError if they were damaged in
+    transit or are of an unknown version. A matching hash says nothing
+    about whether precomputed is right for planText.
+    """
+    encoding = fields.get(RELAY_ENCODING_FIELD, 'identity')
+    if encoding not in ('gzip', 'identity'):
+        raise PlanRelayError('unknown relay encoding %r' % encoding)
+    try:
+        payload = base64.b64decode(str(fields[RELAY_FIELD]))
+        if encoding == 'gzip':
+            payload = zlib.decompress(payload, GZIP_WBITS)
+        headerText, planText = payload.split('\n', 1)
+        header = jsonCodec.loadsDotDict(headerText)
+    except (TypeError, ValueError, zlib.error), e:
+        raise PlanRelayError('could not decode relayed plan: %s' % e)
+    if header.get('version') != RELAY_FORMAT_VERSION:
+        raise PlanRelayError('unknown relay format version %r' % header.get('version'))
+    if getPlanHash(planText) != header.get('planHash'):
+        raise PlanRelayError('relayed plan does not match its hash')
+    return planText, header.get('precomputed')
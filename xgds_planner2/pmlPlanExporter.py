@@ -18,15 +18,25 @@
 import datetime
 import pytz
 
-import logging
 import os
 import re
 
 from xml.sax.saxutils import escape
 from django.conf import settings
-from xgds_planner2.planExporter import TreeWalkPlanExporter
+from xgds_planner2.planExporter import TreeWalkPlanExporter, CACHE_NOW
 from xgds_planner2.models import getPlanSchema
-from geocamUtil.dotDict import convertToDotDictRecurse, DotDict
+from geocamUtil.dotDict import DotDict
+
+PML_DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<PML>
+    <Plan>
+        <Children>
+        %s
+        </Children>
+    </Plan>
+</PML>
+"""
+PML_DOCUMENT_HEAD, PML_DOCUMENT_TAIL = PML_DOCUMENT.split('%s')
 
 from geocamUtil.geomath import calculateDiffMeters, getLength
 
@@ -36,28 +46,35 @@ class PmlPlanExporter(TreeWalkPlanExporter):
     """
     label = 'pml'
     content_type = 'application/xml'
+    streaming = True
     stationCounter = 0
     segmentCounter = 0
 
     startTime = None
     vehicle = None
     
-    def exportDbPlan(self, dbPlan):
+    def loadDbPlan(self, dbPlan, request):
+        plan, schema = super(PmlPlanExporter, self).loadDbPlan(dbPlan, request)
+        try:
+            if dbPlan.executions.count():
+                pe = dbPlan.executions.first()
+                self.startTime = pe.planned_start_time
+                self.vehicle = str(pe.flight.vehicle.name)
+        except:
+            pass
+        return plan, schema
+
+    def getCacheStartTime(self, dbPlan, startTime):
+        # the same precedence as loadDbPlan() and initPlan(): the planned
+        # start of the first execution, the requested time, then now
         try:
-            platform = dbPlan.jsonPlan['platform']
-            planSchema = getPlanSchema(platform["name"])
-            plan = dbPlan.toXpjson()
-            try:
-                if dbPlan.executions.count():
-                    pe = dbPlan.executions.first()
-                    self.startTime = pe.planned_start_time
-                    self.vehicle = str(pe.flight.vehicle.name)
-            except:
-                pass
-            return self.exportPlan(plan, planSchema.getSchema())
+            if dbPlan.executions.count():
+                startTime = dbPlan.executions.first().planned_start_time
         except:
-            logging.warning('exportDbPlan: could not save plan %s', dbPlan.name)
-            raise  # FIX
+            pass
+        if not startTime:
+            return CACHE_NOW
+        return startTime
 
     def initPlan(self, plan, context):
         if not self.startTime:
@@ -90,23 +107,24 @@ class PmlPlanExporter(TreeWalkPlanExporter):
             self.ROTATION_ADDITION = 0.0
 
 
-    def wrapDocument(self, text):
-        content = ""
+    def iterActivities(self, text):
         for entry in text:
             if isinstance(entry, basestring):
-                content = content + entry
+                yield entry
             elif isinstance(entry, list):
                 for a in entry:
-                    content = content + a
-        return ("""<?xml version="1.0" encoding="UTF-8"?>
-<PML>
-    <Plan>
-        <Children>
-        %s
-        </Children>
-    </Plan>
-</PML>
-""" % content)
+                    yield a
+
+    def wrapDocument(self, text):
+        return PML_DOCUMENT % ''.join(self.iterActivities(text))
+
+    def iterPlanText(self, plan, context):
+        # the activities are written as the walk produces them; the
+        # order of the walk matters, since it accumulates startTime.
+        yield PML_DOCUMENT_HEAD
+        for activity in self.iterActivities(self.iterExportSequence(plan, context)):
+            yield activity
+        yield PML_DOCUMENT_TAIL
 
     def getDurationString(self, seconds):
         mins, secs = divmod(seconds, 60)
@@ -239,10 +257,8 @@ class PmlPlanExporter(TreeWalkPlanExporter):
         """
         tsequence = []
         tsequence.append(self.transformStation(station, tsequence, context))
-        for i, cmd in enumerate(convertToDotDictRecurse(station.commands)):
-            ctx = context.copy()
-            ctx.command = cmd
-            ctx.commandIndex = i
+        for i, cmd in enumerate(getattr(station, 'commands', [])):
+            ctx = context.child(command=cmd, commandIndex=i)
             tsequence.append(self.transformStationCommand(cmd, ctx))
         return tsequence
 
@@ -251,10 +267,8 @@ class PmlPlanExporter(TreeWalkPlanExporter):
         For a segment, the activities come first and then the timing for the drive.
         """
         tsequence = []
-        for i, cmd in enumerate(convertToDotDictRecurse(segment.commands)):
-            ctx = context.copy()
-            ctx.command = cmd
-            ctx.commandIndex = i
+        for i, cmd in enumerate(getattr(segment, 'commands', [])):
+            ctx = context.child(command=cmd, commandIndex=i)
             tsequence.append(self.transformSegmentCommand(cmd, ctx))
         tsequence.append(self.transformSegment(segment, tsequence, context))
         return tsequence
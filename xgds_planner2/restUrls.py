@@ -21,6 +21,9 @@ from xgds_planner2 import views
 urlpatterns = [
     url(r'^planIndex\.kml$', views.getPlanIndexKml, {}, name='planner2_planIndexKml'),
     url(r'^planIndexJson$', views.getPlanIndexJson, {}, name='planner2_planIndexJson'),
+    url(r'^planList\.json$', views.getPlanListJson, {}, name='planner2_planListJson'),
+    url(r'^planRoutes\.json$', views.getPlanRoutesJson, {}, name='planner2_planRoutesJson'),
+    url(r'^spatial/(?P<layer>plans|siteFrames)\.json$', views.getSpatialQueryJson, {}, name='planner2_spatialQueryJson'),
     url(r'^plan/(?P<plan_id>[^/]+)$', views.plan_save_from_relay, {}, name="planner2_save_plan_from_relay"),
     url(r'^plan/(?P<plan_id>[^/]+)/(?P<jsonPlanId>[^/\.]+)\.json$', views.plan_save_json, {}, name="planner2_plan_save_json"),
     url(r'^plan/save/(?P<plan_id>[^/]+)$', views.plan_save_json, {}, name="planner2_plan_save_json"),
@@ -28,6 +31,8 @@ urlpatterns = [
     url(r'^plan/export/ajaxByPK/(?P<uuid>[\w-]+)/(?P<name>[^/]+)$', views.planExport, {'isAjax': True, 'idIsPK': True}, name='planner2_planExport_ajax'),
     url(r'^plan/export/(?P<uuid>[\w-]+)/(?P<name>[^/]+)$', views.planExport, {}, name='planner2_planExport'),
     url(r'^plan/export/(?P<uuid>[\w-]+)/(?P<name>[^/]+)/(?P<time>([\w-]+([\w]+[:]+)+[\w]+)*)$', views.planExport, {}, name='planner2_planExportTime'),
+    url(r'^bulkExport\.zip$', views.getBulkExportZip, {}, name='planner2_bulkExportZip'),
+    url(r'^exportCacheStats\.json$', views.getExportCacheStatsJson, {}, name='planner2_exportCacheStatsJson'),
     url(r'^reportExportStatus/$', views.reportExportStatus, {}, name='planner2_report_export_status'),
     url(r'^schedulePlanActive/(?P<vehicleName>\w+)/(?P<planPK>[\d]+)$', views.schedulePlanActiveFlight, {}, "planner2_schedulePlan_active"),
     url(r'^relaySchedulePlan/$', views.relaySchedulePlan, {}, "planner2_relaySchedulePlan"),
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#  __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Benchmark for CRS conversion of plan stations.
+
+Converts the stations of a generated plan into the alternate CRS of the
+example library's site three ways: building a new transform per export
+and converting station by station (what the CRS exporters used to do),
+with the cached transform station by station, and with the cached
+transform in one batched call.
+"""
+
+import random
+import time
+
+from xgds_planner2 import xpjson
+
+
+def getSiteCrs():
+    library = xpjson.loadDictFromPath(xpjson.EXAMPLE_PLAN_LIBRARY_PATH)
+    return library.sites[0].alternateCrs
+
+
+def makeStationCoords(numStations, seed=0):
+    rng = random.Random(seed)
+    return [[-122.065 + rng.uniform(-0.005, 0.005), 37.42 + rng.uniform(-0.005, 0.005)]
+            for _ in xrange(numStations)]
+
+
+def convertUncached(crs, coords):
+    xform = xpjson.makeCrsTransform(crs)
+    return [xform(c) for c in coords]
+
+
+def convertCached(crs, coords):
+    xform = xpjson.getCrsTransform(crs)
+    return [xform(c) for c in coords]
+
+
+def convertBatched(crs, coords):
+    return xpjson.transformPoints(xpjson.getCrsTransform(crs), coords)
+
+
+def timeConvert(func, crs, coords, repeat):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        func(crs, coords)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    import optparse
+    parser = optparse.OptionParser('usage: %prog [opts]')
+    parser.add_option('-n', '--numStations',
+                      type='int', default=2000,
+                      help='Number of stations to convert [%default]')
+    parser.add_option('-r', '--repeat',
+                      type='int', default=5,
+                      help='Number of timing runs; the best is reported [%default]')
+    opts, args = parser.parse_args()
+    if args:
+        parser.error('expected no args')
+
+    crs = getSiteCrs()
+    coords = makeStationCoords(opts.numStations)
+
+    # the batched results must match the per-station ones
+    expected = convertCached(crs, coords[:10])
+    for (a, b), (c, d) in zip(expected, convertBatched(crs, coords[:10])):
+        assert abs(a - c) < 1e-6 and abs(b - d) < 1e-6
+
+    uncached = timeConvert(convertUncached, crs, coords, opts.repeat)
+    cached = timeConvert(convertCached, crs, coords, opts.repeat)
+    batched = timeConvert(convertBatched, crs, coords, opts.repeat)
+
+    print 'converted %d stations to %s' % (opts.numStations, crs.properties.label)
+    print '  %-28s %10s' % ('', 'time (s)')
+    print '  %-28s %10.4f' % ('new transform, per station', uncached)
+    print '  %-28s %10.4f' % ('cached, per station', cached)
+    print '  %-28s %10.4f' % ('cached, batched', batched)
+    print '  speedup: %.1fx' % (uncached / batched)
+
+
+if __name__ == '__main__':
+    main()
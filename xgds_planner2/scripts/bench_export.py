@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#  __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Scaling benchmark for TreeWalkPlanExporter.
+
+Times ExamplePlanExporter.exportPlan() on generated plans of increasing
+size. With the station list built once per export, the time per station
+should stay roughly flat as the plan grows. For comparison, plans up to
+--maxRebuild stations are also exported with the station list rebuilt
+for every element, as the walker used to do.
+
+planExporter imports the Django models, so run this with
+DJANGO_SETTINGS_MODULE set for your site.
+"""
+
+import copy
+import logging
+import time
+
+from xgds_planner2 import xpjson
+from xgds_planner2.planExporter import ExamplePlanExporter
+from bench_xpjson import makeLargePlanDict
+
+
+class RebuildStationsExporter(ExamplePlanExporter):
+    def getBracketingStations(self, plan, segmentIndex, isStation=False, stations=None):
+        return (super(RebuildStationsExporter, self)
+                .getBracketingStations(plan, segmentIndex, isStation))
+
+
+def timeExport(exporter, planDict, schema, repeat):
+    best = None
+    for _ in xrange(repeat):
+        plan = xpjson.loadDocumentFromDict(copy.deepcopy(planDict), schema=schema)
+        start = time.time()
+        exporter.exportPlan(plan, schema)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    import optparse
+    parser = optparse.OptionParser('usage: %prog [opts]')
+    parser.add_option('-s', '--sizes',
+                      default='100,1000,5000,20000',
+                      help='Comma-separated plan sizes in stations [%default]')
+    parser.add_option('-r', '--repeat',
+                      type='int', default=3,
+                      help='Number of timing runs; the best is reported [%default]')
+    parser.add_option('--maxRebuild',
+                      type='int', default=5000,
+                      help='Largest plan to time with per-element station rebuild [%default]')
+    opts, args = parser.parse_args()
+    if args:
+        parser.error('expected no args')
+
+    logging.disable(logging.WARNING)
+    schema = xpjson.loadDocument(xpjson.EXAMPLE_PLAN_SCHEMA_PATH)
+
+    print '%10s %12s %14s %12s' % ('stations', 'export (s)', 'us/station', 'rebuild (s)')
+    for numStations in [int(n) for n in opts.sizes.split(',')]:
+        planDict = makeLargePlanDict(numStations)
+        linear = timeExport(ExamplePlanExporter(), planDict, schema, opts.repeat)
+        if numStations <= opts.maxRebuild:
+            rebuild = '%12.4f' % timeExport(RebuildStationsExporter(), planDict, schema, opts.repeat)
+        else:
+            rebuild = '%12s' % '-'
+        print '%10d %12.4f %14.1f %s' % (numStations, linear, 1e6 * linear / numStations, rebuild)
+
+
+if __name__ == '__main__':
+    main()
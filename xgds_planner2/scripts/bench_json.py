@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Benchmark for the JSON serialization done per request, with each codec
+in jsonCodec.py whose library is installed.
+
+Replays the JSON work of the busiest views on a generated plan:
+
+ save    plan_save_json PUT: parse the body, dump the response and the
+         relayed copy
+ editor  plan_editor_app: dump the plan, links and named URLs
+ index   planIndexJson: dump the summaries of the plan index
+"""
+
+import time
+
+from bench_xpjson import makeLargePlanDict
+
+from xgds_planner2 import jsonCodec
+
+
+def makeIndex(numPlans):
+    return [{'uuid': 'c1a5e8f0-0000-4000-8000-%012d' % i,
+             'name': 'Plan %d' % i,
+             'url': '/xgds_planner2/plan/%d/Plan_%d.json' % (i, i),
+             'creator': 'creator%d' % (i % 20),
+             'dateModified': '2016-06-01T12:00:00Z',
+             'numStations': 40,
+             'numCommands': 120,
+             'lengthMeters': 1234.5 + i,
+             'estimatedDurationSeconds': 5400.0,
+             'bbox': [-122.07 + i * 1e-5, 37.41, -122.06 + i * 1e-5, 37.42]}
+            for i in xrange(numPlans)]
+
+
+def saveRequest(codec, body):
+    plan = codec.loads(body)
+    response = codec.dumps(plan)
+    relayed = codec.dumps({'jsonPlan': codec.dumps(plan)})
+    return response, relayed
+
+
+def editorRequest(codec, plan, links, namedURLs):
+    return codec.dumps(plan), codec.dumps(links), codec.dumps(namedURLs)
+
+
+def indexRequest(codec, index):
+    return codec.dumps(index)
+
+
+def timeRequest(func, args, repeat):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    import optparse
+    parser = optparse.OptionParser('usage: %prog [opts]')
+    parser.add_option('-n', '--numStations',
+                      type='int', default=500,
+                      help='Number of stations in the plan [%default]')
+    parser.add_option('-p', '--numPlans',
+                      type='int', default=5000,
+                      help='Number of plans in the index [%default]')
+    parser.add_option('-r', '--repeat',
+                      type='int', default=20,
+                      help='Number of timing runs; the best is reported [%default]')
+    opts, args = parser.parse_args()
+    if args:
+        parser.error('expected no args')
+
+    plan = makeLargePlanDict(opts.numStations)
+    body = jsonCodec.StdlibJsonCodec().dumps(plan)
+    links = dict((('%s export' % ext, '/xgds_planner2/plan/export/x/plan.%s' % ext)
+                  for ext in ('kml', 'pml', 'bdj', 'csv', 'json')))
+    namedURLs = [{'name': 'doc%d' % i, 'url': 'http://example.com/%d' % i} for i in xrange(5)]
+    index = makeIndex(opts.numPlans)
+
+    print 'plan of %d stations (%d bytes), index of %d plans' % (opts.numStations, len(body),
+                                                                 opts.numPlans)
+    print '  %-12s %10s %10s %10s   (ms per request)' % ('codec', 'save', 'editor', 'index')
+    for name in sorted(jsonCodec.CODEC_CLASSES):
+        try:
+            codec = jsonCodec.CODEC_CLASSES[name]()
+        except ImportError:
+            print '  %-12s not installed' % name
+            continue
+        # every codec must read back what it wrote
+        assert codec.loads(codec.dumps(plan)) == codec.loads(body)
+        save = timeRequest(saveRequest, (codec, body), opts.repeat)
+        editor = timeRequest(editorRequest, (codec, plan, links, namedURLs), opts.repeat)
+        indexTime = timeRequest(indexRequest, (codec, index), opts.repeat)
+        print '  %-12s %10.2f %10.2f %10.2f' % (name, save * 1000, editor * 1000, indexTime * 1000)
+    print 'default codec: %s' % jsonCodec.getCodec().name
+
+
+if __name__ == '__main__':
+    main()
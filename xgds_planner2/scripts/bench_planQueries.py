@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#  __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Compare the cost of loading the plan list the way the plan index page
+does (JSON blobs deferred except stats) against loading full rows.
+
+Runs against the database of your site, so set DJANGO_SETTINGS_MODULE.
+Memory is the growth of the process peak RSS while holding the loaded
+plans, so run each mode in a separate process (--mode) for a fair
+comparison.
+"""
+
+import resource
+import time
+
+import django
+
+
+def loadPlans(mode):
+    from django.conf import settings
+    from geocamUtil.loader import LazyGetModelByName
+    planModel = LazyGetModelByName(settings.XGDS_PLANNER_PLAN_MODEL).get()
+
+    queryset = planModel.objects.filter(deleted=False)
+    if mode == 'full':
+        queryset = queryset.withJson()
+    else:
+        queryset = queryset.withJson('stats')
+    plans = list(queryset)
+    # touch what the index page renders
+    for plan in plans:
+        plan.getSiteName()
+        plan.escapedName()
+        plan.getSummaryOfCommandsByType()
+    return plans
+
+
+def main():
+    import optparse
+    parser = optparse.OptionParser('usage: %prog [opts]')
+    parser.add_option('-m', '--mode',
+                      type='choice', choices=('deferred', 'full'), default='deferred',
+                      help='Load plans with the JSON blobs deferred or in full [%default]')
+    opts, args = parser.parse_args()
+    if args:
+        parser.error('expected no args')
+
+    django.setup()
+    rssBefore = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    plans = loadPlans(opts.mode)
+    elapsed = time.time() - start
+    rssAfter = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print 'loaded %d plans (%s)' % (len(plans), opts.mode)
+    print '  time:          %.4f s' % elapsed
+    print '  peak RSS grew: %d KB' % (rssAfter - rssBefore)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#  __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Benchmark for spatialIndex.GridIndex.
+
+Indexes generated plan bboxes scattered around a handful of sites and
+times bbox, radius and k-nearest queries against a linear scan over the
+same boxes. Needs no database.
+"""
+
+import random
+import time
+
+from xgds_planner2 import spatialIndex
+from xgds_planner2.spatialIndex import GridIndex, getDistanceToBboxMeters
+
+
+def makeBboxes(numPlans, numSites, seed=0):
+    rng = random.Random(seed)
+    sites = [(rng.uniform(-150, 150), rng.uniform(-60, 60)) for _ in xrange(numSites)]
+    result = []
+    for i in xrange(numPlans):
+        lon, lat = rng.choice(sites)
+        west = lon + rng.gauss(0, 0.1)
+        south = lat + rng.gauss(0, 0.1)
+        # routes of a few hundred meters to a few km
+        result.append(('plan%d' % i, (west, south,
+                                      west + rng.uniform(0.001, 0.03),
+                                      south + rng.uniform(0.001, 0.03))))
+    return sites, result
+
+
+def linearBbox(bboxes, query):
+    west, south, east, north = query
+    return [key for key, b in bboxes
+            if b[0] <= east and b[2] >= west and b[1] <= north and b[3] >= south]
+
+
+def linearRadius(bboxes, lon, lat, meters):
+    return [key for key, b in bboxes
+            if getDistanceToBboxMeters(lon, lat, b) <= meters]
+
+
+def linearNearest(bboxes, lon, lat, k):
+    return sorted((getDistanceToBboxMeters(lon, lat, b), key) for key, b in bboxes)[:k]
+
+
+def timeQueries(func, queries):
+    start = time.time()
+    for q in queries:
+        func(*q)
+    return (time.time() - start) / len(queries) * 1000
+
+
+def main():
+    import optparse
+    parser = optparse.OptionParser('usage: %prog [opts]')
+    parser.add_option('-n', '--numPlans',
+                      type='int', default=50000,
+                      help='Number of plan bboxes to index [%default]')
+    parser.add_option('-s', '--numSites',
+                      type='int', default=20,
+                      help='Number of sites the plans are scattered around [%default]')
+    parser.add_option('-q', '--queries',
+                      type='int', default=200,
+                      help='Number of queries of each kind [%default]')
+    parser.add_option('-k', '--nearest',
+                      type='int', default=10,
+                      help='k for the k-nearest queries [%default]')
+    opts, args = parser.parse_args()
+    if args:
+        parser.error('expected no args')
+
+    sites, bboxes = makeBboxes(opts.numPlans, opts.numSites)
+    start = time.time()
+    grid = GridIndex()
+    for key, bbox in bboxes:
+        grid.insert(key, bbox)
+    buildTime = time.time() - start
+
+    rng = random.Random(1)
+    points = []
+    for _ in xrange(opts.queries):
+        lon, lat = rng.choice(sites)
+        points.append((lon + rng.gauss(0, 0.1), lat + rng.gauss(0, 0.1)))
+    bboxQueries = [((lon, lat, lon + 0.05, lat + 0.05),) for lon, lat in points]
+    radiusQueries = [(lon, lat, 2000.0) for lon, lat in points]
+    nearestQueries = [(lon, lat, opts.nearest) for lon, lat in points]
+
+    # check the index against the scan before timing it
+    for q in bboxQueries[:10]:
+        assert sorted(k for k, _v in grid.searchBbox(*q)) == sorted(linearBbox(bboxes, *q))
+    for q in nearestQueries[:10]:
+        assert ([d for d, _k, _v in grid.nearest(*q)] ==
+                [d for d, _k in linearNearest(bboxes, *q)])
+
+    print 'indexed %d plan bboxes in %.3f s (cell size %s degrees)' % (opts.numPlans, buildTime,
+                                                                       spatialIndex.GRID_CELL_DEGREES)
+    print '  %-14s %14s %14s' % ('', 'grid (ms)', 'scan (ms)')
+    for name, indexed, scan, queries in (
+            ('bbox', grid.searchBbox, lambda q: linearBbox(bboxes, q), bboxQueries),
+            ('radius 2 km', grid.searchRadius,
+             lambda lon, lat, m: linearRadius(bboxes, lon, lat, m), radiusQueries),
+            ('%d-nearest' % opts.nearest, grid.nearest,
+             lambda lon, lat, k: linearNearest(bboxes, lon, lat, k), nearestQueries)):
+        scanQueries = queries[:max(1, len(queries) // 20)]
+        print '  %-14s %14.3f %14.3f' % (name, timeQueries(indexed, queries),
+                                         timeQueries(scan, scanQueries))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+#  __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Benchmark for context propagation in TreeWalkPlanExporter.
+
+Exports a command-heavy generated plan with ExamplePlanExporter, once
+with the chained WalkContext frames and once with the DotDict copy per
+element and per command (plus per-export command conversion) that the
+walker used to do. Reports the best time and the number of context
+objects each walk allocates.
+
+planExporter imports the Django models, so run this with
+DJANGO_SETTINGS_MODULE set for your site.
+"""
+
+import copy
+import logging
+import time
+
+from geocamUtil.dotDict import convertToDotDictRecurse, DotDict
+
+from xgds_planner2 import xpjson
+from xgds_planner2 import planExporter
+from xgds_planner2.planExporter import ExamplePlanExporter
+from bench_xpjson import makeLargePlanDict
+
+
+class CountingWalkContext(planExporter.WalkContext):
+    __slots__ = ()
+    numAllocated = 0
+
+    def __init__(self, parentContext=None, **kwargs):
+        CountingWalkContext.numAllocated += 1
+        super(CountingWalkContext, self).__init__(parentContext, **kwargs)
+
+    def child(self, **kwargs):
+        return CountingWalkContext(self, **kwargs)
+
+
+class ChainedExporter(ExamplePlanExporter):
+    def exportPlan(self, plan, schema):
+        context = CountingWalkContext(plan=plan, schema=schema)
+        self.initPlan(plan, context)
+        return self.exportPlanInternal(plan, context)
+
+
+class CountingDotDict(DotDict):
+    numAllocated = 0
+
+    def copy(self):
+        CountingDotDict.numAllocated += 1
+        return CountingDotDict(self)
+
+
+class CopyingExporter(ExamplePlanExporter):
+    """
+    The walk as it was before WalkContext.
+    """
+
+    def exportCommands(self, elt, context, transform):
+        tsequence = []
+        if hasattr(elt, 'commands'):
+            elt.sequence = convertToDotDictRecurse(elt.commands)
+            for i, cmd in enumerate(elt.sequence):
+                ctx = context.copy()
+                ctx.command = cmd
+                ctx.commandIndex = i
+                tsequence.append(transform(cmd, ctx))
+        else:
+            elt.sequence = []
+        return tsequence
+
+    def exportStation(self, station, context):
+        tsequence = self.exportCommands(station, context, self.transformStationCommand)
+        return self.transformStation(station, tsequence, context)
+
+    def exportSegment(self, segment, context):
+        tsequence = self.exportCommands(segment, context, self.transformSegmentCommand)
+        return self.transformSegment(segment, tsequence, context)
+
+    def exportPlan(self, plan, schema):
+        context = CountingDotDict({'plan': plan, 'schema': schema})
+        self.initPlan(plan, context)
+        return self.exportPlanInternal(plan, context)
+
+    def exportPlanInternal(self, plan, context):
+        index = 0
+        tsequence = []
+        stations = self.getStations(plan)
+        for elt in plan.get("sequence", []):
+            ctx = context.copy()
+            ctx.stationIndex = index
+            ctx.parent = elt
+            if elt.type == 'Station':
+                ctx.station = elt
+                ctx.prevStation, ctx.nextStation = self.getBracketingStations(plan, index, True, stations)
+                tsequence.append(self.exportStation(elt, ctx))
+                index += 1
+            else:
+                ctx.segment = elt
+                ctx.prevStation, ctx.nextStation = self.getBracketingStations(plan, index, stations=stations)
+                tsequence.append(self.exportSegment(elt, ctx))
+        return self.transformPlan(plan, tsequence, context)
+
+
+def makeCommandHeavyPlanDict(numStations, commandsPerStation):
+    planDict = makeLargePlanDict(numStations)
+    template = None
+    for elt in planDict.sequence:
+        if elt.get('sequence'):
+            template = elt.sequence[0]
+            break
+    for elt in planDict.sequence:
+        elt.pop('sequence', None)
+        if elt.type == 'Station':
+            commands = []
+            for i in xrange(commandsPerStation):
+                cmd = copy.deepcopy(template)
+                cmd.id = '%s_CMD%02d' % (elt.id, i)
+                commands.append(cmd)
+            elt.commands = commands
+    return planDict
+
+
+def timeExport(exporter, counter, planDict, schema, repeat):
+    best = None
+    for _ in xrange(repeat):
+        plan = xpjson.loadDocumentFromDict(copy.deepcopy(planDict), schema=schema)
+        counter.numAllocated = 0
+        start = time.time()
+        exporter.exportPlan(plan, schema)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, counter.numAllocated
+
+
+def main():
+    import optparse
+    parser = optparse.OptionParser('usage: %prog [opts]')
+    parser.add_option('-n', '--numStations',
+                      type='int', default=2000,
+                      help='Number of stations in the generated plan [%default]')
+    parser.add_option('-c', '--commands',
+                      type='int', default=20,
+                      help='Number of commands per station [%default]')
+    parser.add_option('-r', '--repeat',
+                      type='int', default=5,
+                      help='Number of timing runs; the best is reported [%default]')
+    opts, args = parser.parse_args()
+    if args:
+        parser.error('expected no args')
+
+    logging.disable(logging.WARNING)
+    schema = xpjson.loadDocument(xpjson.EXAMPLE_PLAN_SCHEMA_PATH)
+    planDict = makeCommandHeavyPlanDict(opts.numStations, opts.commands)
+
+    copying, copyingAllocs = timeExport(CopyingExporter(), CountingDotDict,
+                                        planDict, schema, opts.repeat)
+    chained, chainedAllocs = timeExport(ChainedExporter(), CountingWalkContext,
+                                        planDict, schema, opts.repeat)
+
+    print 'exported plan with %d stations, %d commands per station' % (opts.numStations, opts.commands)
+    print '  %-18s %10s %16s' % ('', 'time (s)', 'context allocs')
+    print '  %-18s %10.4f %16d' % ('DotDict copies', copying, copyingAllocs)
+    print '  %-18s %10.4f %16d' % ('chained frames', chained, chainedAllocs)
+    print '  speedup: %.1fx' % (copying / chained)
+
+
+if __name__ == '__main__':
+    main()
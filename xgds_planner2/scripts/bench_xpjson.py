@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#  __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Microbenchmark for XPJSON plan validation.
+
+Builds a large plan by repeating the stations and segments of the
+example plan, then times xpjson.loadDocumentFromDict() (the same call
+views.validateJson() and AbstractPlan.toXpjson() make) with the compiled
+validators and with the interpreted path they replaced.
+"""
+
+import copy
+import logging
+import time
+
+from xgds_planner2 import xpjson
+
+
+def makeLargePlanDict(numStations):
+    """
+    Return a plan dict with *numStations* stations, built by cycling
+    through the stations and segments of the example plan.
+    """
+    planDict = xpjson.loadDictFromPath(xpjson.EXAMPLE_PLAN_PATH)
+    stations = [elt for elt in planDict.sequence if elt.type == 'Station']
+    segments = [elt for elt in planDict.sequence if elt.type == 'Segment']
+
+    sequence = []
+    for i in xrange(numStations):
+        if i > 0:
+            segment = copy.deepcopy(segments[i % len(segments)])
+            segment.id = 'SEG%05d' % i
+            sequence.append(segment)
+        station = copy.deepcopy(stations[i % len(stations)])
+        station.id = 'STN%05d' % i
+        sequence.append(station)
+    planDict.sequence = sequence
+    return planDict
+
+
+def timeValidation(planDict, schema, compileValidators, repeat):
+    xpjson.COMPILE_VALIDATORS = compileValidators
+    best = None
+    for _ in xrange(repeat):
+        docDict = copy.deepcopy(planDict)
+        start = time.time()
+        xpjson.loadDocumentFromDict(docDict, schema=schema)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    import optparse
+    parser = optparse.OptionParser('usage: %prog [opts]')
+    parser.add_option('-n', '--numStations',
+                      type='int', default=2000,
+                      help='Number of stations in the generated plan [%default]')
+    parser.add_option('-r', '--repeat',
+                      type='int', default=5,
+                      help='Number of timing runs; the best is reported [%default]')
+    opts, args = parser.parse_args()
+    if args:
+        parser.error('expected no args')
+
+    # the example plan has fields the schema does not declare; don't
+    # let the warnings dominate the timing.
+    logging.disable(logging.WARNING)
+
+    schema = xpjson.loadDocument(xpjson.EXAMPLE_PLAN_SCHEMA_PATH)
+    planDict = makeLargePlanDict(opts.numStations)
+
+    interpreted = timeValidation(planDict, schema, False, opts.repeat)
+    compiled = timeValidation(planDict, schema, True, opts.repeat)
+    xpjson.COMPILE_VALIDATORS = True
+
+    print 'validated plan with %d stations' % opts.numStations
+    print '  interpreted: %.4f s' % interpreted
+    print '  compiled:    %.4f s' % compiled
+    print '  speedup:     %.1fx' % (interpreted / compiled)
+
+
+if __name__ == '__main__':
+    main()
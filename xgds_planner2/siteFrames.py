@@ -0,0 +1,270 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+The site frame registry: every site with an alternateCrs in the
+libraries of the configured platforms, collected once per process and
+again whenever PLAN_SCHEMA_REGISTRY reloads one of those libraries.
+
+Each site's origin is projected to Earth-centered (ECEF) coordinates,
+where straight-line distance orders sites the same way as distance
+over the ground, even across UTM zones. The origins go into a KD-tree,
+so finding the closest site frame to a point costs O(log n). The UTM
+projections used to read the origins are built once per zone.
+"""
+
+import logging
+import math
+import threading
+
+from django.conf import settings
+
+from xgds_planner2.models import getPlanSchema
+
+
+def getSitePlatforms():
+    platforms = sorted(settings.XGDS_PLANNER_SCHEMAS.keys())
+    try:
+        platforms.remove("test")
+    except ValueError:
+        pass
+    return platforms
+
+# WGS84
+EARTH_A = 6378137.0
+EARTH_E2 = 6.69437999014e-3
+
+UTM_PROJS = {}
+UTM_PROJS_LOCK = threading.Lock()
+
+
+def getUtmProj(zone, south=False):
+    """
+    Return the cached pyproj.Proj for a UTM zone.
+    """
+    key = (int(zone), bool(south))
+    result = UTM_PROJS.get(key)
+    if result is None:
+        import pyproj
+        with UTM_PROJS_LOCK:
+            result = UTM_PROJS.get(key)
+            if result is None:
+                result = pyproj.Proj(proj='utm', zone=key[0], ellps='WGS84', south=key[1])
+                UTM_PROJS[key] = result
+    return result
+
+
+def lonLatToEcef(lon, lat):
+    lon = math.radians(lon)
+    lat = math.radians(lat)
+    sinLat = math.sin(lat)
+    cosLat = math.cos(lat)
+    n = EARTH_A / math.sqrt(1 - EARTH_E2 * sinLat * sinLat)
+    return (n * cosLat * math.cos(lon),
+            n * cosLat * math.sin(lon),
+            n * (1 - EARTH_E2) * sinLat)
+
+
+def getSiteOrigin(site):
+    """
+    Return the (lon, lat) origin of a site frame, read from the
+    originEasting, originNorthing, zone and zoneLetter properties of its
+    alternateCrs, or None if it has no such origin.
+    """
+    try:
+        properties = site.alternateCrs['properties']
+        easting = properties['originEasting']
+        northing = properties['originNorthing']
+        zone = properties['zone']
+    except (AttributeError, KeyError, TypeError):
+        return None
+    south = str(properties.get('zoneLetter', 'N')).upper() < 'N'
+    return getUtmProj(zone, south)(easting, northing, inverse=True)
+
+
+class KdTree(object):
+    """
+    Static KD-tree over (point, value) pairs, where points are tuples
+    of equal length.
+    """
+
+    def __init__(self, items):
+        self.root = self.build(list(items), 0)
+
+    @classmethod
+    def build(cls, items, depth):
+        if not items:
+            return None
+        axis = depth % len(items[0][0])
+        items.sort(key=lambda item: item[0][axis])
+        middle = len(items) // 2
+        point, value = items[middle]
+        return (point, value, axis,
+                cls.build(items[:middle], depth + 1),
+                cls.build(items[middle + 1:], depth + 1))
+
+    def nearest(self, target):
+        """
+        Return (squaredDistance, point, value) for the point nearest to
+        *target*, or None if the tree is empty.
+        """
+        return self.search(self.root, target, None)
+
+    @classmethod
+    def search(cls, node, target, best):
+        if node is None:
+            return best
+        point, value, axis, left, right = node
+        d2 = sum([(p - t) ** 2 for p, t in zip(point, target)])
+        if best is None or d2 < best[0]:
+            best = (d2, point, value)
+        offset = target[axis] - point[axis]
+        near, far = (left, right) if offset < 0 else (right, left)
+        best = cls.search(near, target, best)
+        # the far side can only hold something closer if the splitting
+        # plane is closer than the best so far
+        if offset * offset < best[0]:
+            best = cls.search(far, target, best)
+        return best
+
+
+class SiteFrameRegistry(object):
+    """
+    Per-process registry of the site frames, built on first use and
+    safe to share across threads.
+
+    The registry remembers the PlanSchema objects it read the sites
+    from. PLAN_SCHEMA_REGISTRY replaces those when the compiled files
+    change on disk, and the registry rebuilds itself when it sees that.
+
+    The deprecated setting XGDS_PLANNER_SITE_FRAMES still works both
+    ways: a non-empty list there is used as the site frames instead of
+    the libraries, and otherwise the collected sites are copied into it
+    for code that reads the setting.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (sites, origins, tree, schemas), replaced as a whole so
+        # readers never see a half-built registry
+        self.state = None
+        # set once we have filled XGDS_PLANNER_SITE_FRAMES ourselves
+        self.fillsSetting = False
+
+    @staticmethod
+    def getSchemas():
+        return [(platform, getPlanSchema(platform)) for platform in getSitePlatforms()]
+
+    def getConfiguredSites(self):
+        """
+        Return the sites listed in XGDS_PLANNER_SITE_FRAMES by the site
+        settings, or None if it was left empty.
+        """
+        configured = getattr(settings, 'XGDS_PLANNER_SITE_FRAMES', None)
+        if configured and not self.fillsSetting:
+            logging.warning('XGDS_PLANNER_SITE_FRAMES is deprecated, put the site frames '
+                            'in the platform libraries instead')
+            return list(configured)
+        return None
+
+    def publishSites(self, sites):
+        configured = getattr(settings, 'XGDS_PLANNER_SITE_FRAMES', None)
+        if configured is not None:
+            configured[:] = sites
+            self.fillsSetting = True
+
+    @staticmethod
+    def collectSites(schemas):
+        result = []
+        for _platform, schema in schemas:
+            library = schema.getLibrary()
+            sites = library.sites
+            if sites:
+                for site in sites:
+                    try:
+                        if site.alternateCrs:
+                            result.append(site)
+                    except:  # pylint: disable=W0702
+                        pass
+        return result
+
+    def isCurrent(self, state):
+        schemas = state[3]
+        if schemas is None:
+            # from XGDS_PLANNER_SITE_FRAMES
+            return True
+        return self.getSchemas() == schemas
+
+    def load(self):
+        state = self.state
+        if state is not None and self.isCurrent(state):
+            return state
+        with self.lock:
+            if self.state is not None and self.state is not state and self.isCurrent(self.state):
+                # another thread rebuilt it while we were waiting
+                return self.state
+            sites = self.getConfiguredSites()
+            schemas = None
+            if sites is None:
+                schemas = self.getSchemas()
+                sites = self.collectSites(schemas)
+                self.publishSites(sites)
+            origins = []
+            items = []
+            for site in sites:
+                origin = getSiteOrigin(site)
+                if origin is None:
+                    logging.warning('site frame %s has no origin, it will never be the closest',
+                                    site.id)
+                    continue
+                origins.append((site, origin[0], origin[1]))
+                items.append((lonLatToEcef(*origin), site))
+            self.state = (sites, origins, KdTree(items), schemas)
+            return self.state
+
+    def getSites(self):
+        """
+        Return the list of site frames.
+        """
+        return self.load()[0]
+
+    def getOrigins(self):
+        """
+        Return [(site, lon, lat)] for the site frames with an origin.
+        """
+        return self.load()[1]
+
+    def getClosest(self, lat, lon):
+        """
+        Return the site frame whose origin is closest to (lat, lon), or
+        None if there are no site frames.
+        """
+        sites, _origins, tree, _schemas = self.load()
+        if len(sites) == 1:
+            return sites[0]
+        best = tree.nearest(lonLatToEcef(lon, lat))
+        if best is None:
+            return None
+        return best[2]
+
+    def clear(self):
+        """
+        Forget the site frames, so they are collected again on next use.
+        """
+        self.state = None
+
+
+SITE_FRAME_REGISTRY = SiteFrameRegistry()
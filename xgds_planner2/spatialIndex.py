@@ -0,0 +1,369 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+In-process spatial indexes, for asking which plans or site frames are in
+a map view or near a point without loading plans from the database.
+
+GridIndex buckets bounding boxes into a uniform lon/lat grid and answers
+bbox, radius and k-nearest queries. PLAN_SPATIAL_INDEX holds the route
+bbox of every non-deleted plan (see AbstractPlan.routeGeometry) and
+follows plan saves and deletes in this process; it is rebuilt from the
+database after XGDS_PLANNER_SPATIAL_INDEX_MAX_AGE seconds so changes
+made by other processes show up too. SITE_FRAME_SPATIAL_INDEX holds the
+origin of every site frame.
+"""
+
+import heapq
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+# callers can change these globals.
+GRID_CELL_DEGREES = 0.05
+# boxes covering more cells than this are kept in a list that every
+# query checks, rather than being added to every cell they touch.
+MAX_CELLS_PER_ITEM = 64
+
+METERS_PER_DEGREE = 111320.0
+
+
+class SpatialQueryError(ValueError):
+    pass
+
+
+def getDistanceToBboxMeters(lon, lat, bbox):
+    """
+    Return the approximate distance in meters from (lon, lat) to the
+    nearest point of *bbox* ([west, south, east, north]), 0 if inside.
+    Uses an equirectangular approximation around *lat*, which is plenty
+    at the scale of a plan.
+    """
+    west, south, east, north = bbox
+    dLon = max(west - lon, 0, lon - east)
+    dLat = max(south - lat, 0, lat - north)
+    return math.hypot(dLon * METERS_PER_DEGREE * math.cos(math.radians(lat)),
+                      dLat * METERS_PER_DEGREE)
+
+
+class GridIndex(object):
+    """
+    Index of keyed bounding boxes ([west, south, east, north] in
+    degrees; points are boxes with no extent), each with an optional
+    value. Safe to share across threads.
+    """
+
+    def __init__(self, cellDegrees=None):
+        if cellDegrees is None:
+            cellDegrees = GRID_CELL_DEGREES
+        self.cellDegrees = cellDegrees
+        self.lock = threading.RLock()
+        self.cells = {}
+        self.items = {}
+        self.largeKeys = set()
+        # bounds of the occupied cells; they only grow, which is fine
+        # for their use as a search limit
+        self.cellBounds = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def getCell(self, lon, lat):
+        return (int(math.floor(lon / self.cellDegrees)),
+                int(math.floor(lat / self.cellDegrees)))
+
+    def getCellRange(self, bbox):
+        x0, y0 = self.getCell(bbox[0], bbox[1])
+        x1, y1 = self.getCell(bbox[2], bbox[3])
+        return x0, y0, x1, y1
+
+    def insert(self, key, bbox, value=None):
+        bbox = tuple(bbox)
+        with self.lock:
+            self.remove(key)
+            x0, y0, x1, y1 = self.getCellRange(bbox)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_CELLS_PER_ITEM:
+                cells = None
+                self.largeKeys.add(key)
+            else:
+                cells = [(x, y)
+                         for x in xrange(x0, x1 + 1)
+                         for y in xrange(y0, y1 + 1)]
+                for cell in cells:
+                    self.cells.setdefault(cell, set()).add(key)
+                if self.cellBounds is None:
+                    self.cellBounds = [x0, y0, x1, y1]
+                else:
+                    b = self.cellBounds
+                    self.cellBounds = [min(b[0], x0), min(b[1], y0),
+                                       max(b[2], x1), max(b[3], y1)]
+            self.items[key] = (bbox, value, cells)
+
+    def remove(self, key):
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is None:
+                return
+            cells = item[2]
+            if cells is None:
+                self.largeKeys.discard(key)
+                return
+            for cell in cells:
+                keys = self.cells[cell]
+                keys.discard(key)
+                if not keys:
+                    del self.cells[cell]
+
+    def getCandidates(self, x0, y0, x1, y1):
+        candidates = set(self.largeKeys)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            # cheaper to look at the occupied cells than the query range
+            for (x, y), keys in self.cells.iteritems():
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    candidates.update(keys)
+        else:
+            for x in xrange(x0, x1 + 1):
+                for y in xrange(y0, y1 + 1):
+                    keys = self.cells.get((x, y))
+                    if keys:
+                        candidates.update(keys)
+        return candidates
+
+    def searchBbox(self, bbox):
+        """
+        Return [(key, value)] for the items intersecting *bbox*.
+        """
+        west, south, east, north = bbox
+        result = []
+        with self.lock:
+            for key in self.getCandidates(*self.getCellRange(bbox)):
+                b, value, _cells = self.items[key]
+                if b[0] <= east and b[2] >= west and b[1] <= north and b[3] >= south:
+                    result.append((key, value))
+        return result
+
+    def searchRadius(self, lon, lat, meters):
+        """
+        Return [(distanceMeters, key, value)] for the items within
+        *meters* of (lon, lat), nearest first.
+        """
+        dLat = meters / METERS_PER_DEGREE
+        dLon = dLat / max(math.cos(math.radians(lat)), 1e-6)
+        bbox = (lon - dLon, lat - dLat, lon + dLon, lat + dLat)
+        result = []
+        with self.lock:
+            for key in self.getCandidates(*self.getCellRange(bbox)):
+                b, value, _cells = self.items[key]
+                distance = getDistanceToBboxMeters(lon, lat, b)
+                if distance <= meters:
+                    result.append((distance, key, value))
+        result.sort()
+        return result
+
+    def iterRing(self, cx, cy, r):
+        if r == 0:
+            yield (cx, cy)
+            return
+        for x in xrange(cx - r, cx + r + 1):
+            yield (x, cy - r)
+            yield (x, cy + r)
+        for y in xrange(cy - r + 1, cy + r):
+            yield (cx - r, y)
+            yield (cx + r, y)
+
+    def nearest(self, lon, lat, k=1):
+        """
+        Return [(distanceMeters, key, value)] for the *k* items nearest
+        to (lon, lat), nearest first.
+        """
+        with self.lock:
+            found = []
+            seen = set()
+
+            def consider(keys):
+                for key in keys:
+                    if key not in seen:
+                        seen.add(key)
+                        b, value, _cells = self.items[key]
+                        found.append((getDistanceToBboxMeters(lon, lat, b), key, value))
+
+            consider(self.largeKeys)
+            if self.cells:
+                # search rings of cells outward from the query cell. after
+                # ring r, anything unseen is at least r cells away.
+                cx, cy = self.getCell(lon, lat)
+                b = self.cellBounds
+                maxRing = max(abs(cx - b[0]), abs(cx - b[2]), abs(cy - b[1]), abs(cy - b[3]))
+                cellMeters = self.cellDegrees * METERS_PER_DEGREE * math.cos(math.radians(lat))
+                r = 0
+                while r <= maxRing:
+                    if (2 * r + 1) ** 2 > len(self.cells):
+                        # the rings are now bigger than the occupied grid
+                        for keys in self.cells.itervalues():
+                            consider(keys)
+                        break
+                    for cell in self.iterRing(cx, cy, r):
+                        keys = self.cells.get(cell)
+                        if keys:
+                            consider(keys)
+                    if len(found) >= k and heapq.nsmallest(k, found)[-1][0] <= r * cellMeters:
+                        break
+                    r += 1
+            return heapq.nsmallest(k, found)
+
+
+def parseFloat(params, name):
+    try:
+        return float(params[name])
+    except (KeyError, ValueError):
+        raise SpatialQueryError('expected a number for %s' % name)
+
+
+def runQuery(grid, params):
+    """
+    Run the query described by the request parameters *params* against
+    *grid*: bbox=west,south,east,north, or lon, lat and either radius
+    (meters) or k (number of nearest items). Return a list of dicts
+    with 'id' and 'bbox', plus 'distanceMeters' for point queries, and
+    the fields of each item's value.
+    """
+    if params.get('bbox'):
+        try:
+            bbox = [float(v) for v in params['bbox'].split(',')]
+        except ValueError:
+            bbox = None
+        if not bbox or len(bbox) != 4:
+            raise SpatialQueryError('expected bbox=west,south,east,north')
+        hits = [(None, key, value) for key, value in grid.searchBbox(bbox)]
+    else:
+        lon = parseFloat(params, 'lon')
+        lat = parseFloat(params, 'lat')
+        if params.get('radius'):
+            hits = grid.searchRadius(lon, lat, parseFloat(params, 'radius'))
+        elif params.get('k'):
+            try:
+                k = int(params['k'])
+            except ValueError:
+                raise SpatialQueryError('expected an integer for k')
+            hits = grid.nearest(lon, lat, k)
+        else:
+            raise SpatialQueryError('expected bbox, or lon and lat with radius or k')
+
+    result = []
+    for distance, key, value in hits:
+        entry = dict(value or {})
+        entry['id'] = key
+        entry['bbox'] = list(grid.items[key][0]) if key in grid.items else None
+        if distance is not None:
+            entry['distanceMeters'] = distance
+        result.append(entry)
+    return result
+
+
+class PlanSpatialIndex(object):
+    """
+    Lazily built GridIndex over the route bboxes of the non-deleted
+    plans, keyed by uuid.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.grid = None
+        self.builtTime = None
+
+    def build(self):
+        from xgds_planner2.planIndex import PLAN_MODEL  # delayed import avoids import loop
+        grid = GridIndex()
+        rows = (PLAN_MODEL.get().objects
+                .filter(deleted=False, minLon__isnull=False)
+                .values_list('uuid', 'name', 'minLon', 'minLat', 'maxLon', 'maxLat'))
+        for uuid, name, west, south, east, north in rows:
+            grid.insert(uuid, (west, south, east, north), {'name': name})
+        return grid
+
+    def getGrid(self):
+        with self.lock:
+            if (self.grid is None or
+                    time.time() - self.builtTime > settings.XGDS_PLANNER_SPATIAL_INDEX_MAX_AGE):
+                self.grid = self.build()
+                self.builtTime = time.time()
+            return self.grid
+
+    def update(self, plan):
+        grid = self.grid
+        if grid is None:
+            return
+        if plan.deleted or plan.minLon is None:
+            grid.remove(plan.uuid)
+        else:
+            grid.insert(plan.uuid,
+                        (plan.minLon, plan.minLat, plan.maxLon, plan.maxLat),
+                        {'name': plan.name})
+
+    def remove(self, plan):
+        grid = self.grid
+        if grid is not None:
+            grid.remove(plan.uuid)
+
+
+PLAN_SPATIAL_INDEX = PlanSpatialIndex()
+
+
+class SiteFrameSpatialIndex(object):
+    """
+    GridIndex over the origins of the site frames, keyed by site id.
+    Rebuilt when SITE_FRAME_REGISTRY reloads the site frames.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.grid = None
+        self.origins = None
+
+    def getGrid(self):
+        from xgds_planner2.siteFrames import SITE_FRAME_REGISTRY  # delayed import, GridIndex needs no models
+        origins = SITE_FRAME_REGISTRY.getOrigins()
+        with self.lock:
+            if self.grid is None or origins is not self.origins:
+                grid = GridIndex()
+                for site, lon, lat in origins:
+                    grid.insert(site.id, (lon, lat, lon, lat), {'name': site.name})
+                self.grid = grid
+                self.origins = origins
+            return self.grid
+
+
+SITE_FRAME_SPATIAL_INDEX = SiteFrameSpatialIndex()
+
+
+def onPlanSaved(sender, instance=None, **kwargs):
+    PLAN_SPATIAL_INDEX.update(instance)
+
+
+def onPlanDeleted(sender, instance=None, **kwargs):
+    PLAN_SPATIAL_INDEX.remove(instance)
+
+
+def connectSignals():
+    from xgds_planner2.planIndex import PLAN_MODEL  # delayed import avoids import loop
+    planModel = PLAN_MODEL.get()
+    post_save.connect(onPlanSaved, sender=planModel,
+                      dispatch_uid='xgds_planner2.spatialIndex.post_save')
+    post_delete.connect(onPlanDeleted, sender=planModel,
+                        dispatch_uid='xgds_planner2.spatialIndex.post_delete')
@@ -15,9 +15,15 @@
 #__END_LICENSE__
 
 import math
+import json
+import hashlib
+import numpy
 import pyproj
 
+from geocamUtil.dotDict import DotDict
+
 from xgds_planner2.planExporter import JsonPlanExporter, TreeWalkPlanExporter
+from xgds_planner2 import xpjson
 
 # pylint: disable=W0223
 
@@ -42,6 +48,44 @@ def getDistanceMeters(lonLat1, lonLat2):
     return dist
 
 
+def getDistancesMeters(lonLats1, lonLats2):
+    """
+    Vectorized getDistanceMeters(). Returns an array of the distances
+    between corresponding [lon, lat] points of *lonLats1* and
+    *lonLats2*, computed with a single GEOD.inv call.
+    """
+    p1 = numpy.asarray(lonLats1, dtype=float).reshape(-1, 2)
+    p2 = numpy.array(lonLats2, dtype=float).reshape(-1, 2)
+    if len(p1) == 0:
+        return numpy.zeros(0)
+
+    # oops, GEOD.inv fails when Points are nearly equal. move those
+    # points apart for the call and zero out their distances after.
+    nearlyEqual = numpy.hypot(p1[:, 0] - p2[:, 0], p1[:, 1] - p2[:, 1]) < 1e-5
+    p2[nearlyEqual, 1] += 1.0
+
+    _az12, _az21, dist = GEOD.inv(p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1])
+    dist = numpy.asarray(dist, dtype=float)
+    dist[nearlyEqual] = 0
+    return dist
+
+
+def getStationCoordinates(plan):
+    return [elt.geometry['coordinates']
+            for elt in plan.get('sequence', [])
+            if elt.type == 'Station']
+
+
+def getStationDistancesMeters(plan):
+    """
+    Return an array whose element i is the distance between station i
+    and station i + 1 of *plan*, i.e. the length of the segment between
+    them.
+    """
+    coords = getStationCoordinates(plan)
+    return getDistancesMeters(coords[:-1], coords[1:])
+
+
 class StatsPlanExporter(JsonPlanExporter, TreeWalkPlanExporter):
     """
     Returns summary statistics.
@@ -59,8 +103,24 @@ class StatsPlanExporter(JsonPlanExporter, TreeWalkPlanExporter):
 
     def initPlan(self, plan, context):
         self.defaultSpeed = plan.defaultSpeed
-        
+        # all segment lengths in one batch; transformSegment() just
+        # records which ones the plan uses and transformPlan() reduces them
+        self.stationDistances = getStationDistancesMeters(plan)
+        self.segmentIndices = []
+        self.segmentSpeeds = []
+        self.segmentTotalTimes = []
+
     def transformPlan(self, plan, tsequence, context):
+        if self.segmentIndices:
+            lengths = self.stationDistances[self.segmentIndices]
+            durations = lengths / numpy.array(self.segmentSpeeds)
+            # "totalTime" is the SEXTANT computed time for the segment.
+            totalTimes = numpy.array(self.segmentTotalTimes)
+            hasTotalTime = ~numpy.isnan(totalTimes)
+            durations[hasTotalTime] = totalTimes[hasTotalTime]
+            self.lengthMeters += float(lengths.sum())
+            self.estimatedDurationSeconds += float(durations.sum())
+
         return {
             'numStations': self.numStations,
             'numSegments': self.numSegments,
@@ -75,18 +135,24 @@ class StatsPlanExporter(JsonPlanExporter, TreeWalkPlanExporter):
 
     def transformSegment(self, segment, tsequence, context):
         self.numSegments += 1
-        segmentLength = getDistanceMeters(context.prevStation.geometry['coordinates'],
-                                          context.nextStation.geometry['coordinates'])
-        self.lengthMeters += segmentLength
+        if not 0 < context.stationIndex <= len(self.stationDistances):
+            # a segment without a station on both ends has no length; index
+            # -1 would silently pick up the last station's distance
+            if "totalTime" in segment.derivedInfo:
+                self.estimatedDurationSeconds += float(segment.derivedInfo["totalTime"])
+            return
+        # the segment runs from station stationIndex - 1 to station stationIndex
+        self.segmentIndices.append(context.stationIndex - 1)
         if hasattr(segment, "hintedSpeed"):
                 speed = float(segment.hintedSpeed)
         else:
                 speed = float(self.defaultSpeed)
-        segmentDuration = segmentLength/speed
-        if "totalTime" in segment.derivedInfo:  # "totalTime" is the SEXTANT computed time for the segment.
-            segmentDuration = float(segment.derivedInfo["totalTime"])
-        self.estimatedDurationSeconds += segmentDuration
-        
+        self.segmentSpeeds.append(speed)
+        if "totalTime" in segment.derivedInfo:
+            self.segmentTotalTimes.append(float(segment.derivedInfo["totalTime"]))
+        else:
+            self.segmentTotalTimes.append(float('nan'))
+
 
     def transformStationCommand(self, command, context):
         self.numCommands += 1
@@ -100,6 +166,171 @@ class StatsPlanExporter(JsonPlanExporter, TreeWalkPlanExporter):
         self.transformStationCommand(command, context)
 
 
+def getElementKey(elt):
+    return elt.get('uuid') or elt.get('id')
+
+
+def hashJson(*objs):
+    return hashlib.sha1(json.dumps(objs, sort_keys=True)).hexdigest()
+
+
+def getParamDefault(paramsLookup, paramId):
+    paramSpec = paramsLookup.get(paramId)
+    if paramSpec is not None:
+        return paramSpec.default
+    return None
+
+
+class IncrementalPlanStats(object):
+    """
+    Computes the same stats as StatsPlanExporter directly from a plan's
+    JSON, reusing the per-element contributions cached by the previous
+    call.
+
+    Each station and segment contribution is cached under the element
+    uuid together with a hash of everything it depends on: the element
+    itself and, for segments, the coordinates of the bracketing stations
+    and the speed. Editing one station therefore only recomputes that
+    station and its two neighbouring segments. Changed elements are
+    also validated against the schema, so callers don't need to run a
+    full toXpjson() to catch bad input.
+
+    The updated cache is left in elementStats so the caller can store it
+    for the next save (AbstractPlan keeps it in its statsCache column).
+    """
+
+    def __init__(self, schema, elementStats=None):
+        self.schema = schema
+        self.previousStats = elementStats or {}
+        self.elementStats = {}
+        self.numRecomputed = 0
+
+    def getCached(self, key, contentHash):
+        if key is None:
+            return None
+        cached = self.previousStats.get(key)
+        if cached is not None and cached[0] == contentHash:
+            self.elementStats[key] = cached
+            return cached[1]
+        return None
+
+    def store(self, key, contentHash, contribution):
+        self.numRecomputed += 1
+        if key is not None:
+            self.elementStats[key] = [contentHash, contribution]
+        return contribution
+
+    def validateElement(self, elt):
+        # raises AssertionError on bad input, same as a full toXpjson()
+        xpjson.transformBottomUp(elt, xpjson.decodeWithClassName, schema=self.schema)
+
+    def validatePlanFields(self, plan):
+        planFields = DotDict(plan)
+        planFields['sequence'] = []
+        xpjson.loadDocumentFromDict(planFields, schema=self.schema)
+
+        validTypes = set(self.schema.commandSpecsLookup.iterkeys())
+        validTypes.update(('Station', 'Segment'))
+        for elt in plan.get('sequence', []):
+            assert elt.get('type') in validTypes, \
+                'element of type %s not allowed in Plan.sequence' % elt.get('type')
+
+    def getCommandsContribution(self, elt):
+        numCommandsByType = {}
+        durationSeconds = 0
+        commands = elt.get('commands') or []
+        for command in commands:
+            numCommandsByType[command['type']] = numCommandsByType.get(command['type'], 0) + 1
+            durationSeconds += float(command['duration'])
+        return {'numCommands': len(commands),
+                'numCommandsByType': numCommandsByType,
+                'durationSeconds': durationSeconds}
+
+    def getStationContribution(self, station):
+        key = getElementKey(station)
+        contentHash = hashJson(station)
+        result = self.getCached(key, contentHash)
+        if result is None:
+            self.validateElement(station)
+            result = self.store(key, contentHash, self.getCommandsContribution(station))
+        return result
+
+    def getSegmentContribution(self, segment, prevStation, nextStation, defaultSpeed):
+        prevCoords = prevStation['geometry']['coordinates'] if prevStation else None
+        nextCoords = nextStation['geometry']['coordinates'] if nextStation else None
+        key = getElementKey(segment)
+        contentHash = hashJson(segment, prevCoords, nextCoords, defaultSpeed)
+        result = self.getCached(key, contentHash)
+        if result is None:
+            self.validateElement(segment)
+            result = self.getCommandsContribution(segment)
+
+            lengthMeters = 0
+            if prevCoords and nextCoords:
+                lengthMeters = getDistanceMeters(prevCoords, nextCoords)
+            speed = segment.get('hintedSpeed')
+            if speed is None:
+                speed = getParamDefault(self.schema.segmentParamsLookup, 'hintedSpeed')
+            if speed is None:
+                speed = defaultSpeed
+            segmentDuration = lengthMeters / float(speed)
+            derivedInfo = segment.get('derivedInfo') or {}
+            if "totalTime" in derivedInfo:  # "totalTime" is the SEXTANT computed time for the segment.
+                segmentDuration = float(derivedInfo["totalTime"])
+
+            result['lengthMeters'] = lengthMeters
+            result['durationSeconds'] += segmentDuration
+            result = self.store(key, contentHash, result)
+        return result
+
+    def getStats(self, plan):
+        self.validatePlanFields(plan)
+
+        defaultSpeed = plan.get('defaultSpeed')
+        if defaultSpeed is None:
+            defaultSpeed = getParamDefault(self.schema.planParamsLookup, 'defaultSpeed')
+
+        stats = {
+            'numStations': 0,
+            'numSegments': 0,
+            'numCommands': 0,
+            'numCommandsByType': {},
+            'lengthMeters': 0,
+            'estimatedDurationSeconds': 0
+        }
+
+        sequence = plan.get('sequence', [])
+
+        # the station following each element, found in one backward pass
+        nextStations = [None] * len(sequence)
+        nextStation = None
+        for i in xrange(len(sequence) - 1, -1, -1):
+            nextStations[i] = nextStation
+            if sequence[i]['type'] == 'Station':
+                nextStation = sequence[i]
+
+        prevStation = None
+        for i, elt in enumerate(sequence):
+            if elt['type'] == 'Station':
+                stats['numStations'] += 1
+                contribution = self.getStationContribution(elt)
+                prevStation = elt
+            elif elt['type'] == 'Segment':
+                stats['numSegments'] += 1
+                nextStation = nextStations[i]
+                contribution = self.getSegmentContribution(elt, prevStation, nextStation, defaultSpeed)
+                stats['lengthMeters'] += contribution['lengthMeters']
+            else:
+                continue
+
+            stats['numCommands'] += contribution['numCommands']
+            stats['estimatedDurationSeconds'] += contribution['durationSeconds']
+            for commandType, n in contribution['numCommandsByType'].iteritems():
+                stats['numCommandsByType'][commandType] = stats['numCommandsByType'].get(commandType, 0) + n
+
+        return stats
+
+
 def getSummaryOfCommandsByType(stats):
     lst = []
     counts = stats['numCommandsByType']
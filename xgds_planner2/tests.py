@@ -14,15 +14,30 @@
 # specific language governing permissions and limitations under the License.
 #__END_LICENSE__
 
-from django.test import TransactionTestCase
+from django.test import RequestFactory, TransactionTestCase
 from django.test.utils import override_settings
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
 from django.conf import settings
 from unittest import skipIf
 
+from xgds_planner2 import (bulkExport, bulkImport, choosePlanExporter, exportCache, exportPipeline,
+                           jsonCodec, planExporter, planRelay, siteFrames, spatialIndex, views)
+from xgds_planner2.kmlPlanExporter import KmlPlanExporter
 from xgds_planner2.models import Plan
+from xgds_planner2.pmlPlanExporter import PmlPlanExporter
 
+import datetime
+import json
 import logging
+import os
+import random
+import shutil
+import tempfile
+import zipfile
+from StringIO import StringIO
+
+import pytz
 
 
 @override_settings(PIPELINE_ENABLED=False)
@@ -81,6 +96,375 @@ class xgds_planner2Test(TransactionTestCase):
                                    follow=True)
         self.assertEquals(response.status_code, 200)
 
+    @skipIf(getattr(settings, 'XGDS_PLANNER_TEST_SKIP_PLAN_EXPORT',
+                    settings.XGDS_PLANNER_TEST_SKIP_PLAN_EXPORT),
+            'plan export test set to be skipped')
+    def test_plan_export_cache(self):
+        cache = exportCache.getExportCache()
+        uuid = '421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e'
+        url = reverse('planner2_planExport', args=[uuid, 'test.kml'])
+        # the export is stored once the response has been read
+        expected = ''.join(self.client.get(url).streaming_content)
+
+        hits = cache.hits
+        response = self.client.get(url)
+        self.assertEqual(''.join(response.streaming_content), expected)
+        self.assertEqual(cache.hits, hits + 1)
+
+        # saving the plan drops its cached exports
+        Plan.objects.get(uuid=uuid).save()
+        misses = cache.misses
+        ''.join(self.client.get(url).streaming_content)
+        self.assertEqual(cache.misses, misses + 1)
+
+    def test_export_cache_start_time(self):
+        dbPlan = Plan.objects.get(uuid='421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e')
+        exporter = PmlPlanExporter()
+        startTime = datetime.datetime(2016, 1, 1, tzinfo=pytz.utc)
+        self.assertEqual(exporter.getCacheStartTime(dbPlan, startTime), startTime)
+        # without a start time PML starts now, so it is not cached
+        self.assertEqual(exporter.getCacheStartTime(dbPlan, None), planExporter.CACHE_NOW)
+        stores = exportCache.getExportCache().stores
+        info = choosePlanExporter.ExporterInfo('pml', '.pml', PmlPlanExporter)
+        ''.join(exportCache.iterCachedExport(dbPlan, info, exporter, None))
+        self.assertEqual(exportCache.getExportCache().stores, stores)
+
+    def test_export_key_content(self):
+        dbPlan = Plan.objects.withJson('jsonPlan').get(uuid='421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e')
+        dbPlan.extractFromJson(overWriteDateModified=False)
+        info = choosePlanExporter.ExporterInfo('kml', '.kml', KmlPlanExporter)
+        key = exportCache.getExportKey(dbPlan, info)
+        # a second save within the same second of dateModified
+        dbPlan.jsonPlan.name += ' edited'
+        dbPlan.extractFromJson(overWriteDateModified=False)
+        self.assertNotEqual(exportCache.getExportKey(dbPlan, info), key)
+
+    def test_file_export_cache_mode(self):
+        directory = os.path.join(tempfile.mkdtemp(), 'exportCache')
+        try:
+            backend = exportCache.FileExportCacheBackend(directory)
+            key = ('some-uuid', '', '', 'kml.kml', '', '')
+            backend.set(key, 'text')
+            self.assertEqual(backend.get(key), 'text')
+            for path in (directory, os.path.join(directory, 'some-uuid')):
+                self.assertEqual(os.stat(path).st_mode & 0777, 0700)
+        finally:
+            shutil.rmtree(os.path.dirname(directory))
+
+    def test_export_pipeline_queue(self):
+        # no workers, so the jobs stay queued
+        pipeline = exportPipeline.ExportPipeline(numWorkers=0, maxPending=1)
+        first = exportPipeline.ExportJob('a', None, None)
+        second = exportPipeline.ExportJob('a', None, None)
+        self.assertTrue(pipeline.schedule(first))
+        self.assertTrue(pipeline.schedule(second))
+        self.assertIs(pipeline.pending['a'], second)
+        self.assertFalse(pipeline.schedule(exportPipeline.ExportJob('b', None, None)))
+        stats = pipeline.getStats()
+        self.assertEqual((stats['pending'], stats['superseded'], stats['dropped']), (1, 1, 1))
+
+    def test_bulk_export_report(self):
+        report = bulkExport.BulkExportReport(['.kml', '.pml'], 2)
+        report.add(1, [{'extension': '.kml', 'fileName': 'a_1.kml', 'seconds': 0.5, 'error': None},
+                       {'extension': '.pml', 'fileName': 'a_1.pml', 'seconds': 1.5, 'error': 'boom'}])
+        summary = report.toDict()
+        self.assertEqual(summary['done'], 1)
+        self.assertEqual(summary['formats']['.kml']['exported'], 1)
+        self.assertEqual(summary['formats']['.pml']['failed'], 1)
+        self.assertEqual(summary['formats']['.pml']['meanSeconds'], 1.5)
+        self.assertEqual([e['fileName'] for e in summary['errors']], ['a_1.pml'])
+        self.assertRaises(bulkExport.BulkExportError, bulkExport.getExporterInfos, ['.nope'])
+
+    def test_bulk_export_zip(self):
+        url = reverse('planner2_bulkExportZip')
+        response = self.client.get(url, {'formats': '.kml'})
+        self.assertEquals(response.status_code, 200)
+        archive = zipfile.ZipFile(StringIO(''.join(response.streaming_content)))
+        summary = json.loads(archive.read('report.json'))
+        self.assertEqual(summary['done'], Plan.objects.filter(deleted=False).count())
+
+        with override_settings(XGDS_PLANNER_BULK_EXPORT_MAX_PLANS=0):
+            response = self.client.get(url, {'formats': '.kml'})
+        self.assertEquals(response.status_code, 400)
+
+    def test_bulk_import_files(self):
+        directory = tempfile.mkdtemp()
+        for fileName in ('a.kml', 'b.json', 'notes.txt'):
+            with open(os.path.join(directory, fileName), 'w') as f:
+                f.write('{}')
+        items = bulkImport.collectImportFiles(directory)
+        self.assertEqual([fileName for fileName, _path, _member in items], ['a.kml', 'b.json'])
+        self.assertEqual(len(bulkImport.collectImportFiles(os.path.join(directory, '*.kml'))), 1)
+
+        # plans cross from the parsing workers to the parent as plain values
+        plan = Plan.objects.withJson().get(uuid='421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e')
+        copied = bulkImport.makePlan(bulkImport.getPlanFields(plan))
+        self.assertIsNone(copied.pk)
+        self.assertEqual(copied.uuid, plan.uuid)
+        self.assertEqual(copied.jsonPlan.name, plan.jsonPlan.name)
+
+        report = bulkImport.BulkImportReport(2)
+        report.add('a.kml', None, copied, 0.5)
+        report.add('b.json', 'ValueError: boom', None, 1.5)
+        summary = report.toDict()
+        self.assertEqual((summary['imported'], summary['failed']), (1, 1))
+        self.assertEqual(summary['meanParseSeconds'], 1.0)
+        self.assertEqual([e['fileName'] for e in report.getErrors()], ['b.json'])
+
+    def test_bulk_import_zip_in_process(self):
+        plan = Plan.objects.withJson().get(uuid='421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e')
+        planDict = json.loads(jsonCodec.dumps(plan.jsonPlan))
+        for key in ('uuid', 'serverId', 'url'):
+            planDict.pop(key, None)
+        fd, path = tempfile.mkstemp(suffix='.zip')
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(path, 'w') as archive:
+                archive.writestr('copy.json', json.dumps(planDict))
+            self.assertRaises(bulkImport.BulkImportError, bulkImport.importPlans,
+                              path, {}, plan.jsonPlan.platform.name, processes=0, maxFiles=0)
+            report = bulkImport.importPlans(path, {}, plan.jsonPlan.platform.name, processes=0)
+        finally:
+            os.remove(path)
+        self.assertEqual(report.toDict()['imported'], 1)
+        self.assertNotIn(path, bulkImport.WORKER_ZIPS)
+        # named after its id, as planImport does
+        imported = Plan.objects.withJson('jsonPlan').get(uuid=report.files[0]['uuid'])
+        self.assertEqual(imported.name, planDict['id'])
+        self.assertEqual(imported.jsonPlan.uuid, imported.uuid)
+
+    def test_plan_relay(self):
+        plan = Plan.objects.withJson().get(uuid='421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e')
+        fields = planRelay.getRelayFields(plan)
+        planText, precomputed = planRelay.decodeRelayFields(fields)
+        self.assertEqual(json.loads(planText)['uuid'], plan.uuid)
+        self.assertEqual(precomputed['numStations'], plan.numStations)
+        self.assertNotIn('elementStats', precomputed['stats'])
+        # old receivers read the plan from the legacy field, sent only on request
+        self.assertNotIn(planRelay.LEGACY_FIELD, fields)
+        with override_settings(XGDS_PLANNER_RELAY_LEGACY_FIELD=True):
+            self.assertEqual(planRelay.getRelayFields(plan)[planRelay.LEGACY_FIELD], planText)
+
+        # the receiver takes the derived columns from the sender
+        received = Plan(jsonPlan=jsonCodec.loadsDotDict(planText))
+        received.extractFromJson(precomputed=precomputed)
+        self.assertEqual(received.summary, plan.summary)
+        self.assertEqual(received.lengthMeters, plan.lengthMeters)
+
+        # columns computed against another schema are recomputed
+        precomputed['schemaHash'] = 'other'
+        precomputed['summary'] = 'bogus'
+        received.extractFromJson(precomputed=precomputed)
+        self.assertEqual(received.summary, plan.summary)
+
+        fields['planRelayEncoding'] = 'identity'
+        self.assertRaises(planRelay.PlanRelayError, planRelay.decodeRelayFields, fields)
+
+    def test_plan_index_json_conditional_get(self):
+        url = reverse('planner2_planIndexJson')
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+
+        # saving a plan invalidates the cached index
+        plan = Plan.objects.get(uuid='421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e')
+        plan.name = 'renamed for index test'
+        plan.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('renamed for index test', response.content)
+
+    def test_plan_json_deferred(self):
+        uuid = '421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e'
+        plan = Plan.objects.get(uuid=uuid)
+        self.assertEqual(plan.get_deferred_fields(), set(['jsonPlan', 'stats', 'statsCache', 'routeGeometry']))
+        # the blob is loaded on first access
+        self.assertEqual(plan.jsonPlan.uuid, uuid)
+
+        plan = Plan.objects.withJson('stats').get(uuid=uuid)
+        self.assertEqual(plan.get_deferred_fields(), set(['jsonPlan', 'statsCache', 'routeGeometry']))
+        plan = Plan.objects.withJson().get(uuid=uuid)
+        self.assertEqual(plan.get_deferred_fields(), set())
+
+    def test_plan_routes_bbox(self):
+        plan = Plan.objects.get(uuid='421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e')
+        plan.extractFromJson(overWriteDateModified=False)
+        plan.save()
+        west, south, east, north = plan.routeGeometry.bbox
+        self.assertEqual(len(plan.toMapDict()['stations']),
+                         len(plan.routeGeometry.geometry.coordinates))
+
+        url = reverse('planner2_planRoutesJson')
+        inside = '%s,%s,%s,%s' % (west - 0.001, south - 0.001, west + 0.001, south + 0.001)
+        response = self.client.get(url, {'bbox': inside})
+        self.assertEquals(response.status_code, 200)
+        features = json.loads(response.content)['features']
+        self.assertIn(plan.uuid, [f['id'] for f in features])
+
+        outside = '%s,%s,%s,%s' % (east + 1, north + 1, east + 2, north + 2)
+        response = self.client.get(url, {'bbox': outside})
+        features = json.loads(response.content)['features']
+        self.assertNotIn(plan.uuid, [f['id'] for f in features])
+
+        response = self.client.get(url, {'bbox': '1,2,3'})
+        self.assertEquals(response.status_code, 400)
+
+        # one query for all the routes, none per plan
+        request = RequestFactory().get(url)
+        with self.assertNumQueries(1):
+            response = views.getPlanRoutesJson(request)
+        self.assertIn(plan.uuid, [f['id'] for f in json.loads(response.content)['features']])
+
+    def test_spatial_index(self):
+        grid = spatialIndex.GridIndex(cellDegrees=1.0)
+        grid.insert('a', (0.1, 0.1, 0.2, 0.2))
+        grid.insert('b', (3.5, 3.5, 3.5, 3.5))
+        grid.insert('big', (-50, -50, 50, 50))
+        self.assertEqual(sorted(k for k, _v in grid.searchBbox((3, 3, 4, 4))), ['b', 'big'])
+        self.assertEqual([k for _d, k, _v in grid.nearest(3.4, 3.4, 2)], ['big', 'b'])
+        grid.remove('big')
+        self.assertEqual([k for _d, k, _v in grid.nearest(0, 0, 1)], ['a'])
+        self.assertEqual([k for _d, k, _v in grid.searchRadius(0.3, 0.3, 20000)], ['a'])
+        self.assertEqual(grid.searchRadius(0.3, 0.3, 5000), [])
+
+        plan = Plan.objects.get(uuid='421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e')
+        plan.extractFromJson(overWriteDateModified=False)
+        plan.save()
+        url = reverse('planner2_spatialQueryJson', args=['plans'])
+        params = {'lon': plan.minLon, 'lat': plan.minLat, 'k': 1}
+        response = self.client.get(url, params)
+        self.assertEquals(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)[0]['id'], plan.uuid)
+
+        # deleting the plan takes it out of the index without a rebuild
+        plan.deleted = True
+        plan.save()
+        response = self.client.get(url, params)
+        self.assertNotIn(plan.uuid, [r['id'] for r in json.loads(response.content)])
+
+        response = self.client.get(url, {'lon': 1})
+        self.assertEquals(response.status_code, 400)
+
+    def test_site_frame_kd_tree(self):
+        rng = random.Random(0)
+        points = [(rng.uniform(-180, 180), rng.uniform(-80, 80)) for _ in xrange(200)]
+        tree = siteFrames.KdTree([(siteFrames.lonLatToEcef(*p), p) for p in points])
+        for _ in xrange(50):
+            target = siteFrames.lonLatToEcef(rng.uniform(-180, 180), rng.uniform(-80, 80))
+            expected = min(sum([(a - b) ** 2 for a, b in zip(siteFrames.lonLatToEcef(*p), target)])
+                           for p in points)
+            self.assertAlmostEqual(tree.nearest(target)[0], expected)
+        self.assertIsNone(siteFrames.KdTree([]).nearest((0, 0, 0)))
+
+    def test_site_frame_registry_reload(self):
+        class FakeSite(object):
+            alternateCrs = None
+
+            def __init__(self, id):
+                self.id = id
+
+        schemas = [('rover', object())]
+        registry = siteFrames.SiteFrameRegistry()
+        registry.getSchemas = lambda: list(schemas)
+        registry.collectSites = lambda schemas: [FakeSite(id(schemas[0][1]))]
+
+        legacy = []
+        with override_settings(XGDS_PLANNER_SITE_FRAMES=legacy):
+            sites = registry.getSites()
+            self.assertIs(registry.getSites(), sites)
+            # the deprecated setting is filled in
+            self.assertEqual(legacy, sites)
+            # a reloaded schema rebuilds the registry
+            schemas[0] = ('rover', object())
+            self.assertNotEqual(registry.getSites()[0].id, sites[0].id)
+            self.assertEqual(legacy, registry.getSites())
+
+        configured = [FakeSite('configured')]
+        with override_settings(XGDS_PLANNER_SITE_FRAMES=configured):
+            registry = siteFrames.SiteFrameRegistry()
+            self.assertEqual(registry.getSites(), configured)
+
+    def test_plan_list_pagination(self):
+        url = reverse('planner2_planListJson')
+        expected = [p.uuid for p in Plan.objects.filter(deleted=False).order_by('name', 'pk')]
+        listed = []
+        params = {'sort': 'name', 'limit': 1}
+        while True:
+            response = self.client.get(url, params)
+            self.assertEquals(response.status_code, 200)
+            page = json.loads(response.content)
+            self.assertLessEqual(len(page['plans']), 1)
+            listed.extend([p['uuid'] for p in page['plans']])
+            if not page['next']:
+                break
+            params['cursor'] = page['next']
+        self.assertEqual(listed, expected)
+
+        response = self.client.get(url, {'sort': 'bogus'})
+        self.assertEquals(response.status_code, 400)
+
+        response = self.client.get(url, {'sort': '-creator', 'limit': 1})
+        self.assertEquals(response.status_code, 200)
+
+    def test_backfill_plan_columns(self):
+        uuid = '421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e'
+        plan = Plan.objects.withJson('jsonPlan').get(uuid=uuid)
+        platform = plan.jsonPlan.platform.name
+        # fill in the other fixture plans so only this one changes below
+        call_command('backfillPlanColumns', stdout=StringIO())
+        # as if saved before the columns were added
+        Plan.objects.filter(uuid=uuid).update(platformName='', siteId='', siteName=None, planVersion=None)
+        url = reverse('planner2_planListJson')
+        response = self.client.get(url, {'platform': platform})
+        self.assertNotIn(uuid, [p['uuid'] for p in json.loads(response.content)['plans']])
+
+        # one query to read the plans, one to update the changed one
+        # and one to find there are no more
+        with self.assertNumQueries(3):
+            call_command('backfillPlanColumns', '--batchSize', str(Plan.objects.count()), stdout=StringIO())
+        self.assertEqual(Plan.objects.get(uuid=uuid).platformName, platform)
+        response = self.client.get(url, {'platform': platform})
+        self.assertIn(uuid, [p['uuid'] for p in json.loads(response.content)['plans']])
+
+    @skipIf(getattr(settings, 'XGDS_PLANNER_TEST_SKIP_PLAN_EXPORT',
+                    settings.XGDS_PLANNER_TEST_SKIP_PLAN_EXPORT),
+            'plan export test set to be skipped')
+    def test_pml_streaming_export(self):
+        dbPlan = Plan.objects.get(uuid='421d0eb5-f04d-4f36-a4f7-503e0ca8ef2e')
+        dbPlan.jsonPlan.sequence = dbPlan.jsonPlan.sequence * 500
+        startTime = datetime.datetime(2016, 1, 1, tzinfo=pytz.utc)
+
+        def makeExporter():
+            exporter = PmlPlanExporter()
+            exporter.startTime = startTime
+            return exporter
+
+        # count the stations walked so far, to see when chunks come out
+        exporter = makeExporter()
+        plan, schema = exporter.loadDbPlan(dbPlan, None)
+        numStations = len([elt for elt in plan.sequence if elt.type == 'Station'])
+        walked = []
+        exportStation = exporter.exportStation
+
+        def countingExportStation(station, context):
+            walked.append(station)
+            return exportStation(station, context)
+        exporter.exportStation = countingExportStation
+
+        chunks = exporter.iterExportPlan(plan, schema)
+        firstChunk = next(chunks)
+        # the first chunk must be produced well before the whole plan is walked
+        self.assertLess(len(walked), numStations / 2)
+        streamed = firstChunk + ''.join(chunks)
+        self.assertEqual(len(walked), numStations)
+
+        exporter = makeExporter()
+        expected = exporter.serializeExportedObject(exporter.exportDbPlan(dbPlan, None))
+        self.assertEqual(streamed, expected)
+
     @skipIf(getattr(settings, 'XGDS_PLANNER_TEST_SKIP_CREATE_PLAN_PAGE',
                     settings.XGDS_PLANNER_TEST_SKIP_CREATE_PLAN_PAGE),
             'plan create page test set to be skipped')
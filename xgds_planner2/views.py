@@ -18,6 +18,7 @@ import sys
 import pytz
 import collections
 import os
+import tempfile
 from cStringIO import StringIO
 import datetime
 import json
@@ -37,10 +38,12 @@ from django.http import (HttpResponseRedirect,
                          Http404,
                          HttpResponseNotAllowed,
                          HttpResponseBadRequest,
-                         JsonResponse)
+                         JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import render, get_object_or_404
 from django.template import RequestContext
 from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition
 
 from geocamUtil.datetimeJsonEncoder import DatetimeJsonEncoder
 from geocamUtil import timezone
@@ -48,16 +51,24 @@ from geocamUtil.models.UuidField import makeUuid
 from geocamUtil.KmlUtil import wrapKmlDjango
 from geocamUtil.dotDict import convertToDotDictRecurse, DotDict
 from geocamUtil.loader import LazyGetModelByName, getClassByName
-from geocamUtil.usng.usng import LLtoUTM
-from geocamUtil.geomath import calculateUTMDiffMeters
 from geocamUtil.modelJson import modelToJson
 from geocamUtil.TimeUtil import utcToTimeZone
 from geocamUtil.models import SiteFrame
 
 from xgds_planner2 import (models,
+                           bulkExport,
+                           bulkImport,
+                           jsonCodec,
                            choosePlanExporter,
+                           exportCache,
+                           exportPipeline,
+                           planExporter,
                            choosePlanImporter,
                            planImporter,
+                           planIndex as planIndexModule,
+                           planRelay,
+                           siteFrames,
+                           spatialIndex,
                            fillIdsPlanExporter)
 from xgds_planner2.forms import UploadXPJsonForm, CreatePlanForm, ImportPlanForm
 from xgds_planner2.models import getPlanSchema
@@ -110,9 +121,9 @@ def plan_tests(request, plan_id, editable=True):
                    # xpjson.dumpDocumentToString(planSchema.getSchema()),
                    'plan_library_json': planSchema.getJsonLibrary(),
                    # xpjson.dumpDocumentToString(planSchema.getLibrary()),
-                   'plan_json': json.dumps(plan_json),
+                   'plan_json': jsonCodec.dumps(plan_json),
                    'plan_name': plan.name,
-                   'plan_index_json': json.dumps(plan_index_json()),
+                   'plan_index_json': planIndexModule.getPlanIndex()['json'],
                    'editable': editable,
                    'simulatorUrl': planSchema.simulatorUrl,
                    'simulator': planSchema.simulator,
@@ -120,8 +131,8 @@ def plan_tests(request, plan_id, editable=True):
                        staticfiles_storage.url('xgds_planner2/images/placemark_circle.png')),
                    'placemark_circle_highlighted_url': request.build_absolute_uri(
                        staticfiles_storage.url('xgds_planner2/images/placemark_circle_highlighted.png')),
-                   'plan_links_json': json.dumps(plan.getLinks()),
-                   'plan_namedURLs_json': json.dumps(plan.namedURLs),
+                   'plan_links_json': jsonCodec.dumps(plan.getLinks()),
+                   'plan_namedURLs_json': jsonCodec.dumps(plan.namedURLs),
                    })
 
 
@@ -149,13 +160,13 @@ def handleCallbacks(request, plan, mode):
     return plan
 
 
-def populatePlanFromJson(plan, rawData):
-    data = json.loads(rawData)
+def populatePlanFromJson(plan, rawData, precomputed=None):
+    data = jsonCodec.loads(rawData)
     for k, v in data.iteritems():
         if k == "_simInfo":
             continue
         plan.jsonPlan[k] = v
-    plan.extractFromJson(overWriteDateModified=True)
+    plan.extractFromJson(overWriteDateModified=True, precomputed=precomputed)
 
 
 def plan_save_from_relay(request, plan_id):
@@ -165,7 +176,15 @@ def plan_save_from_relay(request, plan_id):
         plan = PLAN_MODEL.get().objects.get(pk=plan_id)
     except:
         plan = PLAN_MODEL.get()(pk=plan_id)
-    populatePlanFromJson(plan, request.POST['jsonPlan'])
+    if planRelay.RELAY_FIELD in request.POST:
+        try:
+            planText, precomputed = planRelay.decodeRelayFields(request.POST)
+        except planRelay.PlanRelayError, e:
+            return JsonResponse({"status": "error", "msg": str(e)}, status=400)
+    else:
+        # relayed by a server that predates planRelay.py
+        planText, precomputed = request.POST[planRelay.LEGACY_FIELD], None
+    populatePlanFromJson(plan, planText, precomputed)
     plan.save()
     return JsonResponse({"status": "success", "planPK": plan.pk})
 
@@ -175,7 +194,7 @@ def get_last_changed_planID_for_user_json(request, username):
     plan = PLAN_MODEL.get().objects.filter(creator__username=username).order_by('-dateModified')[0]
     planMetadata = {"planID": plan.id, "planUUID": plan.uuid, "planName": plan.name,
                     "lastModified": plan.dateModified, "username": username}
-    return HttpResponse(json.dumps(planMetadata, cls=DatetimeJsonEncoder), content_type='application/json')
+    return HttpResponse(jsonCodec.dumps(planMetadata, cls=DatetimeJsonEncoder), content_type='application/json')
 
 
 def plan_save_json(request, plan_id, jsonPlanId=None):
@@ -186,7 +205,7 @@ def plan_save_json(request, plan_id, jsonPlanId=None):
     """
     plan = PLAN_MODEL.get().objects.get(pk=plan_id)
     if request.method == "GET":
-        return HttpResponse(json.dumps(plan.jsonPlan), content_type='application/json')
+        return HttpResponse(jsonCodec.dumps(plan.jsonPlan), content_type='application/json')
     elif request.method == "PUT":
         # this is coming in from the regular plan editor
         populatePlanFromJson(plan, request.body)
@@ -194,9 +213,10 @@ def plan_save_json(request, plan_id, jsonPlanId=None):
         plan.save()
 
         plan = handleCallbacks(request, plan, settings.SAVE)
-        addRelay(plan, None, json.dumps({"jsonPlan": json.dumps(plan.jsonPlan)}),
+        planText = jsonCodec.dumps(plan.jsonPlan)
+        addRelay(plan, None, planRelay.dumpRelayData(plan, planText),
                  reverse('planner2_save_plan_from_relay', kwargs={'plan_id': plan.pk}), update=True)
-        return HttpResponse(json.dumps(plan.jsonPlan), content_type='application/json')
+        return HttpResponse(planText, content_type='application/json')
 
     elif request.method == "POST":
         # we are doing a save as
@@ -225,12 +245,13 @@ def plan_save_json(request, plan_id, jsonPlanId=None):
         exporter = fillIdsPlanExporter.FillIdsPlanExporter()
         planDict = convertToDotDictRecurse(plan.jsonPlan)
         updateAllUuids(planDict)
-        plan.jsonPlan = json.dumps(exporter.exportPlan(planDict, schema.schema))
+        plan.jsonPlan = jsonCodec.dumps(exporter.exportPlan(planDict, schema.schema))
         plan.uuid = planDict.uuid
 
         plan.save()
         handleCallbacks(request, plan, settings.SAVE)
-        addRelay(plan, None, json.dumps({"jsonPlan": plan.jsonPlan}),
+        # plan.jsonPlan still holds the text assigned above
+        addRelay(plan, None, planRelay.dumpRelayData(plan, plan.jsonPlan),
                  reverse('planner2_save_plan_from_relay', kwargs={'plan_id': plan.pk}))
 
         #         response = {}
@@ -263,13 +284,13 @@ def plan_detail_doc(request, plan_id=None):
     return render(request,
                   'xgds_planner2/planDetailDoc.html',
                   {'plan_json': plan_json,
-                   'plan_schema': json.loads(planSchema.getJsonSchema()),
-                   'plan_library': json.loads(planSchema.getJsonLibrary())})
+                   'plan_schema': jsonCodec.loads(planSchema.getJsonSchema()),
+                   'plan_library': jsonCodec.loads(planSchema.getJsonLibrary())})
 
 
 def fixTimezonesInPlans():
     # we added timezone to the site frame in the library but may have created plans without that -- patch them
-    for plan in PLAN_MODEL.get().objects.all():
+    for plan in PLAN_MODEL.get().objects.all().withJson():
         try:
             plan_timezone = plan.jsonPlan.site.alternateCrs.properties.timezone
         except AttributeError:
@@ -317,7 +338,7 @@ def plan_editor_app(request, plan_id=None, editable=True):
     pe = None
     try:
         if plan.executions and plan.executions.count() > 0:
-            pe = json.dumps(plan.executions.all()[0].toSimpleDict(), cls=DatetimeJsonEncoder)
+            pe = jsonCodec.dumps(plan.executions.all()[0].toSimpleDict(), cls=DatetimeJsonEncoder)
     except:
         pass
 
@@ -328,13 +349,13 @@ def plan_editor_app(request, plan_id=None, editable=True):
         'app': 'xgds_planner2/js/plannerApp.js',
         # 'saveSearchForm': MapSearchForm(),
         'searchForms': getSearchForms(),
-        'flight_names': json.dumps(getAllFlightNames()),
+        'flight_names': jsonCodec.dumps(getAllFlightNames()),
         'plan_schema_json': planSchema.getJsonSchema(),  # xpjson.dumpDocumentToString(planSchema.getSchema()),
         'plan_library_json': planSchema.getJsonLibrary(),  # xpjson.dumpDocumentToString(planSchema.getLibrary()),
-        'plan_json': json.dumps(plan.jsonPlan),
+        'plan_json': jsonCodec.dumps(plan.jsonPlan),
         'plan_name': plan.name,
         'plan_execution': pe,
-        'plan_index_json': json.dumps(plan_index_json()),
+        'plan_index_json': planIndexModule.getPlanIndex()['json'],
         'editable': editable and not plan.readOnly,
         'simulatorUrl': planSchema.simulatorUrl,
         'simulator': planSchema.simulator,
@@ -342,7 +363,7 @@ def plan_editor_app(request, plan_id=None, editable=True):
         'placemark_circle_highlighted_url': staticfiles_storage.url('xgds_planner2/images/placemark_circle_highlighted.png'),
         'placemark_directional_url': staticfiles_storage.url('xgds_planner2/images/placemark_directional.png'),
         'placemark_selected_directional_url': staticfiles_storage.url('xgds_planner2/images/placemark_directional_highlighted.png'),
-        'plan_links_json': json.dumps(plan.getLinks()),
+        'plan_links_json': jsonCodec.dumps(plan.getLinks()),
         'help_content_path': 'xgds_planner2/help/editPlan.rst',
         'title': 'List %ss' % settings.XGDS_PLANNER_PLAN_MONIKER
     }
@@ -368,7 +389,7 @@ def planIndex(request):
     complemented with a nice index API method for rich JavaScript
     clients.
     """
-    context = {'plans': PLAN_MODEL.get().objects.filter(deleted=False),
+    context = {'plans': PLAN_MODEL.get().objects.filter(deleted=False).withJson('stats'),
                'flight_names': getAllFlightNames(),
                'exporters': choosePlanExporter.PLAN_EXPORTERS,
                'rest_services': get_rest_services(),
@@ -385,31 +406,90 @@ def planIndex(request):
 
 
 def plan_index_json():
-    plan_objs = PLAN_MODEL.get().objects.filter(deleted=False)
-    plans_json = []
-    for plan in plan_objs:
-        plans_json.append({
-            'id': plan.pk,
-            'uuid': plan.uuid,
-            'name': plan.name,
-            'url': plan.get_absolute_url(),
-            'dateModified': plan.dateModified.isoformat(),
-            'creator': plan.creator.username if plan.creator else "",
-            'numStations': plan.numStations,
-            'numSegments': plan.numSegments,
-            'numCommands': plan.numCommands,
-            'lengthMeters': plan.lengthMeters,
-            'estimatedDurationsSeconds': plan.estimatedDurationSeconds
-        })
-
-    return plans_json
+    return jsonCodec.loads(planIndexModule.getPlanIndex()['json'])
 
 
+@condition(etag_func=lambda request: planIndexModule.getPlanIndex()['etag'],
+           last_modified_func=lambda request: planIndexModule.getPlanIndex()['lastModified'])
 def getPlanIndexJson(request):
-    return HttpResponse(json.dumps(plan_index_json()),
+    return HttpResponse(planIndexModule.getPlanIndex()['json'],
+                        content_type='application/json')
+
+
+def getPlanListJson(request):
+    """
+    One page of the plan listing. Accepts the filters platform, site,
+    creator, readOnly, modifiedAfter and modifiedBefore, plus sort
+    (dateModified, name or creator, prefixed with '-' for descending),
+    limit and the cursor returned as "next" by the previous page.
+    """
+    try:
+        plans, nextCursor = planIndexModule.getPlanListPage(request.GET)
+    except planIndexModule.PlanListError, e:
+        return HttpResponseBadRequest(str(e))
+    return HttpResponse(jsonCodec.dumps({'plans': plans, 'next': nextCursor}),
+                        content_type='application/json')
+
+
+def getPlanRoutesJson(request):
+    """
+    The routes of the listed plans (see getPlanListJson) as a GeoJSON
+    FeatureCollection, read from the precomputed routeGeometry. Pass
+    bbox=west,south,east,north to get only the plans in a map view.
+    """
+    # routeGeometry is deferred by default, and only() keeps that
+    queryset = (PLAN_MODEL.get().objects.withJson('routeGeometry')
+                .only('uuid', 'routeGeometry', 'dateModified', 'name', 'creator'))
+    features = []
+    try:
+        for plan in getListedPlans(request, '-dateModified', queryset):
+            route = plan.routeGeometry
+            if route and route.get('geometry'):
+                route.id = plan.uuid
+                features.append(route)
+    except planIndexModule.PlanListError, e:
+        return HttpResponseBadRequest(str(e))
+    return HttpResponse(jsonCodec.dumps({'type': 'FeatureCollection',
+                                         'features': features}),
                         content_type='application/json')
 
 
+def getSpatialQueryJson(request, layer):
+    """
+    Query the in-process spatial index of plan routes or site frame
+    origins. Pass bbox=west,south,east,north, or lon and lat with
+    either radius (meters) or k (number of nearest results).
+    """
+    if layer == 'siteFrames':
+        grid = spatialIndex.SITE_FRAME_SPATIAL_INDEX.getGrid()
+    else:
+        grid = spatialIndex.PLAN_SPATIAL_INDEX.getGrid()
+    try:
+        result = spatialIndex.runQuery(grid, request.GET)
+    except spatialIndex.SpatialQueryError, e:
+        return HttpResponseBadRequest(str(e))
+    return HttpResponse(jsonCodec.dumps(result), content_type='application/json')
+
+
+def getListedPlans(request, defaultSort, queryset=None):
+    """
+    Return the plans selected by the plan listing parameters in
+    *request*: one page if it asks for a limit or cursor, otherwise an
+    iterator over all of them.
+    """
+    if queryset is None:
+        queryset = PLAN_MODEL.get().objects.all()
+    queryset = planIndexModule.filterPlans(queryset,
+                                           **planIndexModule.getFilterArgs(request.GET))
+    sort = request.GET.get('sort', defaultSort)
+    if 'limit' in request.GET or 'cursor' in request.GET:
+        plans, nextCursor = planIndexModule.getPlanPage(queryset, sort,
+                                                        request.GET.get('cursor'),
+                                                        request.GET.get('limit'))
+        return plans
+    return planIndexModule.iterPlans(queryset, sort)
+
+
 def getDbPlan(uuid, idIsPK=False):
     if idIsPK:
         try:
@@ -430,36 +510,76 @@ def planExport(request, uuid, name, time=None, outputDirectory=None, isAjax=Fals
     formatCode = request.GET.get('format')
     if formatCode is not None:
         # user explicitly specified e.g. '?format=kml'
-        exporterClass = choosePlanExporter.PLAN_EXPORTERS_BY_FORMAT.get(formatCode)
-        if exporterClass is None:
+        exporterInfo = choosePlanExporter.PLAN_EXPORTERS_BY_FORMAT.get(formatCode)
+        if exporterInfo is None:
             return HttpResponseBadRequest('invalid export format %s' % formatCode)
     else:
         # filename ends with e.g. '.kml'
-        exporterClass = None
+        exporterInfo = None
         for entry in choosePlanExporter.PLAN_EXPORTERS:
             if name.endswith(entry.extension):
-                exporterClass = entry.exporterClass
-        if exporterClass is None:
+                exporterInfo = entry
+        if exporterInfo is None:
             return HttpResponseBadRequest(
                 'could not infer export format to use: "format" query parameter not set and extension not recognized for filename "%s"' % name)
 
-    exporter = exporterClass()
+    exporter = exporterInfo.exporterClass()
+    startTime = None
     if time:
         try:
             thetime = dateparser(time)
-            context = DotDict({'startTime': thetime.astimezone(pytz.utc)})
+            startTime = thetime.astimezone(pytz.utc)
+            context = DotDict({'startTime': startTime})
             exporter.initPlan(dbPlan, context)
         except:
             pass
 
+    chunks = exportCache.iterCachedExport(dbPlan, exporterInfo, exporter, request, startTime)
     if outputDirectory:
         # output the exported file to a directory
-        exporter.exportDbPlanToPath(dbPlan, os.path.join(outputDirectory, name), request)
+        planExporter.writeChunksToPath(chunks, os.path.join(outputDirectory, name))
         return True
     elif not isAjax:
-        return exporter.getHttpResponse(dbPlan, name, request)
+        return exporter.makeHttpResponse(chunks, name)
     else:
-        return exporter.getHttpResponse(dbPlan, None, request)
+        return exporter.makeHttpResponse(chunks)
+
+
+def getBulkExportZip(request):
+    """
+    Stream a zip of the listed plans (filtered as for getPlanListJson,
+    or given as ids=1,2,3) exported in formats=.kml,.pml, ending with a
+    report.json of per-format timings and errors.
+    """
+    extensions = [e for e in request.GET.get('formats', '').split(',') if e]
+    if not extensions:
+        return HttpResponseBadRequest('expected formats=<extension>,...')
+    try:
+        bulkExport.getExporterInfos(extensions)
+        queryset = planIndexModule.filterPlans(PLAN_MODEL.get().objects.all(),
+                                               **planIndexModule.getFilterArgs(request.GET))
+        if request.GET.get('ids'):
+            queryset = queryset.filter(pk__in=[int(pk) for pk in request.GET['ids'].split(',')])
+    except (bulkExport.BulkExportError, planIndexModule.PlanListError, ValueError), e:
+        return HttpResponseBadRequest(str(e))
+    maxPlans = settings.XGDS_PLANNER_BULK_EXPORT_MAX_PLANS
+    planIds = list(queryset.order_by('pk').values_list('pk', flat=True)[:maxPlans + 1])
+    if len(planIds) > maxPlans:
+        return HttpResponseBadRequest('more than %d plans to export, narrow the filters '
+                                      'or use manage.py exportPlans' % maxPlans)
+    # exported in this process, see bulkExport.py
+    response = StreamingHttpResponse(bulkExport.iterZipExport(planIds, extensions,
+                                                              exportPipeline.DetachedRequest(request),
+                                                              processes=0),
+                                     content_type='application/zip')
+    response['Content-disposition'] = 'attachment; filename=plans.zip'
+    return response
+
+
+def getExportCacheStatsJson(request):
+    cache = exportCache.getExportCache()
+    stats = cache.getStats() if cache is not None else None
+    return HttpResponse(jsonCodec.dumps(stats), content_type='application/json')
 
 
 def planCreate(request):
@@ -500,11 +620,7 @@ def planCreate(request):
                                          meta=meta,
                                          planSchema=planSchema)
 
-            # bit of a hack, setting the name from the id
-            planId = dbPlan.jsonPlan.id
-            dbPlan.jsonPlan["name"] = planId
-            dbPlan.jsonPlan["uuid"] = dbPlan.uuid  # makeUuid()
-            dbPlan.name = planId
+            planImporter.setNameFromId(dbPlan)
 
             dbPlan.save()
             handleCallbacks(request, dbPlan, settings.SAVE)
@@ -521,12 +637,53 @@ def planCreate(request):
                    'siteLabel': 'Create'})
 
 
+def importPlanZip(request, uploadedFile, meta, platform):
+    """
+    Bulk import the plan files in an uploaded zip file and report the
+    outcome as messages on the plan index. Unlike a single imported
+    file, the plans do not go through handleCallbacks(), so they are
+    not relayed.
+    """
+    if uploadedFile.size > settings.XGDS_PLANNER_BULK_IMPORT_MAX_UPLOAD_BYTES:
+        messages.error(request, 'Could not import %s: bigger than %d bytes, use manage.py importPlans'
+                       % (uploadedFile.name, settings.XGDS_PLANNER_BULK_IMPORT_MAX_UPLOAD_BYTES))
+        return HttpResponseRedirect(reverse('planner2_planImport'))
+    fd, path = tempfile.mkstemp(suffix='.zip')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in uploadedFile.chunks():
+                out.write(chunk)
+        # parsed in this process, see bulkImport.py
+        report = bulkImport.importPlans(path, meta,
+                                        platform=platform,
+                                        processes=0,
+                                        maxFiles=settings.XGDS_PLANNER_BULK_IMPORT_MAX_FILES)
+    except bulkImport.BulkImportError, e:
+        messages.error(request, 'Could not import %s: %s' % (uploadedFile.name, e))
+        return HttpResponseRedirect(reverse('planner2_planImport'))
+    finally:
+        os.remove(path)
+
+    summary = report.toDict()
+    messages.info(request, 'Imported %d of %d files from %s'
+                  % (summary['imported'], summary['files'], uploadedFile.name))
+    errors = report.getErrors()
+    for entry in errors[:20]:
+        messages.error(request, '%(fileName)s: %(error)s' % entry)
+    if len(errors) > 20:
+        messages.error(request, '... and %d more files failed' % (len(errors) - 20))
+    return HttpResponseRedirect(reverse('planner2_index'))
+
+
 def planImport(request):
     if request.method == 'GET':
         messages.info(request, 'Create a ' + settings.XGDS_PLANNER_PLAN_MONIKER + ' by importing:')
         messages.info(request, 'a kml file containing a LineString')
         messages.info(request, 'a csv file, with column headers of latitude and longitude, and optional name and notes')
         messages.info(request, 'an xpJson file')
+        messages.info(request, 'a zip file of any of these (up to %d files; '
+                      'save callbacks do not run and the plans are not relayed)'
+                      % settings.XGDS_PLANNER_BULK_IMPORT_MAX_FILES)
         form = ImportPlanForm()
     elif request.method == 'POST':
         form = ImportPlanForm(request.POST, request.FILES)
@@ -557,8 +714,11 @@ def planImport(request):
                         meta['site'] = hackSite
                         break
 
-            importer = choosePlanImporter.chooseImporter(form.cleaned_data['sourceFile'].name)
             f = request.FILES['sourceFile']
+            if f.name.lower().endswith('.zip'):
+                return importPlanZip(request, f, meta, form.cleaned_data['platform'])
+
+            importer = choosePlanImporter.chooseImporter(form.cleaned_data['sourceFile'].name)
             buf = ''.join([chunk for chunk in f.chunks()])
 
             dbPlan = importer.importPlan('tempName',
@@ -566,11 +726,7 @@ def planImport(request):
                                          meta=meta,
                                          planSchema=planSchema)
 
-            # bit of a hack, setting the name from the id
-            planId = dbPlan.jsonPlan.id
-            dbPlan.jsonPlan["name"] = planId
-            dbPlan.jsonPlan["uuid"] = dbPlan.uuid  # makeUuid()
-            dbPlan.name = planId
+            planImporter.setNameFromId(dbPlan)
 
             dbPlan.save()
             handleCallbacks(request, dbPlan, settings.SAVE)
@@ -606,15 +762,15 @@ def plan_delete(request):
 def getPlanIndexKml(request):
     out = StringIO()
     out.write('<Document>\n')
-    plans = PLAN_MODEL.get().objects.filter(deleted=False)
-    plans = list(reversed(sorted(plans, key=lambda plan: (plan.escapedName(),))))
-    for plan in plans:
-        fname = '%s.kml' % plan.escapedName()
-        relUrl = reverse('planner2_planExport', args=[plan.uuid, fname])
-        restUrl = insertIntoPath(relUrl, 'rest')
-        url = request.build_absolute_uri(restUrl)
-        #         print(url)
-        out.write("""
+    try:
+        plans = getListedPlans(request, '-name')
+        for plan in plans:
+            fname = '%s.kml' % plan.escapedName()
+            relUrl = reverse('planner2_planExport', args=[plan.uuid, fname])
+            restUrl = insertIntoPath(relUrl, 'rest')
+            url = request.build_absolute_uri(restUrl)
+            #         print(url)
+            out.write("""
 <NetworkLink>
   <name>%(name)s</name>
   <visibility>0</visibility>
@@ -623,7 +779,9 @@ def getPlanIndexKml(request):
   </Link>
 </NetworkLink>
 """
-                  % dict(name=plan.escapedName(), url=url))
+                      % dict(name=plan.escapedName(), url=url))
+    except planIndexModule.PlanListError, e:
+        return HttpResponseBadRequest(str(e))
     out.write('</Document>')
     return wrapKmlDjango(out.getvalue())
 
@@ -711,22 +869,22 @@ def schedulePlans(request, redirect=True):
                     peDict = pe.toSimpleDict()
                     del peDict['flight']
                     del peDict['plan']
-                    addRelay(pe, None, json.dumps(peDict, cls=DatetimeJsonEncoder),
+                    addRelay(pe, None, jsonCodec.dumps(peDict, cls=DatetimeJsonEncoder),
                              reverse('planner2_relaySchedulePlan'))
 
                     lastPlanExecution = pe
         except:
             traceback.print_exc()
-            return HttpResponse(json.dumps({'Success': "False", 'msg': 'Plan not scheduled'}),
+            return HttpResponse(jsonCodec.dumps({'Success': "False", 'msg': 'Plan not scheduled'}),
                                 content_type='application/json', status=406)
             pass
     if redirect:
         return HttpResponseRedirect(reverse('planner2_index'))
     else:
         if lastPlanExecution:
-            return HttpResponse(json.dumps(lastPlanExecution.toSimpleDict(), cls=DatetimeJsonEncoder),
+            return HttpResponse(jsonCodec.dumps(lastPlanExecution.toSimpleDict(), cls=DatetimeJsonEncoder),
                                 content_type='application/json')
-        return HttpResponse(json.dumps({'Success': "True", 'msg': 'Plan scheduled'}), content_type='application/json')
+        return HttpResponse(jsonCodec.dumps({'Success': "True", 'msg': 'Plan scheduled'}), content_type='application/json')
 
 
 def schedulePlanActiveFlight(request, vehicleName, planPK):
@@ -766,7 +924,7 @@ def schedulePlanActiveFlight(request, vehicleName, planPK):
         peDict = lastPE.toSimpleDict()
         del peDict['flight']
         del peDict['plan']
-        addRelay(lastPE, None, json.dumps(peDict, cls=DatetimeJsonEncoder), reverse('planner2_relaySchedulePlan'))
+        addRelay(lastPE, None, jsonCodec.dumps(peDict, cls=DatetimeJsonEncoder), reverse('planner2_relaySchedulePlan'))
         return JsonResponse(peDict);
 
     except Exception, e:
@@ -778,7 +936,7 @@ def relaySchedulePlan(request):
         requires the flight, plan and ev all exist.
     """
     try:
-        form_dict = json.loads(request.POST.get('serialized_form'))
+        form_dict = jsonCodec.loads(request.POST.get('serialized_form'))
 
         try:
             id = form_dict['id']
@@ -836,63 +994,12 @@ def deletePlanExecution(request, pe_id):
 
 
 def getSiteFrames():
-    if not settings.XGDS_PLANNER_SITE_FRAMES:
-        platforms = sorted(settings.XGDS_PLANNER_SCHEMAS.keys())
-        try:
-            platforms.remove("test")
-        except ValueError:
-            pass
-
-        for platform in platforms:
-            schema = getPlanSchema(platform)
-            library = schema.getLibrary()
-            sites = library.sites
-            if sites:
-                for site in sites:
-                    try:
-                        if site.alternateCrs:
-                            settings.XGDS_PLANNER_SITE_FRAMES.append(site)
-                    except:
-                        pass
-    return settings.XGDS_PLANNER_SITE_FRAMES
+    return siteFrames.SITE_FRAME_REGISTRY.getSites()
 
 
 def getClosestSiteFrame(lat, lon):
     """ Return the site frame with centroid closest to the given location"""
-    if getSiteFrames():
-        if len(getSiteFrames()) == 1:
-            return getSiteFrames()[0]
-
-        # first convert point to UTM
-        UTM_location = LLtoUTM(lat, lon)
-        myUTM = (UTM_location[0], UTM_location[1])
-        # return (UTMEasting, UTMNorthing, zoneNumber, zoneLetter)
-
-        #  "alternateCrs": {
-        #                 "type": "roversw",
-        #                 "properties": {
-        #                     "originNorthing": 4141835,
-        #                     "originEasting": 582724,
-        #                     "projection": "utm",
-        #                     "zone": 10,
-        #                     "zoneLetter": "N",
-        closestSite = None
-        smallestDiff = None
-        for site in getSiteFrames():
-            properties = site.alternateCrs['properties']
-            oEasting = properties[unicode('originEasting')]
-            oNorthing = properties[unicode('originNorthing')]
-            diff = calculateUTMDiffMeters(myUTM, (oEasting, oNorthing))
-            if smallestDiff:
-                if diff < smallestDiff:
-                    smallestDiff = diff
-                    closestSite = site
-            else:
-                smallestDiff = diff
-                closestSite = site
-        return closestSite
-
-    return None
+    return siteFrames.SITE_FRAME_REGISTRY.getClosest(lat, lon)
 
 
 def toggleReadOnly(request):
@@ -927,10 +1034,10 @@ def externalServiceExport(request):
                 pass
 
         headers = {"replyurl": reverse("planner2_report_export_status"),
-                   "replyids": json.dumps(pids),
+                   "replyids": jsonCodec.dumps(pids),
                    "content-type": "application/json"}
         try:
-            resp = requests.post(restService.serviceUrl, data=json.dumps(planContentList), headers=headers)
+            resp = requests.post(restService.serviceUrl, data=jsonCodec.dumps(planContentList), headers=headers)
             requestStatus = resp.status_code
         except Exception as e:
             print e
@@ -938,7 +1045,7 @@ def externalServiceExport(request):
 
         result = {"status":requestStatus, "planNames":planNameList, "serviceName":serviceName,
                   "serviceDisplayName":restService.display_name}
-    return HttpResponse(content=json.dumps(result),
+    return HttpResponse(content=jsonCodec.dumps(result),
                         content_type="application/json")
 
 
@@ -958,7 +1065,7 @@ def mapJsonPlan(request, uuid=None, pk=None):
             plan = PLAN_MODEL.get().objects.get(uuid=uuid)
         elif pk:
             plan = PLAN_MODEL.get().objects.get(pk=pk)
-        json_data = json.dumps(plan.jsonPlan, indent=4)
+        json_data = jsonCodec.dumps(plan.jsonPlan, indent=4)
         return HttpResponse(content=json_data,
                             content_type="application/json")
     except:
@@ -967,11 +1074,15 @@ def mapJsonPlan(request, uuid=None, pk=None):
 
 
 def plansTreeNodes(request):
-    plans = PLAN_MODEL.get().objects.filter(deleted=False)
-    result = []
-    for plan in plans:
-        result.append(plan.get_tree_json())
-    json_data = json.dumps(result, indent=4)
+    try:
+        plans = getListedPlans(request, '-dateModified',
+                               PLAN_MODEL.get().objects.withJson('jsonPlan'))
+        result = []
+        for plan in plans:
+            result.append(plan.get_tree_json())
+    except planIndexModule.PlanListError, e:
+        return HttpResponseBadRequest(str(e))
+    json_data = jsonCodec.dumps(result, indent=4)
     return HttpResponse(content=json_data,
                         content_type="application/json")
 
@@ -1038,31 +1149,31 @@ def planImportXPJson(request):
             try:
                 plan = PLAN_MODEL.get().objects.get(uuid=planUuid)
             except:
-                return HttpResponse(json.dumps({'Success': "False", 'responseText': 'Wrong UUID, plan not found'}),
+                return HttpResponse(jsonCodec.dumps({'Success': "False", 'responseText': 'Wrong UUID, plan not found'}),
                                     content_type='application/json', status=406)
             incoming = request.FILES['file']
             newJson = handle_uploading_xpjson(incoming)
             if (len(newJson) > 0):
-                newJsonObj = json.loads(newJson, 'UTF-8')
+                newJsonObj = jsonCodec.loads(newJson)
                 foundUuid = newJsonObj['uuid']
                 if (foundUuid != planUuid):
-                    return HttpResponse(json.dumps({'Success': "False",
+                    return HttpResponse(jsonCodec.dumps({'Success': "False",
                                                     'responseText': 'Loaded JSON is for a different plan; UUID of plans do not match.'}),
                                         content_type='application/json', status=406)
                 isValid = validateJson(newJsonObj)
                 if isValid == True:
                     updateJson(plan, newJsonObj)
-                    return HttpResponse(json.dumps({'Success': "True"}))
+                    return HttpResponse(jsonCodec.dumps({'Success': "True"}))
                 else:
-                    return HttpResponse(json.dumps({'Success': "False", 'responseText': isValid}),
+                    return HttpResponse(jsonCodec.dumps({'Success': "False", 'responseText': isValid}),
                                         content_type='application/json', status=406)
             else:
-                return HttpResponse(json.dumps({'Success': "False", 'responseText': 'JSON Empty'}),
+                return HttpResponse(jsonCodec.dumps({'Success': "False", 'responseText': 'JSON Empty'}),
                                     content_type='application/json', status=406)
     except Exception:
         traceback.print_exc()
         exc_type, exc_value, exc_traceback = sys.exc_info()
-        return HttpResponse(json.dumps({'Success': "False", 'responseText': exc_value['message']}),
+        return HttpResponse(jsonCodec.dumps({'Success': "False", 'responseText': exc_value['message']}),
                             content_type='application/json', status=406)
 
 
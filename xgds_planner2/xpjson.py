@@ -21,9 +21,14 @@ Utilities for parsing and modeling XPJSON format plans, plan schemas, and plan l
 import sys
 import os
 import json
-from collections import deque, Mapping, OrderedDict
+import functools
+import hashlib
+import cPickle as pickle
+import copy_reg
+from collections import OrderedDict
 import re
 import logging
+import threading
 
 import iso8601
 try:
@@ -33,10 +38,17 @@ except ImportError:
     # transforms.  let's avoid requiring the dependency if you're only
     # doing plan validation.
     pass
+try:
+    import numpy
+except ImportError:
+    # likewise, numpy is only needed for batched coordinate transforms.
+    pass
 
 from geocamUtil import dotDict
 from geocamUtil.dotDict import DotDict
 
+from xgds_planner2 import jsonCodec
+
 # pylint: disable=R0911,C0204
 
 
@@ -113,12 +125,36 @@ KEEP_PARAM_SPECS = False
 # deletion.
 KEEP_PARAM_PARENT = False
 
+# normally field and param validation uses validator functions compiled
+# once per valueType (see getValueTypeValidator()). callers can change
+# this global to fall back to interpreting the valueType on every
+# check, which is mostly useful for benchmarking.
+COMPILE_VALIDATORS = True
+
+ARRAY_TYPE_REGEX = re.compile(r'^array(\[(?P<arrayLength>\d+)\])?\.(?P<elementType>.*)$')
+
+INTEGER_TYPES = frozenset(('integer',) + DETAILED_INTEGER_TYPE_CHOICES)
+NUMBER_TYPES = frozenset(('number',) + DETAILED_REAL_TYPE_CHOICES)
+
+# cache of valueType -> validator function, filled in by getValueTypeValidator()
+VALUE_TYPE_VALIDATORS = {}
+
+# bump this whenever a change to the classes in this module would make
+# previously pickled snapshots invalid. see dumpSnapshotToPath().
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXTENSION = '.pickle'
+
+
 class UnknownParentError(Exception):
     pass
 
 
+class CyclicInheritanceError(Exception):
+    pass
+
+
 def parseArrayType(arrayType):
-    m = re.search(r'^array(\[(?P<arrayLength>\d+)\])?\.(?P<elementType>.*)$', arrayType)
+    m = ARRAY_TYPE_REGEX.search(arrayType)
     if not m:
         return None
     elementType = m.group('elementType')
@@ -136,6 +172,9 @@ def isValueOfType(val, valueType):
     we use in this parsing library.
     """
 
+    if COMPILE_VALIDATORS:
+        return getValueTypeValidator(valueType)(val)
+
     if valueType == 'custom':
         return True  # skip validation
     elif valueType == 'string':
@@ -204,6 +243,89 @@ def isValueOfType(val, valueType):
             return val.__class__.__name__ == valueType
 
 
+def isDateTimeString(val):
+    # must be explicitly in UTC time zone
+    if not val.endswith('Z'):
+        return False
+
+    # must conform to ISO 8601 date-time format
+    try:
+        iso8601.parse_date(val)
+        return True
+    except iso8601.ParseError:
+        return False
+
+
+def compileValueTypeValidator(valueType):
+    """
+    Return a function f(val) that gives the same result as
+    isValueOfType(val, valueType), but with the dispatch on
+    *valueType* (including parsing array types) done up front.
+    """
+
+    if valueType == 'custom':
+        return lambda val: True  # skip validation
+    elif valueType in ('string', 'targetId', 'url'):
+        return lambda val: isinstance(val, (str, unicode))
+    elif valueType in INTEGER_TYPES:
+        return lambda val: isinstance(val, int)
+    elif valueType in NUMBER_TYPES:
+        return lambda val: isinstance(val, (int, float))
+    elif valueType == 'boolean':
+        return lambda val: isinstance(val, bool)
+    elif valueType == 'date-time':
+        return isDateTimeString
+    elif valueType.startswith('array'):
+        # for example, 'array.integer' -> array of integer
+        parseResult = parseArrayType(valueType)
+        assert parseResult, 'invalid array valueType %s' % valueType
+        elementType, arrayLength = parseResult
+        isValidElement = getValueTypeValidator(elementType)
+
+        def isValidArray(val):
+            if not isinstance(val, (list, tuple)):
+                return False
+            if arrayLength is not None and len(val) != arrayLength:
+                return False
+            for elt in val:
+                if not isValidElement(elt):
+                    return False
+            return True
+        return isValidArray
+    elif valueType == 'bbox':
+        # must be an array of 4 floats (2d) or 6 floats (3d)
+        isNumberArray = getValueTypeValidator('array.number')
+        return lambda val: isNumberArray(val) and len(val) in (4, 6)
+    elif valueType == 'crs':
+        return lambda val: 'type' in val and 'properties' in val
+    elif valueType == 'quaternion':
+        return lambda val: (isinstance(val, list)
+                            and len(val) == 4
+                            and all([isinstance(elt, (int, float)) for elt in val]))
+    else:
+        def isTypedObject(val):
+            if isinstance(val, (dict, dotDict.DotDict)):
+                # for example, 'ParamSpec' -> DotDict with 'type' member equal
+                # to 'ParamSpec'
+                return val['type'] == valueType
+            else:
+                # for example, 'ParamSpec' -> instance of ParamSpec class
+                return val.__class__.__name__ == valueType
+        return isTypedObject
+
+
+def getValueTypeValidator(valueType):
+    """
+    Return the cached validator function for *valueType*, compiling it
+    on first use.
+    """
+    result = VALUE_TYPE_VALIDATORS.get(valueType)
+    if result is None:
+        result = compileValueTypeValidator(valueType)
+        VALUE_TYPE_VALIDATORS[valueType] = result
+    return result
+
+
 def getIdDict(lst):
     return dict([(elt.get('id'), elt) for elt in lst])
 
@@ -218,69 +340,27 @@ def joinById(localList, parentList):
     return joinedDict.values()
 
 
-class InheritDict(Mapping):
+def mergeSpec(spec, parent, inheritFields=(), localOnlyFields=()):
     """
-    A dict-like object that implements lazy inheritance.  By default,
-    the *localVals* value for a field overrides the *parent* value.
+    Return a new DotDict with the fields of *spec* resolved against its
+    (already resolved) *parent*.  By default, the *spec* value for a
+    field overrides the *parent* value.
 
-    For fields in *inheritFields*, the resolved value is formed by
-    recursive inheritance, basically a union of the local and parent
-    values using the joinById() function.
+    For fields in *inheritFields*, the resolved value is the union of
+    the local and parent values formed by the joinById() function.
 
-    For fields in *localOnlyFields*, the value is drawn only from
-    *localVals*.
+    For fields in *localOnlyFields*, the value is drawn only from *spec*.
     """
-    def __init__(self, localVals, parent, inheritFields=None, localOnlyFields=None):
-        if inheritFields is None:
-            inheritFields = []
-        if localOnlyFields is None:
-            localOnlyFields = []
-        self.localDict = dict(localVals)
-        self.parent = parent
-        self.inheritFields = inheritFields
-        self.localOnlyFields = localOnlyFields
-
-    @staticmethod
-    def localValOverridesParentVal(getLocalVal, getParentVal):
-        try:
-            return getLocalVal()
-        except KeyError:
-            return getParentVal()
-
-    @staticmethod
-    def localValInheritsFromParentVal(getLocalVal, getParentVal):
-        try:
-            localVal = getLocalVal()
-            try:
-                parentVal = getParentVal()
-                return joinById(localVal, parentVal)
-            except KeyError:
-                return localVal
-        except KeyError:
-            return getParentVal()
-
-    @staticmethod
-    def useLocalValOnly(getLocalVal, getParentVal):
-        return getLocalVal()
-
-    def __getitem__(self, key):
-        if key in self.inheritFields:
-            func = self.localValInheritsFromParentVal
-        elif key in self.localOnlyFields:
-            func = self.useLocalValOnly
+    result = DotDict()
+    for key, val in parent.iteritems():
+        if key not in localOnlyFields:
+            result[key] = val
+    for key, val in spec.iteritems():
+        if key in inheritFields and key in parent:
+            result[key] = joinById(val, parent[key])
         else:
-            func = self.localValOverridesParentVal
-        getLocalVal = lambda: self.localDict[key]
-        getParentVal = lambda: self.parent[key]
-        return func(getLocalVal, getParentVal)
-
-    def __iter__(self):
-        possibleKeys = set(self.localDict.iterkeys()).union(self.parent.iterkeys())
-        return (k for k in possibleKeys if k in self)
-
-    def __len__(self):
-        # O(1) not possible with lazy design
-        return sum(1 for _ in iter(self))
+            result[key] = val
+    return result
 
 
 def resolveInheritanceLookup(spec, parentSpecLookup,
@@ -288,12 +368,9 @@ def resolveInheritanceLookup(spec, parentSpecLookup,
     if 'parent' in spec:
         parent = parentSpecLookup.get(spec.parent)
         if parent:
-            result = (DotDict
-                      (InheritDict
-                       (spec,
-                        parent,
-                        inheritFields=inheritFields,
-                        localOnlyFields=localOnlyFields)))
+            result = mergeSpec(spec, parent,
+                               inheritFields=inheritFields,
+                               localOnlyFields=localOnlyFields)
             if not KEEP_PARAM_PARENT:
                 result.pop('parent', None)
             return result
@@ -303,26 +380,42 @@ def resolveInheritanceLookup(spec, parentSpecLookup,
         return spec
 
 
-def resolveSpecInheritance(rawSpecs, inheritFields=None, localOnlyFields=None):
-    if inheritFields is None:
-        inheritFields = []
-    if localOnlyFields is None:
-        localOnlyFields = []
+def resolveSpecInheritance(rawSpecs, inheritFields=(), localOnlyFields=()):
+    """
+    Return a dict of id -> spec with the inheritance of each spec in
+    *rawSpecs* fully resolved. Parents are resolved before their
+    children, so each spec is merged exactly once.
+
+    Raises UnknownParentError if a spec refers to a parent that is not
+    in *rawSpecs* and CyclicInheritanceError if the parent links form a
+    cycle.
+    """
     rawSpecLookup = getIdDict(rawSpecs)
-    q = deque(rawSpecs)
     parentSpecLookup = {}
 
-    while q:
-        spec = q.popleft()
-        try:
-            parentSpecLookup[spec.id] = (resolveInheritanceLookup
-                                         (spec, parentSpecLookup,
-                                          inheritFields, localOnlyFields))
-        except UnknownParentError:
-            # parent not processed yet, try again later
-            assert spec.parent in rawSpecLookup, spec.parent
-            q.append(spec)
-            continue
+    for spec in rawSpecLookup.itervalues():
+        # walk up the parent links until we reach a spec that is
+        # already resolved or has no parent
+        chain = []
+        chainIds = set()
+        current = spec
+        while current is not None and current.id not in parentSpecLookup:
+            if current.id in chainIds:
+                raise CyclicInheritanceError(' -> '.join([s.id for s in chain] + [current.id]))
+            chain.append(current)
+            chainIds.add(current.id)
+            if 'parent' in current:
+                current = rawSpecLookup.get(current.parent)
+                if current is None:
+                    raise UnknownParentError(chain[-1].parent)
+            else:
+                current = None
+
+        # then resolve top-down
+        for current in reversed(chain):
+            parentSpecLookup[current.id] = (resolveInheritanceLookup
+                                            (current, parentSpecLookup,
+                                             inheritFields, localOnlyFields))
 
     return parentSpecLookup
 
@@ -340,7 +433,7 @@ def resolveSchemaInheritance(schemaDict):
         'abstract': True,
     }))
     commandSpecsLookup = resolveSpecInheritance(rawCommandSpecs,
-                                                inheritFields=('params'),
+                                                inheritFields=('params',),
                                                 localOnlyFields=('id', 'name', 'abstract'))
 
     # filter out abstract commandSpecs
@@ -410,6 +503,9 @@ class TypedObjectMetaClass(type):
        foo.bar calls foo.get('bar') or foo.set('bar', ...). The get()
        and set() methods are defined in TypedObject.
 
+     * The valueType of each field is compiled once into a validator
+       function, kept in the Foo.fieldValidators list.
+
     """
 
     def __new__(cls, name, bases, dct):
@@ -431,6 +527,9 @@ class TypedObjectMetaClass(type):
                 fields[fname] = val
                 dct[fname] = makeProperty(fname)
 
+        dct['fieldValidators'] = [(fname, spec, getValueTypeValidator(spec.valueType))
+                                  for fname, spec in fields.iteritems()]
+
         return type.__new__(cls, name, bases, dct)
 
 
@@ -504,16 +603,30 @@ class TypedObject(object):
     def set(self, fieldName, val):
         self._objDict[fieldName] = val
 
+    # explicit pickle support; without it, pickle's lookups on a
+    # half-built object would recurse through __getattr__().
+    def __getstate__(self):
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
     def checkFields(self):
+        if COMPILE_VALIDATORS:
+            fieldValidators = self.fieldValidators
+        else:
+            fieldValidators = [(fieldName, spec, functools.partial(isValueOfType, valueType=spec.valueType))
+                               for fieldName, spec in self.fields.iteritems()]
+
         # validate fields declared in XPJSON spec
-        for fieldName, spec in self.fields.iteritems():
+        for fieldName, spec, isValidType in fieldValidators:
             val = self.get(fieldName)
             if val is None:
                 assert not spec.required, \
                     'required field %s missing from %s' % (fieldName, self._objDict)
                 val = spec.default
             if val is not None:
-                assert isValueOfType(val, spec.valueType), \
+                assert isValidType(val), \
                     '%s should have valueType %s in %s' % (fieldName, spec.valueType, self._objDict)
             if val is not None and spec.validMethod is not None:
                 validMethod = getattr(self, spec.validMethod)
@@ -587,6 +700,9 @@ class ParamSpec(TypedObject):
         else:
             self.enum = [c[0] for c in self.choices]
 
+        # built on first call to invalidParamValueReason()
+        self._valueValidator = None
+
     def isNotEmpty(self, val):
         return len(val) > 0
         
@@ -610,7 +726,71 @@ class ParamSpec(TypedObject):
     def isLowerCase(self, val):
         return val == val.lower()
 
+    def compileValueValidator(self):
+        """
+        Return a function f(val) that gives the same result as the
+        interpreted checks in invalidParamValueReason(), with the
+        ParamSpec fields looked up once instead of on every call.
+        """
+        required = self.required
+        valueType = self.valueType
+        isValidType = getValueTypeValidator(valueType)
+        checks = []
+
+        minimum = self.minimum
+        if minimum is not None:
+            if self.strictMinimum:
+                def checkMinimum(val):
+                    if not val > minimum:
+                        return 'value %s should be strictly greater than minimum %s' % (val, repr(minimum))
+            else:
+                def checkMinimum(val):
+                    if not val >= minimum:
+                        return 'value %s should be greater than or equal to minimum %s' % (val, repr(minimum))
+            checks.append(checkMinimum)
+
+        maximum = self.maximum
+        if maximum is not None:
+            if self.strictMaximum:
+                def checkMaximum(val):
+                    if not val < maximum:
+                        return 'value %s should be strictly less than maximum %s' % (val, repr(maximum))
+            else:
+                def checkMaximum(val):
+                    if not val <= maximum:
+                        return 'value %s should be less than or equal to maximum %s' % (val, repr(maximum))
+            checks.append(checkMaximum)
+
+        enum = self.enum
+        if enum is not None:
+            def checkEnum(val):
+                if val not in enum:
+                    return 'value %s should be one of %s' % (val, repr(enum))
+            checks.append(checkEnum)
+
+        def validate(val):
+            # None is valid unless value is required, short-circuits other tests
+            if not required and val is None:
+                return None
+
+            if not isValidType(val):
+                return 'value %s should have type %s' % (val, repr(valueType))
+
+            for check in checks:
+                reason = check(val)
+                if reason is not None:
+                    return reason
+
+            return None
+
+        return validate
+
     def invalidParamValueReason(self, val):
+        if COMPILE_VALIDATORS:
+            if self._valueValidator is None:
+                self._valueValidator = self.compileValueValidator()
+            return self._valueValidator(val)
+
         # None is valid unless value is required, short-circuits other tests
         if not self.required and val is None:
             return None
@@ -645,6 +825,12 @@ class ParamSpec(TypedObject):
             logging.warning(reason)
         return reason is not None
 
+    def __getstate__(self):
+        state = super(ParamSpec, self).__getstate__()
+        # closures can't be pickled; it is rebuilt on demand
+        state['_valueValidator'] = None
+        return state
+
 
 class ClassSpec(TypedObject):
     """
@@ -750,6 +936,11 @@ class PathElement(TypedObject):
         super(PathElement, self).__init__(objDict, **kwargs)
         self.sequence = [Command(elt, **kwargs)
                          for elt in self.sequence]
+        # exporters walk the commands as DotDicts; convert them once
+        # here rather than on every export.
+        commands = self._objDict.get('commands')
+        if commands is not None:
+            self.commands = dotDict.convertToDotDictRecurse(commands)
 
 
 class Station(PathElement):
@@ -841,8 +1032,8 @@ class Plan(Document):
         super(Plan, self).__init__(objDict, **kwargs)
 
     def isValidPlanSequence(self, val):
-        validTypes = (self._schema.commandSpecsLookup.keys()
-                      + ['Station', 'Segment'])
+        validTypes = set(self._schema.commandSpecsLookup.iterkeys())
+        validTypes.update(('Station', 'Segment'))
         return all([elt.type in validTypes for elt in val])
 
 
@@ -912,14 +1103,14 @@ def loadDictFromString(s):
     """
     Load a DotDict from the JSON-format string *s*.
     """
-    return dotDict.convertToDotDictRecurse(json.loads(s))
+    return jsonCodec.loadsDotDict(s)
 
 
 def loadDictFromFile(f):
     """
     Load a DotDict from the JSON-format file *f*.
     """
-    return dotDict.convertToDotDictRecurse(json.load(f))
+    return jsonCodec.loadsDotDict(f.read())
 
 
 def loadDictFromPath(path):
@@ -945,6 +1136,50 @@ def loadDocumentFromDict(docDict, schema=None, parseOpts=None):
                              parseOpts=parseOpts)
 
 
+class InvalidElementError(Exception):
+    def __init__(self, path, error):
+        super(InvalidElementError, self).__init__(path, error)
+        self.path = path
+        self.error = error
+
+
+def transformBottomUpWithPath(obj, func, path, **kwargs):
+    """
+    Like transformBottomUp(), but reports where *func* failed by raising
+    InvalidElementError.
+    """
+    if isinstance(obj, (list, tuple)):
+        return [transformBottomUpWithPath(v, func, path + ('[%d]' % i,), **kwargs)
+                for i, v in enumerate(obj)]
+    elif isinstance(obj, (int, float, str, unicode, bool, long)) or obj is None:
+        return obj
+    else:
+        dct = dict(((k, transformBottomUpWithPath(v, func, path + ('.%s' % k,), **kwargs))
+                    for k, v in obj.iteritems()))
+        try:
+            return func(dct, **kwargs)
+        except Exception, e:
+            raise InvalidElementError(''.join(path).lstrip('.'), e)
+
+
+def getErrorPath(docDict, schema=None, parseOpts=None):
+    """
+    Return the path within *docDict* of the first element that fails to
+    load, e.g. 'sequence[3].commands[0]', '' for the document itself, or
+    None if it loads. Slower than loadDocumentFromDict(); meant for
+    explaining a failure after the fact.
+    """
+    if docDict.type == 'PlanSchema' or not schema:
+        return None
+    try:
+        transformBottomUpWithPath(docDict, decodeWithClassName, (),
+                                  schema=schema,
+                                  parseOpts=parseOpts)
+    except InvalidElementError, e:
+        return e.path
+    return None
+
+
 def loadDocument(docPath, schema=None, fillInDefaults=False):
     docDict = loadDictFromPath(docPath)
     parseOpts = ParseOpts(fillInDefaults=fillInDefaults)
@@ -955,7 +1190,7 @@ def dumpDictToString(obj):
     """
     Dump a DotDict in to the specified path in (pretty indented) JSON format.
     """
-    return json.dumps(obj, sort_keys=True, indent=4)
+    return jsonCodec.dumps(obj, sort_keys=True, indent=4)
 
 
 def dumpDictToPath(path, obj):
@@ -984,6 +1219,85 @@ def dumpDocumentToPath(path, doc):
     dumpDictToPath(path, docDict)
 
 
+def getSnapshotPath(docPath):
+    """
+    Return the path where the snapshot for the JSON document at *docPath* lives.
+    """
+    return os.path.splitext(docPath)[0] + SNAPSHOT_EXTENSION
+
+
+def getContentHash(paths):
+    h = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def reduceDotDict(d):
+    # DotDict.__getattr__ answers None for any missing attribute, so
+    # pickle's own lookups of __getnewargs__ and __getstate__ find None
+    # and fail; pickle the contents as a plain dict instead.
+    return (DotDict, (dict(d),))
+
+copy_reg.pickle(DotDict, reduceDotDict)
+
+
+def dumpSnapshotToPath(path, sourcePaths, docs):
+    """
+    Pickle *docs* (usually a dict of loaded Documents) to *path* so
+    loadSnapshotFromPath() can skip parsing and validation. The snapshot
+    is keyed by a hash of the files at *sourcePaths* and by
+    SNAPSHOT_VERSION.
+    """
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'sourcePaths': list(sourcePaths),
+        'sourceHash': getContentHash(sourcePaths),
+    }
+    # write to a temp file and rename, so readers never see a partial snapshot
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(docs, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmpPath, path)
+
+
+def loadSnapshotFromPath(path):
+    """
+    Return the docs pickled by dumpSnapshotToPath(), or None if the
+    snapshot is missing, was written by a different SNAPSHOT_VERSION, or
+    any of its source files have changed since it was written.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+            if header.get('version') != SNAPSHOT_VERSION:
+                return None
+            if getContentHash(header['sourcePaths']) != header['sourceHash']:
+                return None
+            return pickle.load(f)
+    except Exception:  # pylint: disable=W0703
+        logging.warning('could not load XPJSON snapshot from %s', path)
+        return None
+
+
+# callers can change this global.
+CRS_TRANSFORM_CACHE_SIZE = 32
+
+
+def asCoordinateArray(v):
+    """
+    Return *v* unchanged if it is a scalar or array, or as a float array
+    if it is a list or tuple, so the transforms can do arithmetic on it.
+    """
+    if isinstance(v, (list, tuple)):
+        return numpy.asarray(v, dtype=float)
+    return v
+
+
 def getCrsTransformRoversw(crs):
     """
     xform = getCrsTransform(crs)
@@ -998,11 +1312,11 @@ def getCrsTransformRoversw(crs):
     y0 = crs['properties']['originNorthing']
 
     def xform(coords, inverse=False):
+        a, b = [asCoordinateArray(v) for v in coords]
         if inverse:
-            x, y = coords
-            outX, outY = proj(x + x0, y + y0, inverse=True)
+            outX, outY = proj(a + x0, b + y0, inverse=True)
         else:
-            x, y = proj(*coords, inverse=False)
+            x, y = proj(a, b, inverse=False)
             outX, outY = x - x0, y - y0
         return outY, outX
 
@@ -1037,28 +1351,25 @@ def getCrsTransformProj4(crs):
         y0 = float(match.group(1))
         projString = re.sub(Y_REGEX, '', projString)
     else:
-        x0 = 0
+        y0 = 0
 
     proj = pyproj.Proj(str(projString))
 
     def xform(coords, inverse=False):
+        a, b = [asCoordinateArray(v) for v in coords]
         if inverse:
-            x, y = coords
-            outX, outY = proj(x + x0, y + y0, inverse=True)
+            outX, outY = proj(a + x0, b + y0, inverse=True)
         else:
-            x, y = proj(*coords, inverse=False)
+            x, y = proj(a, b, inverse=False)
             outX, outY = x - x0, y - y0
         return outY, outX  # HACK this is kn-specific
 
     return xform
 
 
-def getCrsTransform(crs):
+def makeCrsTransform(crs):
     """
-    xform = getCrsTransform(crs)
-    # x, y in crs coordinates. x, y, lon, lat may be scalars or iterables.
-    x, y = xform(lon, lat)
-    lon, lat = xform(x, y, inverse=True)
+    Build a new transform for *crs*; see getCrsTransform().
     """
     t = crs['type']
     if t == 'proj4':
@@ -1067,3 +1378,83 @@ def getCrsTransform(crs):
         return getCrsTransformRoversw(crs)
     else:
         assert False, 'crs type should be "proj4" or "roversw"'
+
+
+def getCrsKey(crs):
+    """
+    Return a hashable key for *crs* that is the same for equal CRS
+    objects, whatever their dict ordering.
+    """
+    return json.dumps(crs, sort_keys=True)
+
+
+class CrsTransformCache(object):
+    """
+    LRU cache of the transforms built by makeCrsTransform(), holding at
+    most CRS_TRANSFORM_CACHE_SIZE of them. Safe to share across threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.transforms = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, crs):
+        key = getCrsKey(crs)
+        with self.lock:
+            xform = self.transforms.pop(key, None)
+            if xform is not None:
+                self.hits += 1
+                self.transforms[key] = xform
+                return xform
+
+        # build outside the lock; if two threads race, both results are
+        # equivalent and the second one wins
+        xform = makeCrsTransform(crs)
+        with self.lock:
+            self.misses += 1
+            self.transforms[key] = xform
+            while len(self.transforms) > CRS_TRANSFORM_CACHE_SIZE:
+                self.transforms.popitem(last=False)
+        return xform
+
+    def clear(self):
+        with self.lock:
+            self.transforms.clear()
+
+    def getStats(self):
+        with self.lock:
+            return {'size': len(self.transforms),
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+CRS_TRANSFORM_CACHE = CrsTransformCache()
+
+
+def getCrsTransform(crs):
+    """
+    xform = getCrsTransform(crs)
+    # x, y in crs coordinates. x, y, lon, lat may be scalars, lists or
+    # numpy arrays; pass arrays to convert many points in one call.
+    x, y = xform((lon, lat))
+    lon, lat = xform((x, y), inverse=True)
+
+    Transforms are cached by CRS, so calling this for every export is
+    cheap.
+    """
+    return CRS_TRANSFORM_CACHE.get(crs)
+
+
+def transformPoints(xform, points, inverse=False):
+    """
+    Convert a list of [a, b] *points* with *xform* in one vectorized
+    call, and return the results as a list of [a, b] lists. Any extra
+    ordinates (e.g. altitude) are dropped.
+    """
+    if not len(points):
+        return []
+    arr = numpy.asarray([p[:2] for p in points], dtype=float)
+    a, b = xform((arr[:, 0], arr[:, 1]), inverse=inverse)
+    return numpy.column_stack((a, b)).tolist()
@@ -21,8 +21,14 @@ Test xpjson.py.
 
 import unittest
 import os
+import json
+import cPickle as pickle
+import shutil
+import tempfile
 
-from xgds_planner2 import xpjson
+from geocamUtil.dotDict import DotDict
+
+from xgds_planner2 import bulkValidate, jsonCodec, xpjson
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 SCHEMA_PATH = os.path.join(THIS_DIR, 'xpjsonSpec', 'examplePlanSchema.json')
@@ -42,6 +48,152 @@ class XpjsonTest(unittest.TestCase):
         schema = xpjson.loadDocument(SCHEMA_PATH)
         _library = xpjson.loadDocument(LIBRARY_PATH, schema=schema)
 
+    def test_compiled_validators(self):
+        cases = [
+            ('string', u'abc'), ('string', 3),
+            ('integer', 3), ('long', 3.5),
+            ('number', 3.5), ('double', 'x'),
+            ('boolean', True), ('boolean', 1),
+            ('date-time', '2012-03-01T10:05:07Z'), ('date-time', '2012-03-01T10:05:07'),
+            ('array.number', [1, 2.5]), ('array.number', [1, 'a']),
+            ('array[2].integer', [1, 2]), ('array[2].integer', [1, 2, 3]),
+            ('bbox', [0, 0, 1, 1]), ('bbox', [0, 0, 1]),
+            ('quaternion', [0, 0, 0, 1]), ('quaternion', [0, 0, 1]),
+            ('url', 'http://example.com'),
+            ('ParamSpec', {'type': 'ParamSpec'}), ('ParamSpec', {'type': 'Site'}),
+        ]
+        try:
+            for valueType, val in cases:
+                xpjson.COMPILE_VALIDATORS = False
+                expected = xpjson.isValueOfType(val, valueType)
+                xpjson.COMPILE_VALIDATORS = True
+                self.assertEqual(xpjson.isValueOfType(val, valueType), expected,
+                                 '%s %s' % (valueType, val))
+        finally:
+            xpjson.COMPILE_VALIDATORS = True
+
+    def test_spec_inheritance(self):
+        specs = [DotDict({'id': 'C', 'parent': 'B', 'params': [DotDict({'id': 'z'})]}),
+                 DotDict({'id': 'B', 'parent': 'A', 'name': 'b', 'params': [DotDict({'id': 'y'})]}),
+                 DotDict({'id': 'A', 'color': 'red', 'params': [DotDict({'id': 'x'})]})]
+        lookup = xpjson.resolveSpecInheritance(specs,
+                                               inheritFields=('params',),
+                                               localOnlyFields=('id', 'name'))
+        self.assertEqual(lookup['C'].color, 'red')
+        self.assertNotIn('name', lookup['C'])
+        self.assertEqual([p.id for p in lookup['C'].params], ['x', 'y', 'z'])
+
+    def test_spec_inheritance_errors(self):
+        missing = [DotDict({'id': 'A', 'parent': 'nope'})]
+        self.assertRaises(xpjson.UnknownParentError,
+                          xpjson.resolveSpecInheritance, missing)
+        cycle = [DotDict({'id': 'A', 'parent': 'B'}),
+                 DotDict({'id': 'B', 'parent': 'A'})]
+        self.assertRaises(xpjson.CyclicInheritanceError,
+                          xpjson.resolveSpecInheritance, cycle)
+
+    def test_snapshot(self):
+        tmpDir = tempfile.mkdtemp()
+        # geocamUtil's DotDict answers None for any missing attribute,
+        # dunders included; make sure that is what we pickle against
+        originalGetattr = DotDict.__dict__.get('__getattr__')
+        DotDict.__getattr__ = lambda self, attr: self.get(attr, None)
+        try:
+            schemaPath = os.path.join(tmpDir, 'schema.json')
+            shutil.copy(SCHEMA_PATH, schemaPath)
+            schema = xpjson.loadDocument(schemaPath)
+            # as PlanSchema.writeSnapshot() loads it, which fills in DotDicts
+            library = xpjson.loadDocument(LIBRARY_PATH, schema=schema, fillInDefaults=True)
+
+            snapshotPath = xpjson.getSnapshotPath(schemaPath)
+            xpjson.dumpSnapshotToPath(snapshotPath, [schemaPath],
+                                      {'schema': schema, 'library': library})
+            docs = xpjson.loadSnapshotFromPath(snapshotPath)
+            self.assertEqual(sorted(docs['schema'].commandSpecsLookup.keys()),
+                             sorted(schema.commandSpecsLookup.keys()))
+            self.assertIs(docs['library']._schema, docs['schema'])
+            self.assertIsInstance(pickle.loads(pickle.dumps(DotDict(a=DotDict(b=1)), 0)).a, DotDict)
+
+            # changing a source file makes the snapshot stale
+            with open(schemaPath, 'a') as f:
+                f.write('\n')
+            self.assertIsNone(xpjson.loadSnapshotFromPath(snapshotPath))
+        finally:
+            if originalGetattr is None:
+                del DotDict.__getattr__
+            else:
+                DotDict.__getattr__ = originalGetattr
+            shutil.rmtree(tmpDir)
+
+    def test_crs_transform_cache(self):
+        library = xpjson.loadDictFromPath(LIBRARY_PATH)
+        crs = library.sites[0].alternateCrs
+        xform = xpjson.getCrsTransform(crs)
+        # an equal CRS built with a different key order shares the transform
+        reordered = DotDict(reversed(crs.items()))
+        self.assertIs(xpjson.getCrsTransform(reordered), xform)
+
+        points = [[-122.065, 37.42], [-122.064, 37.419], [-122.0655, 37.4201, 10.0]]
+        batched = xpjson.transformPoints(xform, points)
+        for point, converted in zip(points, batched):
+            expected = xform(point[:2])
+            self.assertAlmostEqual(converted[0], expected[0])
+            self.assertAlmostEqual(converted[1], expected[1])
+        self.assertEqual(xpjson.transformPoints(xform, []), [])
+
+        oldSize = xpjson.CRS_TRANSFORM_CACHE_SIZE
+        try:
+            xpjson.CRS_TRANSFORM_CACHE_SIZE = 1
+            other = DotDict(crs, properties=DotDict(crs.properties, zone=11))
+            xpjson.getCrsTransform(other)
+            self.assertIsNot(xpjson.getCrsTransform(crs), xform)
+        finally:
+            xpjson.CRS_TRANSFORM_CACHE_SIZE = oldSize
+
+    def test_bulk_validate(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            with open(PLAN_PATH) as f:
+                planDict = json.load(f)
+            planDict['sequence'][1]['tolerance'] = 'wide'
+            badPath = os.path.join(tmpDir, 'bad.json')
+            with open(badPath, 'w') as f:
+                json.dump(planDict, f)
+            shutil.copy(PLAN_PATH, os.path.join(tmpDir, 'good.json'))
+
+            schema = xpjson.loadDocument(SCHEMA_PATH)
+            paths = bulkValidate.collectDocumentPaths([tmpDir])
+            self.assertEqual([os.path.basename(p) for p in paths], ['bad.json', 'good.json'])
+            bad, good = list(bulkValidate.iterValidateDocuments(paths, schema, processes=2))
+            self.assertTrue(good['valid'])
+            self.assertEqual(good['type'], 'Plan')
+            self.assertFalse(bad['valid'])
+            self.assertEqual(bad['errorPath'], 'sequence[1]')
+            self.assertIn('tolerance', bad['error'])
+            # 0 validates in this process, like bulkImport and bulkExport
+            self.assertEqual([r['valid'] for r in bulkValidate.iterValidateDocuments(paths, schema, processes=0)],
+                             [False, True])
+            noSchema = bulkValidate.validateDocument(paths[1], None)
+            self.assertTrue(noSchema['needsSchema'])
+            self.assertEqual(noSchema['type'], 'Plan')
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def test_json_codec(self):
+        text = '{"a": [{"b": 1.25}], "c": "d/e"}'
+        for name in ('json', 'simplejson', 'ujson'):
+            try:
+                codec = jsonCodec.CODEC_CLASSES[name]()
+            except ImportError:
+                continue
+            loaded = codec.loadsDotDict(text)
+            self.assertIsInstance(loaded.a[0], DotDict)
+            self.assertEqual(loaded.a[0].b, 1.25)
+            self.assertEqual(json.loads(codec.dumps(loaded, sort_keys=True)), json.loads(text))
+        # pretty output is the same whatever the codec
+        self.assertEqual(jsonCodec.dumps({'a': 1}, indent=4), json.dumps({'a': 1}, indent=4))
+        self.assertRaises(ValueError, jsonCodec.setCodec, 'nope')
+
 
 if __name__ == '__main__':
     unittest.main()